@@ -0,0 +1,259 @@
+"""
+This module benchmarks the habit database on synthetic data.
+
+It generates databases with a configurable number of habits, log density and
+share of weekly habits, times the main operations at several scales and
+writes the results as JSON. Given the results of an earlier run as a
+baseline, it exits with status 1 if any operation got slower than the
+allowed threshold.
+
+Example:
+    python benchmark.py --scales 100 1000 10000 --output results.json
+    python benchmark.py --baseline results.json --threshold 0.2
+    python benchmark.py --scales 10000 --startup
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from db import Database, habit_to_dict
+from habits_class import Habit
+
+END_DATE = datetime(2024, 12, 31)
+MAIN_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+
+def generate_habits(count, days=365, density=0.8, weekly_share=0.3, seed=0):
+    """
+    Generates habits with random completion logs.
+
+    Args:
+        count (int): Number of habits.
+        days (int): Length of the history, ending on END_DATE.
+        density (float): Probability that a period is completed.
+        weekly_share (float): Share of weekly habits.
+        seed (int): Seed of the random generator, for reproducible data.
+
+    Returns:
+        list: List of Habit objects.
+    """
+    rng = random.Random(seed)
+    start_date = END_DATE - timedelta(days=days - 1)
+    habits = []
+    for index in range(count):
+        periodicity = "weekly" if rng.random() < weekly_share else "daily"
+        step = 7 if periodicity == "weekly" else 1
+        log = []
+        for offset in range(0, days - step + 1, step):
+            if rng.random() < density:
+                log.append(start_date + timedelta(days=offset + rng.randrange(step), minutes=rng.randrange(1440)))
+        habits.append(Habit(f"Habit {index}", start_date, log, periodicity))
+    return habits
+
+def generate_database(db_file, count, **kwargs):
+    """
+    Writes a synthetic JSON database.
+
+    Args:
+        db_file (str): The path to the file to write.
+        count (int): Number of habits.
+        **kwargs: Options for generate_habits.
+    """
+    with open(db_file, "w") as file:
+        json.dump([habit_to_dict(habit) for habit in generate_habits(count, **kwargs)], file, indent=4)
+
+def best_time(function, repeat):
+    """
+    Runs a function several times and returns the fastest run.
+
+    Args:
+        function (callable): Function to time. Called without arguments.
+        repeat (int): Number of runs.
+
+    Returns:
+        float: Seconds taken by the fastest run.
+    """
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+def benchmark_scale(db_file, repeat=3, **options):
+    """
+    Times the database operations on one database file.
+
+    Whole-database operations are reported in seconds per call; get_habit,
+    log_entry and calculate_streak in seconds per habit.
+
+    Args:
+        db_file (str): The path to the database to benchmark.
+        repeat (int): Number of runs; the fastest one is reported.
+        **options: Options for Database.
+
+    Returns:
+        dict: Seconds by operation name.
+    """
+    db = Database(db_file, **options)
+    names = [habit.name for habit in db.get_all_habits()]
+    count = max(len(names), 1)
+    fresh = []
+
+    def reload():
+        fresh[:] = Database(db_file, **options).get_all_habits()
+
+    def log_entries():
+        for habit in fresh:
+            habit.log_entry(END_DATE + timedelta(days=1))
+
+    def streaks():
+        for habit in fresh:
+            habit.calculate_streak()
+
+    results = {
+        'load_db': best_time(db.load_db, repeat),
+        'save_db': best_time(db.save_db, repeat),
+        'get_habit': best_time(lambda: [db.get_habit(name) for name in names], repeat) / count,
+        'get_longest_streak_all_habits': best_time(db.get_longest_streak_all_habits, repeat)
+    }
+    timings = {'log_entry': [], 'calculate_streak': []}
+    for _ in range(repeat):
+        reload()
+        timings['calculate_streak'].append(best_time(streaks, 1))
+        timings['log_entry'].append(best_time(log_entries, 1))
+    for operation, values in timings.items():
+        results[operation] = min(values) / count
+    db.close()
+    return results
+
+def benchmark_startup(db_file, repeat=3):
+    """
+    Times cold starts of the command line tool on one database file.
+
+    Every run is a fresh interpreter, so the timings include the imports. They
+    are set against the bare interpreter start, the imports of main.py alone
+    and a full json.load of the database, which the subcommands should not
+    need.
+
+    Args:
+        db_file (str): The path to the database to benchmark.
+        repeat (int): Number of runs; the fastest one is reported.
+
+    Returns:
+        dict: Seconds by measurement name.
+    """
+    with open(db_file, "r") as file:
+        name = json.load(file)[0]['name']
+    cwd = os.path.dirname(MAIN_SCRIPT)
+
+    def command(*args):
+        return lambda: subprocess.run([sys.executable, *args], cwd=cwd, check=True, stdout=subprocess.DEVNULL)
+
+    def parse():
+        with open(db_file, "r") as file:
+            json.load(file)
+
+    log_date = (END_DATE + timedelta(days=1)).strftime("%Y-%m-%d")
+    return {
+        'startup_interpreter': best_time(command("-c", "pass"), repeat),
+        'startup_imports': best_time(command("-c", "import main"), repeat),
+        'startup_streak': best_time(command(MAIN_SCRIPT, "--db", db_file, "streak", name), repeat),
+        'startup_log': best_time(command(MAIN_SCRIPT, "--db", db_file, "log", name, log_date), repeat),
+        'full_json_parse': best_time(parse, repeat)
+    }
+
+def run_benchmarks(scales, repeat=3, days=365, density=0.8, weekly_share=0.3, seed=0, startup=False, **options):
+    """
+    Generates a database for every scale and benchmarks it.
+
+    Args:
+        scales (list): Habit counts to benchmark.
+        repeat (int): Number of runs per operation.
+        days (int): Length of the generated histories.
+        density (float): Probability that a period is completed.
+        weekly_share (float): Share of weekly habits.
+        seed (int): Seed of the random generator.
+        startup (bool): Also time cold starts of the command line tool.
+        **options: Options for Database.
+
+    Returns:
+        dict: The benchmark parameters and the seconds by operation for
+        every scale.
+    """
+    tmp_dir = tempfile.mkdtemp()
+    results = {}
+    try:
+        for scale in scales:
+            db_file = os.path.join(tmp_dir, f"bench_{scale}.json")
+            generate_database(db_file, scale, days=days, density=density, weekly_share=weekly_share, seed=seed)
+            results[str(scale)] = benchmark_scale(db_file, repeat, **options)
+            if startup:
+                results[str(scale)].update(benchmark_startup(db_file, repeat))
+    finally:
+        shutil.rmtree(tmp_dir)
+    return {
+        'python': platform.python_version(),
+        'parameters': {'days': days, 'density': density, 'weekly_share': weekly_share, 'seed': seed,
+                       'repeat': repeat, 'options': options},
+        'results': results
+    }
+
+def find_regressions(report, baseline, threshold):
+    """
+    Compares benchmark results with a baseline.
+
+    Args:
+        report (dict): Results of run_benchmarks.
+        baseline (dict): Earlier results of run_benchmarks.
+        threshold (float): Allowed slowdown, e.g. 0.2 for 20 percent.
+
+    Returns:
+        list: (scale, operation, baseline seconds, seconds) of every
+        operation that got slower than allowed.
+    """
+    regressions = []
+    for scale, timings in report['results'].items():
+        for operation, seconds in timings.items():
+            previous = baseline['results'].get(scale, {}).get(operation)
+            if previous is not None and seconds > previous * (1 + threshold):
+                regressions.append((scale, operation, previous, seconds))
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the habit database on synthetic data.")
+    parser.add_argument("--scales", type=int, nargs="+", default=[100, 1000, 10000], help="habit counts")
+    parser.add_argument("--days", type=int, default=365, help="length of the generated histories")
+    parser.add_argument("--density", type=float, default=0.8, help="probability that a period is completed")
+    parser.add_argument("--weekly-share", type=float, default=0.3, help="share of weekly habits")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random generator")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per operation")
+    parser.add_argument("--compact-logs", action="store_true", help="benchmark with compact logs")
+    parser.add_argument("--lazy", action="store_true", help="benchmark with lazy loading")
+    parser.add_argument("--startup", action="store_true", help="also time cold starts of main.py subcommands")
+    parser.add_argument("--output", help="file to write the JSON results to (default: stdout)")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown against the baseline")
+    args = parser.parse_args()
+    report = run_benchmarks(args.scales, args.repeat, args.days, args.density, args.weekly_share, args.seed,
+                            args.startup, compact_logs=args.compact_logs, lazy=args.lazy)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=4)
+    else:
+        print(json.dumps(report, indent=4))
+    if args.baseline:
+        with open(args.baseline, "r") as file:
+            regressions = find_regressions(report, json.load(file), args.threshold)
+        for scale, operation, previous, seconds in regressions:
+            print(f"Regression at {scale} habits: {operation} took {seconds:.3g}s, baseline {previous:.3g}s.",
+                  file=sys.stderr)
+        if regressions:
+            sys.exit(1)
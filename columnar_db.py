@@ -0,0 +1,175 @@
+"""
+This module provides a binary columnar file format for the habit database.
+
+A columnar file starts with a fixed header, followed by JSON metadata for
+each habit and one contiguous little-endian int64 column holding the epoch
+seconds of every completion, habit after habit:
+
+    b"HBTC" | version (uint32) | metadata length (uint64) | metadata | padding | column
+
+Loading memory-maps the file and hands out zero-copy views of the column,
+so opening a large database neither parses nor copies the completion logs.
+"""
+
+import argparse
+import json
+import mmap
+import struct
+import sys
+from array import array
+from habits_class import CompactLog, Habit, format_timestamp, from_timestamp, parse_timestamp, to_timestamp
+
+COLUMNAR_EXTENSION = ".hbt"
+MAGIC = b"HBTC"
+VERSION = 1
+HEADER = struct.Struct("<4sIQ")
+
+def is_columnar_file(db_file):
+    """
+    Tells whether a database file uses the columnar format.
+
+    Args:
+        db_file (str): The path to the database file.
+
+    Returns:
+        bool: True if the file has the columnar extension.
+    """
+    return db_file.endswith(COLUMNAR_EXTENSION)
+
+def save_columnar(db_file, habits):
+    """
+    Writes habits to a columnar file.
+
+    Args:
+        db_file (str): The path to the file to write.
+        habits (list): List of Habit objects.
+    """
+    columns = [_timestamps(habit) for habit in habits]
+    metadata, offset = [], 0
+    for habit, column in zip(habits, columns):
+        item = {
+            'name': habit.name,
+            'start_date': format_timestamp(habit.start_date),
+            'periodicity': habit.periodicity,
+            'summary': habit.summary(),
+            'offset': offset,
+            'count': len(column)
+        }
+        if habit.timezone is not None:
+            item['timezone'] = habit.timezone
+        if habit.day_cutoff:
+            item['day_cutoff'] = habit.day_cutoff
+        metadata.append(item)
+        offset += len(column)
+    encoded = json.dumps(metadata).encode("utf-8")
+    padding = -(HEADER.size + len(encoded)) % 8
+    with open(db_file, "wb") as file:
+        file.write(HEADER.pack(MAGIC, VERSION, len(encoded)))
+        file.write(encoded)
+        file.write(b"\0" * padding)
+        for column in columns:
+            if sys.byteorder == "big":
+                column = array('q', column)
+                column.byteswap()
+            file.write(column)
+
+def load_columnar(db_file, compact_logs=False, lazy=False):
+    """
+    Loads habits from a columnar file.
+
+    Args:
+        db_file (str): The path to the file to read.
+        compact_logs (bool): Return CompactLogs viewing the mapped file
+            instead of lists of datetimes.
+        lazy (bool): Convert each log to datetimes on first access.
+
+    Returns:
+        list: List of Habit objects.
+
+    Raises:
+        ValueError: If the file is not a columnar habit database.
+    """
+    with open(db_file, "rb") as file:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, length = HEADER.unpack_from(mapped)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{db_file} is not a columnar habit database.")
+    metadata = json.loads(mapped[HEADER.size:HEADER.size + length])
+    start = HEADER.size + length
+    start += -start % 8
+    column = memoryview(mapped)[start:].cast("q")
+    if sys.byteorder == "big":
+        column = array('q', column)
+        column.byteswap()
+    habits = []
+    for item in metadata:
+        timestamps = column[item['offset']:item['offset'] + item['count']]
+        summary = item.get('summary')
+        settings = {'timezone': item.get('timezone'), 'day_cutoff': item.get('day_cutoff', 0)}
+        if compact_logs:
+            habits.append(Habit(item['name'], parse_timestamp(item['start_date']),
+                                CompactLog.from_timestamps(timestamps), item['periodicity'], summary, **settings))
+        elif lazy:
+            habits.append(Habit.lazy(item['name'], parse_timestamp(item['start_date']),
+                                     _log_loader(timestamps), item['periodicity'], summary, **settings))
+        else:
+            habits.append(Habit(item['name'], parse_timestamp(item['start_date']),
+                                [from_timestamp(timestamp) for timestamp in timestamps], item['periodicity'], summary,
+                                **settings))
+    return habits
+
+def convert(source_file, target_file):
+    """
+    Converts a database between the JSON and the columnar format.
+
+    The format of each file is chosen by its extension.
+
+    Args:
+        source_file (str): The path to the database to read.
+        target_file (str): The path to the database to write.
+
+    Returns:
+        int: Number of converted habits.
+    """
+    from db import Database, habit_to_dict
+    habits = Database(source_file, compact_logs=True).get_all_habits()
+    if is_columnar_file(target_file):
+        save_columnar(target_file, habits)
+    else:
+        with open(target_file, "w") as file:
+            json.dump([habit_to_dict(habit) for habit in habits], file, indent=4)
+    return len(habits)
+
+def _timestamps(habit):
+    """
+    Returns the completion log of a habit as int64 epoch seconds.
+
+    Args:
+        habit (Habit): Habit whose log to convert.
+
+    Returns:
+        array: The epoch seconds, or the CompactLog's own buffer.
+    """
+    if isinstance(habit.log, CompactLog):
+        return habit.log.timestamps
+    return array('q', (to_timestamp(log_datetime) for log_datetime in habit.log))
+
+def _log_loader(timestamps):
+    """
+    Returns a function converting mapped epoch seconds to datetimes.
+
+    Args:
+        timestamps (memoryview): Epoch seconds of one habit.
+
+    Returns:
+        callable: Function returning the completion log.
+    """
+    return lambda: [from_timestamp(timestamp) for timestamp in timestamps]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a habit database between JSON and columnar format.")
+    parser.add_argument("source_file", help="database to read (.json or " + COLUMNAR_EXTENSION + ")")
+    parser.add_argument("target_file", help="database to write (.json or " + COLUMNAR_EXTENSION + ")")
+    args = parser.parse_args()
+    count = convert(args.source_file, args.target_file)
+    print(f"Converted {count} habits into {args.target_file}.")
@@ -0,0 +1,172 @@
+"""
+This module provides the CompletionIndex class, a secondary index from time
+buckets to the habits completed in them.
+
+Buckets are day numbers (days since 1970-01-01) and ISO week numbers as used
+by the streaks module, so calendar and heatmap queries look up a handful of
+buckets instead of scanning every habit's log. Completions are bucketed by
+the local day of their habit's timezone and day cutoff.
+"""
+
+from datetime import date, datetime, timedelta
+from streaks import EPOCH_ORDINAL, EPOCH_WEEKDAY, habit_days, period_number
+
+def day_number(day):
+    """
+    Converts a date or datetime into its day number.
+
+    Args:
+        day (date): Date or datetime to convert.
+
+    Returns:
+        int: Days since 1970-01-01.
+    """
+    if isinstance(day, datetime):
+        day = day.date()
+    return day.toordinal() - EPOCH_ORDINAL
+
+def iso_week_days(year, week):
+    """
+    Returns the first and last day of an ISO week.
+
+    Args:
+        year (int): ISO year.
+        week (int): ISO week number.
+
+    Returns:
+        tuple: Monday and Sunday of the week as dates.
+    """
+    monday = date.fromisocalendar(year, week, 1)
+    return monday, monday + timedelta(days=6)
+
+class CompletionIndex:
+    """
+    Maps day and ISO week buckets to the names of the habits completed in them.
+    """
+
+    def __init__(self, habits=()):
+        """
+        Builds the index from habits.
+
+        Args:
+            habits (iterable): Habit objects to index. Their logs are read.
+        """
+        self.by_day = {}
+        self.by_week = {}
+        for habit in habits:
+            self.add_habit(habit)
+
+    def add_habit(self, habit):
+        """
+        Indexes every completion of a habit.
+
+        Args:
+            habit (Habit): Habit to index.
+        """
+        for day in set(habit_days(habit)):
+            self._add(habit.name, day)
+
+    def remove_habit(self, habit):
+        """
+        Removes a habit from every bucket it was completed in.
+
+        Args:
+            habit (Habit): Habit to remove, with its log as it was indexed.
+        """
+        for day in set(habit_days(habit)):
+            for buckets, bucket in ((self.by_day, day), (self.by_week, period_number(day, 'weekly'))):
+                names = buckets.get(bucket)
+                if names is not None:
+                    names.discard(habit.name)
+                    if not names:
+                        del buckets[bucket]
+
+    def add_entries(self, habit, log_datetimes):
+        """
+        Indexes new completions of a habit.
+
+        Args:
+            habit (Habit): The habit.
+            log_datetimes (iterable): Logged datetimes, in the stored form.
+        """
+        for day in set(map(habit.day_number, log_datetimes)):
+            self._add(habit.name, day)
+
+    def names_on(self, day):
+        """
+        Returns the habits completed on a day.
+
+        Args:
+            day (date): Day to look up.
+
+        Returns:
+            set: Names of the habits.
+        """
+        return set(self.by_day.get(day_number(day), ()))
+
+    def names_in_week(self, year, week):
+        """
+        Returns the habits completed in an ISO week.
+
+        Args:
+            year (int): ISO year.
+            week (int): ISO week number.
+
+        Returns:
+            set: Names of the habits.
+        """
+        monday, _ = iso_week_days(year, week)
+        return set(self.by_week.get(period_number(day_number(monday), 'weekly'), ()))
+
+    def names_between(self, start, end):
+        """
+        Returns the habits completed between two days.
+
+        Whole ISO weeks inside the range are answered from their week bucket.
+
+        Args:
+            start (date): First day, inclusive.
+            end (date): Last day, inclusive.
+
+        Returns:
+            set: Names of the habits.
+        """
+        day, last = day_number(start), day_number(end)
+        buckets = []
+        while day <= last:
+            if (day + EPOCH_WEEKDAY) % 7 == 0 and day + 6 <= last:
+                buckets.append(self.by_week.get(period_number(day, 'weekly'), ()))
+                day += 7
+            else:
+                buckets.append(self.by_day.get(day, ()))
+                day += 1
+        return set().union(*buckets)
+
+    def counts_between(self, start, end):
+        """
+        Counts the habits completed on every day between two days.
+
+        Args:
+            start (date): First day, inclusive.
+            end (date): Last day, inclusive.
+
+        Returns:
+            dict: Number of completed habits by date, for every day in the range.
+        """
+        first = day_number(start)
+        start_date = date.fromordinal(first + EPOCH_ORDINAL)
+        return {
+            start_date + timedelta(days=offset): len(self.by_day.get(first + offset, ()))
+            for offset in range(day_number(end) - first + 1)
+        }
+
+    def _add(self, name, day):
+        """
+        Adds a habit to the buckets of a day.
+
+        Args:
+            name (str): Name of the habit.
+            day (int): Day number of the completion.
+        """
+        self.by_day.setdefault(day, set()).add(name)
+        self.by_week.setdefault(period_number(day, 'weekly'), set()).add(name)
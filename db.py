@@ -2,61 +2,1225 @@
 This module provides the Database class for managing habits stored in a JSON file.
 """
 
+import atexit
 import json
-from habits_class import Habit
-from datetime import datetime
+import mmap
+import os
+import re
+import shutil
+import tempfile
+import threading
+import weakref
+from contextlib import contextmanager
+from habits_class import CompactLog, Habit, format_timestamp, from_timestamp, parse_timestamp, to_timestamp
+from columnar_db import is_columnar_file, load_columnar, save_columnar
+from completion_index import CompletionIndex
+from streaks import longest_streak, longest_streaks
+
+_DECODER = json.JSONDecoder()
+_WHITESPACE = re.compile(r'\s*')
+_NAME_KEY = re.compile(rb'\{\s*"name"\s*:\s*\Z')
+_NAME_FIRST = re.compile(rb'\s*\[\s*(?:\]|\{\s*"name"\s*:)')
+_BYTES_WHITESPACE = re.compile(rb'\s*')
+_BYTES_KEY = re.compile(rb'"(?:[^"\\]|\\.)*"')
+_RELEASE_BLOCK = 1 << 20
+COMPACT_AFTER = 1 << 20
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+@contextmanager
+def file_lock(lock_file, shared=False):
+    """
+    Holds an advisory lock on a file for the duration of a block.
+
+    The lock is shared between processes, so it serializes every
+    read-modify-write of the same database. An exclusive lock creates the
+    lock file. A shared lock for reading does not: if the file is missing or
+    cannot be opened, e.g. in a read-only directory, nothing has ever been
+    written under the lock and the block runs unlocked.
+
+    Args:
+        lock_file (str): The path to the lock file.
+        shared (bool): Take a shared lock for reading.
+    """
+    try:
+        file = open(lock_file, "r" if shared else "a+")
+    except OSError:
+        if not shared:
+            raise
+        yield
+        return
+    with file:
+        if fcntl is not None:
+            fcntl.flock(file.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        else:
+            file.seek(0)
+            msvcrt.locking(file.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(file.fileno(), fcntl.LOCK_UN)
+            else:
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+
+def file_state(path):
+    """
+    Returns a fingerprint of a file that changes whenever it is rewritten.
+
+    Args:
+        path (str): The path to the file.
+
+    Returns:
+        tuple: Inode, size and modification time, or None if the file is missing.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+def habit_to_dict(habit, timestamp_format="text"):
+    """
+    Converts a habit into its JSON representation.
+
+    The materialized summary is written before the log, so that lazy loading
+    finds it without scanning the log array. The timezone and day cutoff are
+    only written if they are set, and logs of habits with a timezone hold
+    UTC timestamps.
+
+    Args:
+        habit (Habit): Habit to convert.
+        timestamp_format (str): 'text' for 'YYYY-MM-DD HH:MM:SS' strings or
+            'epoch' for integer epoch seconds in the log.
+
+    Returns:
+        dict: JSON-serializable representation of the habit.
+    """
+    if timestamp_format == "epoch":
+        if isinstance(habit.log, CompactLog):
+            log = habit.log.timestamps.tolist()
+        else:
+            log = [to_timestamp(log_datetime) for log_datetime in habit.log]
+    else:
+        log = [format_timestamp(log_datetime) for log_datetime in habit.log]
+    summary = habit.summary()
+    item = {
+        'name': habit.name,
+        'start_date': format_timestamp(habit.start_date),
+        'periodicity': habit.periodicity
+    }
+    if habit.timezone is not None:
+        item['timezone'] = habit.timezone
+    if habit.day_cutoff:
+        item['day_cutoff'] = habit.day_cutoff
+    item['summary'] = dict(summary, weekly_counts=dict(summary['weekly_counts']))
+    item['log'] = log
+    return item
+
+def habit_fragment(habit, timestamp_format="text", cache=True):
+    """
+    Returns the JSON text of a habit as an element of the database list.
+
+    The text is cached on the habit until its log changes, so saving only
+    serializes the habits changed since they were last read or written.
+
+    Args:
+        habit (Habit): Habit to serialize.
+        timestamp_format (str): 'text' or 'epoch', as for habit_to_dict.
+        cache (bool): Keep newly serialized text on the habit.
+
+    Returns:
+        tuple: A string, or the bytes of a memory-mapped snapshot, and the
+        (start, end) slice of it holding the habit object, without the
+        indentation of its first line.
+    """
+    return habit.serialized(_fragment_key(habit, timestamp_format), lambda habit: _serialize(habit, timestamp_format),
+                            cache)
+
+def _fragment_key(habit, timestamp_format):
+    """
+    Returns the cache key of a habit's JSON text.
+    """
+    return timestamp_format, habit.name, habit.start_date, habit.periodicity, habit.timezone, habit.day_cutoff
+
+def _serialize(habit, timestamp_format):
+    """
+    Serializes a habit the way json.dump indents it inside the database list.
+    """
+    text = json.dumps(habit_to_dict(habit, timestamp_format), indent=4).replace("\n", "\n    ")
+    return text, 0, len(text)
+
+def log_from_json(values, compact_logs=False):
+    """
+    Builds a completion log from its JSON representation.
+
+    The timestamp format is detected automatically: integers are epoch
+    seconds, strings are 'YYYY-MM-DD HH:MM:SS' timestamps.
+
+    Args:
+        values (list): Timestamps of the log.
+        compact_logs (bool): Return a CompactLog instead of a list.
+
+    Returns:
+        list: Completion datetimes, or a CompactLog.
+    """
+    if values and isinstance(values[0], int):
+        return CompactLog.from_timestamps(sorted(values)) if compact_logs else [from_timestamp(value) for value in values]
+    if compact_logs:
+        return CompactLog.from_timestamps(sorted(to_timestamp(parse_timestamp(value)) for value in values))
+    return [parse_timestamp(value) for value in values]
+
+def habit_from_dict(item, compact_logs=False):
+    """
+    Builds a habit from its JSON representation.
+
+    A stored summary is only kept if its total matches the log, so a log
+    edited by hand gets its summary recomputed.
+
+    Args:
+        item (dict): JSON representation of the habit.
+        compact_logs (bool): Store the log as a CompactLog instead of a list.
+
+    Returns:
+        Habit: The reconstructed Habit object.
+    """
+    summary = item.get('summary')
+    return Habit(
+        name=item['name'],
+        start_date=parse_timestamp(item['start_date']),
+        log=log_from_json(item['log'], compact_logs),
+        periodicity=item.get('periodicity', 'daily'),
+        summary=summary if summary and summary.get('total') == len(item['log']) else None,
+        timezone=item.get('timezone'),
+        day_cutoff=item.get('day_cutoff', 0)
+    )
+
+def scan_habits(text):
+    """
+    Scans a JSON habit list without parsing the log arrays.
+
+    Every field except "log" is decoded. The log array is only located, by
+    searching for its closing bracket, which is safe because log entries are
+    timestamps or integers.
+
+    Args:
+        text (str): Contents of a JSON database file.
+
+    Yields:
+        tuple: The habit fields without "log", and the (start, end) slice of
+        the log array in text, or None if the habit has no log.
+
+    Raises:
+        ValueError: If the text is not a JSON list of habit objects.
+    """
+    for header, log_span, _ in _scan_list(text):
+        yield header, log_span
+
+def _scan_list(text):
+    """
+    Scans a JSON habit list like scan_habits, also yielding the (start, end)
+    slice of every habit object.
+    """
+    pos = _expect(text, _skip(text, 0), '[')
+    if text[pos:pos + 1] == ']':
+        return
+    while True:
+        start = pos
+        header, log_span, pos = _scan_object(text, pos)
+        yield header, log_span, (start, pos)
+        pos = _skip(text, pos)
+        if text[pos:pos + 1] != ',':
+            break
+        pos = _skip(text, pos + 1)
+    _expect(text, pos, ']')
+
+def find_habit(data, name):
+    """
+    Locates one habit in a JSON database without decoding the others.
+
+    Habits written by this module start with their "name" key, so the habit
+    is found with a byte search and only the text around it is decoded, and
+    if such a file does not contain the name, the habit is missing. Files in
+    another layout fall back to stream_habits. Searched pages of a memory
+    map are released, so a miss does not keep the whole file resident.
+
+    Args:
+        data (bytes): Contents of a JSON database file, e.g. a memory map.
+        name (str): Name of the habit.
+
+    Returns:
+        tuple: The habit fields without "log", the (start, end) slice of the
+        log array or None, and the decoded text the slice refers to; or None
+        if no habit has that name.
+    """
+    for encoded in dict.fromkeys((json.dumps(name), json.dumps(name, ensure_ascii=False))):
+        encoded = encoded.encode("utf-8")
+        pos = _find_released(data, encoded, 0)
+        while pos != -1:
+            window = max(pos - 64, 0)
+            key = _NAME_KEY.search(data[window:pos])
+            if key is not None:
+                return _scan_object_at(data, window + key.start())
+            pos = _find_released(data, encoded, pos + 1)
+    if _NAME_FIRST.match(data):
+        return None
+    for header, log_span in stream_habits(data):
+        if header.get('name') == name:
+            if log_span is None:
+                return header, None, ""
+            text = data[log_span[0]:log_span[1]].decode("utf-8")
+            return header, (0, len(text)), text
+    return None
+
+def _scan_object_at(data, start):
+    """
+    Decodes and scans the habit object starting at a byte offset.
+
+    The decoded window grows until it holds the whole object.
+
+    Args:
+        data (bytes): Contents of a JSON database file.
+        start (int): Offset of the opening brace.
+
+    Returns:
+        tuple: As returned by find_habit.
+    """
+    size = 1 << 16
+    while True:
+        text = data[start:start + size].decode("utf-8", errors="ignore")
+        try:
+            header, log_span, _ = _scan_object(text, 0)
+            return header, log_span, text
+        except ValueError:
+            if start + size >= len(data):
+                raise
+            size *= 4
+
+def _skip(text, pos):
+    """
+    Returns the position of the first non-whitespace character from pos.
+    """
+    return _WHITESPACE.match(text, pos).end()
+
+def _expect(text, pos, char):
+    """
+    Checks that char is at pos and returns the position after it and any whitespace.
+    """
+    if text[pos:pos + 1] != char:
+        raise ValueError(f"Expected '{char}' at position {pos} of the database file.")
+    return _skip(text, pos + 1)
+
+def _scan_object(text, pos):
+    """
+    Scans one habit object of a JSON habit list, locating its log array.
+
+    Args:
+        text (str): Contents of a JSON database file.
+        pos (int): Position of the opening brace.
+
+    Returns:
+        tuple: The habit fields without "log", the (start, end) slice of the
+        log array or None, and the position after the closing brace.
+    """
+    pos = _expect(text, pos, '{')
+    header, log_span = {}, None
+    while text[pos:pos + 1] != '}':
+        if text[pos:pos + 1] != '"':
+            raise ValueError(f"Expected a key at position {pos} of the database file.")
+        key, pos = json.decoder.scanstring(text, pos + 1)
+        pos = _expect(text, _skip(text, pos), ':')
+        if key == 'log' and text[pos:pos + 1] == '[':
+            end = text.index(']', pos) + 1
+            log_span, pos = (pos, end), end
+        else:
+            header[key], pos = _DECODER.raw_decode(text, pos)
+        pos = _skip(text, pos)
+        if text[pos:pos + 1] == ',':
+            pos = _skip(text, pos + 1)
+    if text[pos:pos + 1] != '}':
+        raise ValueError(f"Expected '}}' at position {pos} of the database file.")
+    return header, log_span, pos + 1
+
+def stream_habits(data):
+    """
+    Scans a JSON habit list in bytes, such as a memory map, without decoding it.
+
+    JSON syntax is ASCII and never occurs inside multi-byte UTF-8 sequences,
+    so the bytes are scanned directly and only the keys and the fields other
+    than "log" are decoded, each from a small window. The pages of a memory
+    map are released once a log array has been skipped.
+
+    Args:
+        data (bytes): Contents of a JSON database file.
+
+    Yields:
+        tuple: The habit fields without "log", and the (start, end) byte
+        slice of the log array, or None if the habit has no log.
+
+    Raises:
+        ValueError: If the data is not a JSON list of habit objects.
+    """
+    for header, log_span, _ in _stream_list(data):
+        yield header, log_span
+
+def _stream_list(data):
+    """
+    Scans a JSON habit list like stream_habits, also yielding the (start, end)
+    byte slice of every habit object.
+    """
+    pos = _expect_byte(data, _skip_bytes(data, 0), b'[')
+    if data[pos:pos + 1] == b']':
+        return
+    while True:
+        start = pos
+        pos = _expect_byte(data, pos, b'{')
+        header, log_span = {}, None
+        while data[pos:pos + 1] != b'}':
+            key = _BYTES_KEY.match(data, pos)
+            if key is None:
+                raise ValueError(f"Expected a key at byte {pos} of the database file.")
+            pos = _expect_byte(data, _skip_bytes(data, key.end()), b':')
+            name = json.loads(key.group())
+            if name == 'log' and data[pos:pos + 1] == b'[':
+                end = _find_released(data, b']', pos)
+                if end == -1:
+                    raise ValueError(f"Unterminated log at byte {pos} of the database file.")
+                log_span, pos = (pos, end + 1), end + 1
+            else:
+                header[name], pos = _decode_bytes_at(data, pos)
+            pos = _skip_bytes(data, pos)
+            if data[pos:pos + 1] == b',':
+                pos = _skip_bytes(data, pos + 1)
+        yield header, log_span, (start, pos + 1)
+        pos = _skip_bytes(data, pos + 1)
+        if data[pos:pos + 1] != b',':
+            break
+        pos = _skip_bytes(data, pos + 1)
+    _expect_byte(data, pos, b']')
+
+def stream_log(data, log_span, chunk_size):
+    """
+    Parses a log array found by stream_habits in chunks.
+
+    The array is cut at commas, which is safe because log entries are
+    timestamps or integers, and each piece is parsed on its own. The pages of
+    a memory map are released once parsed, so only about one chunk of the
+    file stays resident.
+
+    Args:
+        data (bytes): Contents of a JSON database file.
+        log_span (tuple): The (start, end) byte slice of the log array, or None.
+        chunk_size (int): Maximum number of entries per chunk.
+
+    Yields:
+        CompactLog: The entries of each chunk, sorted.
+    """
+    if log_span is None:
+        return
+    pos, end = log_span[0] + 1, log_span[1] - 1
+    block = max(chunk_size, 1) * 24
+    while pos < end:
+        cut = end
+        if pos + block < end:
+            cut = data.rfind(b',', pos, pos + block)
+            if cut == -1:
+                cut = data.find(b',', pos + block, end)
+                cut = end if cut == -1 else cut
+        piece = data[pos:cut].strip()
+        _release(data, pos, cut)
+        pos = cut + 1
+        if piece:
+            values = json.loads(b'[' + piece + b']')
+            for index in range(0, len(values), chunk_size):
+                yield log_from_json(values[index:index + chunk_size], compact_logs=True)
+
+def _log_length(data, log_span):
+    """
+    Counts the entries of a log array found by stream_habits without parsing it.
+
+    Entries are timestamps or integers, so they are separated by the only
+    commas in the array.
+
+    Returns:
+        int: Number of entries.
+    """
+    if log_span is None or _skip_bytes(data, log_span[0] + 1) == log_span[1] - 1:
+        return 0
+    commas = 0
+    for pos in range(log_span[0], log_span[1], _RELEASE_BLOCK):
+        stop = min(pos + _RELEASE_BLOCK, log_span[1])
+        commas += data[pos:stop].count(b',')
+        _release(data, pos, stop)
+    return commas + 1
+
+def _find_released(data, needle, pos):
+    """
+    Finds bytes like data.find, releasing the pages of a memory map once searched.
+    """
+    while pos < len(data):
+        stop = min(pos + _RELEASE_BLOCK, len(data))
+        found = data.find(needle, pos, min(stop + len(needle) - 1, len(data)))
+        _release(data, pos, stop if found == -1 else found)
+        if found != -1:
+            return found
+        pos = stop
+    return -1
+
+def _release(data, start, end):
+    """
+    Drops the resident pages of a read-only memory map between two offsets.
+
+    Pages are read back from the file if accessed again. Other bytes-like
+    objects, and platforms without madvise, are left alone.
+    """
+    if not isinstance(data, mmap.mmap) or not hasattr(mmap, "MADV_DONTNEED"):
+        return
+    start -= start % mmap.PAGESIZE
+    if end > start:
+        data.madvise(mmap.MADV_DONTNEED, start, end - start)
+
+def _decode_bytes_at(data, pos):
+    """
+    Decodes the JSON value starting at a byte offset.
+
+    The decoded window grows until the value is followed by another
+    character, so a number cut off at the end of the window is not mistaken
+    for a complete one.
+
+    Returns:
+        tuple: The value and the byte offset after it.
+    """
+    size = 256
+    while True:
+        text = data[pos:pos + size].decode("utf-8", errors="ignore")
+        complete = pos + size >= len(data)
+        try:
+            value, end = _DECODER.raw_decode(text)
+            if end < len(text) or complete:
+                return value, pos + len(text[:end].encode("utf-8"))
+        except ValueError:
+            if complete:
+                raise
+        size *= 4
+
+def _skip_bytes(data, pos):
+    """
+    Returns the offset of the first non-whitespace byte from pos.
+    """
+    return _BYTES_WHITESPACE.match(data, pos).end()
+
+def _expect_byte(data, pos, char):
+    """
+    Checks that char is at pos and returns the offset after it and any whitespace.
+    """
+    if data[pos:pos + 1] != char:
+        raise ValueError(f"Expected '{char.decode()}' at byte {pos} of the database file.")
+    return _skip_bytes(data, pos + 1)
+
+def _read_events(file):
+    """
+    Reads the events of a journal, stopping at a truncated final line.
+
+    Args:
+        file (file): Open journal file.
+
+    Yields:
+        dict: The recorded events.
+    """
+    for line in file:
+        try:
+            yield json.loads(line)
+        except ValueError:
+            return
+
+_OPEN_DATABASES = weakref.WeakSet()
+
+@atexit.register
+def _flush_open_databases():
+    """
+    Flushes the deferred mutations of every open Database at interpreter exit.
+    """
+    for db in list(_OPEN_DATABASES):
+        db.flush()
+
+def open_database(db_file="db.json", **kwargs):
+    """
+    Opens the storage backend matching the extension of the database file.
+
+    Args:
+        db_file (str): The path to the database file.
+        **kwargs: Extra options for the JSON-backed Database. SQLite only
+            takes flush_every.
+
+    Returns:
+        Database: A Database, a SQLiteDatabase for .sqlite/.sqlite3/.db files,
+        or a ShardedDatabase for a directory.
+    """
+    if db_file.endswith((".sqlite", ".sqlite3", ".db")):
+        from sqlite_db import SQLiteDatabase
+        return SQLiteDatabase(db_file, flush_every=kwargs.get('flush_every', 1))
+    if os.path.isdir(db_file):
+        from sharded_db import ShardedDatabase
+        return ShardedDatabase(db_file, **kwargs)
+    return Database(db_file, **kwargs)
 
 class Database:
     """
     Manages the database of habits.
+
+    In journaled mode every mutation is appended as a single JSON line to
+    ``<db_file>.journal`` instead of rewriting the whole file. Loading replays
+    the journal over the last snapshot, and ``compact`` folds it back into
+    ``db_file``.
+
+    Several processes may open the same file. Every read-modify-write holds
+    an advisory lock on ``<db_file>.lock``, created by the first write, so
+    opening a database only to read it works in a read-only directory.
+    Snapshots are replaced atomically, and if another process changed the
+    files since they were last read, ``save_db`` reloads them and reapplies
+    this instance's pending mutations before writing. Changes made to Habit objects directly rather
+    than through this class are not reapplied.
+
+    By default every mutation is written immediately. With ``flush_every``
+    or ``flush_interval`` the writes are coalesced, and ``batch()`` defers
+    them until the end of a block. Deferred mutations are flushed by
+    ``flush``, ``close`` and at interpreter exit.
+
+    Once the journal outgrows ``compact_after`` bytes, ``flush`` and
+    ``close`` start a background compaction, so replaying it on startup
+    stays cheap.
     """
 
-    def __init__(self, db_file="db.json"):
+    def __init__(self, db_file="db.json", journal=False, compact_logs=False, timestamp_format="text",
+                 lazy=False, flush_every=1, flush_interval=None, habit_names=None, compact_after=COMPACT_AFTER):
         """
         Initializes the Database with a specified file.
 
         Args:
             db_file (str): The path to the JSON file storing the habits.
+            journal (bool): Append mutations to a journal instead of rewriting db_file.
+            compact_logs (bool): Keep loaded logs as memory-efficient CompactLogs.
+            timestamp_format (str): How logs are written: 'text' timestamps or
+                'epoch' integers. Both are read regardless of this setting.
+            lazy (bool): Only read habit names, start dates and periodicities
+                when opening; each log is parsed when it is first accessed.
+            flush_every (int): Write after this many mutations, or only on
+                flush if None.
+            flush_interval (float): Also flush from a background thread every
+                this many seconds, if not None.
+            habit_names (iterable): Only load the habits with these names,
+                found by searching the snapshot instead of scanning it, with
+                their logs parsed on first access. Such a partial database
+                must be journaled, because it cannot rewrite the snapshot.
+            compact_after (int): Compact once the journal reaches this many
+                bytes, or never automatically if None.
+
+        Raises:
+            ValueError: If habit_names is given without journal.
         """
+        if habit_names is not None and not journal:
+            raise ValueError("A database opened with habit_names must be journaled.")
+        self.habit_names = None if habit_names is None else frozenset(habit_names)
+        self.lazy = lazy
         self.db_file = db_file
-        self.habits = self.load_db()
+        self.journal = journal
+        self.compact_logs = compact_logs
+        self.timestamp_format = timestamp_format
+        self.journal_file = db_file + ".journal"
+        self.lock_file = db_file + ".lock"
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.compact_after = compact_after
+        self._lock = threading.RLock()
+        self._compaction = None
+        self._flusher = None
+        self._closed = threading.Event()
+        self._batch_depth = 0
+        self._batch_gate = threading.RLock()
+        self._pending = []
+        with self._locked(shared=True):
+            self.habits = self.load_db()
+            self._seen = self._disk_state()
+        _OPEN_DATABASES.add(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def dirty(self):
+        """
+        bool: Whether mutations are waiting to be flushed.
+        """
+        return bool(self._pending)
+
+    @property
+    def habits(self):
+        """
+        list: All Habit objects, in insertion order.
+        """
+        return list(self._habits.values())
+
+    @habits.setter
+    def habits(self, habits):
+        """
+        Replaces all habits and rebuilds the name and periodicity indexes.
+
+        Duplicate names collapse to the last habit with that name.
+
+        Args:
+            habits (list): List of Habit objects.
+        """
+        self._habits = {}
+        self._by_periodicity = {}
+        self._completions = None
+        for habit in habits:
+            self._unindex(habit.name)
+            self._index(habit)
+
+    def _index(self, habit):
+        """
+        Adds a habit to the name and periodicity indexes.
+
+        Args:
+            habit (Habit): Habit to index.
+        """
+        self._habits[habit.name] = habit
+        self._by_periodicity.setdefault(habit.periodicity, {})[habit.name] = habit
+        if self._completions is not None:
+            self._completions.add_habit(habit)
+
+    def _unindex(self, name):
+        """
+        Removes a habit from the name and periodicity indexes.
+
+        Args:
+            name (str): Name of the habit to remove.
+
+        Returns:
+            Habit: The removed habit, or None if no habit has that name.
+        """
+        habit = self._habits.pop(name, None)
+        if habit is not None:
+            self._by_periodicity[habit.periodicity].pop(name, None)
+            if self._completions is not None:
+                self._completions.remove_habit(habit)
+        return habit
+
+    def _completion_index(self):
+        """
+        Returns the day and ISO week completion index, building it on first use.
+
+        Building it reads the log of every habit; afterwards it is kept up to
+        date by the mutating methods of this class.
+
+        Returns:
+            CompletionIndex: The index.
+        """
+        with self._lock:
+            if self._completions is None:
+                self._completions = CompletionIndex(self._habits.values())
+            return self._completions
 
     def load_db(self):
         """
-        Loads habits from the JSON file.
+        Loads habits from the JSON file and replays any pending journal.
+
+        Returns:
+            list: List of Habit objects.
+        """
+        habits = self._load_snapshot()
+        for journal_file in (self._compacting_file(), self.journal_file):
+            habits = self._replay_journal(habits, journal_file)
+        if self.habit_names is not None:
+            habits = [habit for habit in habits if habit.name in self.habit_names]
+        return habits
+
+    def save_db(self):
+        """
+        Saves the current habits to the JSON file and discards the journal.
+
+        If another process changed the database since it was last read, the
+        files are reloaded and the pending mutations of this instance are
+        reapplied first, so no process overwrites the changes of another.
+
+        Raises:
+            ValueError: If the database was opened with habit_names.
+        """
+        self._check_complete()
+        self.wait_for_compaction()
+        with self._locked():
+            if self._disk_state() != self._seen:
+                self.habits = self._apply_events(self.load_db(), self._pending)
+            self._write_snapshot(self._habits.values())
+            for journal_file in (self._compacting_file(), self.journal_file):
+                if os.path.exists(journal_file):
+                    os.remove(journal_file)
+            self._pending = []
+            self._seen = self._disk_state()
+
+    def flush(self):
+        """
+        Writes all deferred mutations.
+
+        In journaled mode the pending events are appended in a single write,
+        and a background compaction is started if the journal grew past
+        compact_after; otherwise the snapshot is saved once.
+        """
+        if not self._pending:
+            return
+        if not self.journal:
+            self.save_db()
+            return
+        with self._locked():
+            unchanged = self._disk_state() == self._seen
+            events, self._pending = self._pending, []
+            with open(self.journal_file, "a") as file:
+                file.write("".join(json.dumps(event, default=format_timestamp) + "\n" for event in events))
+                journal_size = file.tell()
+            if unchanged:
+                self._seen = self._disk_state()
+        self._maybe_compact(journal_size)
+
+    def checkpoint(self):
+        """
+        Bounds the memory held by a long batch.
+
+        In journaled mode the pending events are appended to the journal now;
+        in snapshot mode nothing is written, as the pending events hold no
+        completion payloads.
+        """
+        if self.journal:
+            self.flush()
+
+    @contextmanager
+    def batch(self):
+        """
+        Defers writing until the end of the block, then flushes once.
+
+        Blocks can be nested; only the outermost one flushes. Mutations are
+        applied in memory immediately and are flushed even if the block
+        raises.
+
+        Yields:
+            Database: This database.
+        """
+        with self._batch_gate, self._lock:
+            self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._batch_depth -= 1
+                outermost = not self._batch_depth
+            if outermost:
+                self.flush()
+
+    def close(self):
+        """
+        Stops the background flusher and writes all deferred mutations.
+        """
+        self._closed.set()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+        self.flush()
+        if self.journal and os.path.exists(self.journal_file):
+            self._maybe_compact(os.path.getsize(self.journal_file))
+        self.wait_for_compaction()
+        _OPEN_DATABASES.discard(self)
+
+    def compact(self, background=True):
+        """
+        Folds the journal into a fresh snapshot of the JSON file.
+
+        The journal is rotated under the lock, so mutations made while the
+        compaction runs go to a new journal and are never lost. The whole
+        snapshot is folded, even if the database was opened with habit_names.
+
+        Args:
+            background (bool): Run the compaction in a background thread.
+
+        Returns:
+            threading.Thread: The compaction thread, or None if it ran inline.
+        """
+        self.wait_for_compaction()
+        with self._locked():
+            unchanged = self._disk_state() == self._seen
+            if os.path.exists(self.journal_file):
+                with open(self.journal_file, "r") as src, open(self._compacting_file(), "a") as dst:
+                    shutil.copyfileobj(src, dst)
+                os.remove(self.journal_file)
+            if unchanged:
+                self._seen = self._disk_state()
+        if not background:
+            self._fold_journal()
+            return None
+        self._compaction = threading.Thread(target=self._fold_journal, daemon=True)
+        self._compaction.start()
+        return self._compaction
+
+    def wait_for_compaction(self):
+        """
+        Blocks until a running background compaction has finished.
+        """
+        if self._compaction is not None:
+            self._compaction.join()
+            self._compaction = None
+
+    def _maybe_compact(self, journal_size):
+        """
+        Starts a background compaction if the journal reached compact_after bytes.
+
+        Args:
+            journal_size (int): Current size of the journal in bytes.
+        """
+        if self.compact_after is None or journal_size < self.compact_after:
+            return
+        if self._compaction is not None and self._compaction.is_alive():
+            return
+        self.compact(background=True)
+
+    def _check_complete(self):
+        """
+        Refuses to rewrite the snapshot from a partially loaded database.
+        """
+        if self.habit_names is not None:
+            raise ValueError("A database opened with habit_names cannot rewrite the snapshot.")
+
+    def _compacting_file(self):
+        """
+        Returns the path of the journal segment being compacted.
+        """
+        return self.journal_file + ".compacting"
+
+    @contextmanager
+    def _locked(self, shared=False):
+        """
+        Holds both the thread lock and the inter-process file lock.
+
+        Args:
+            shared (bool): Only read, taking a shared file lock that does not
+                create the lock file.
+        """
+        with self._lock, file_lock(self.lock_file, shared):
+            yield
+
+    def _disk_state(self):
+        """
+        Returns the fingerprints of the snapshot and journal files.
+
+        Returns:
+            tuple: One file_state per database file.
+        """
+        return tuple(file_state(path) for path in (self.db_file, self.journal_file, self._compacting_file()))
+
+    def _fold_journal(self):
+        """
+        Replays the rotated journal over the on-disk snapshot and writes the result.
+
+        The lock is only held to swap in the new snapshot. If another process
+        rewrote the snapshot in the meantime, the result is discarded: that
+        process already folded the journal in.
+        """
+        compacting_file = self._compacting_file()
+        if not os.path.exists(compacting_file):
+            return
+        snapshot_state = file_state(self.db_file)
+        habits = self._replay_journal(self._load_snapshot(complete=True), compacting_file)
+        tmp_file = self._dump(habits)
+        with self._locked():
+            if file_state(self.db_file) != snapshot_state or not os.path.exists(compacting_file):
+                os.remove(tmp_file)
+                return
+            unchanged = self._disk_state() == self._seen
+            os.replace(tmp_file, self.db_file)
+            os.remove(compacting_file)
+            if unchanged:
+                self._seen = self._disk_state()
+
+    def _load_snapshot(self, complete=False):
+        """
+        Loads the habits stored in the snapshot.
+
+        Files with the columnar extension are memory-mapped, everything else
+        is read as JSON. In lazy mode the JSON file is memory-mapped as well
+        and only indexed: logs are parsed from the map on first access, and
+        a stored summary is kept only if its total matches the number of
+        entries in the log, as when loading eagerly.
+
+        Args:
+            complete (bool): Load every habit with lazily parsed logs, even
+                if the database was opened with habit_names.
 
         Returns:
             list: List of Habit objects.
         """
+        if is_columnar_file(self.db_file):
+            try:
+                return load_columnar(self.db_file, self.compact_logs, self.lazy)
+            except FileNotFoundError:
+                return []
+        if self.habit_names is not None and not complete:
+            return self._load_named_habits()
         try:
-            with open(self.db_file, "r") as file:
-                data = json.load(file)
-                habits = []
-                for item in data:
-                    habits.append(Habit(
-                        name=item['name'],
-                        start_date=datetime.strptime(item['start_date'], '%Y-%m-%d %H:%M:%S'),
-                        log=[datetime.strptime(log_datetime, '%Y-%m-%d %H:%M:%S') for log_datetime in item['log']],
-                        periodicity=item.get('periodicity', 'daily')
-                    ))
-                return habits
+            with open(self.db_file, "rb") as file:
+                if not self.lazy and not complete:
+                    return [habit_from_dict(item, self.compact_logs) for item in json.load(file)]
+                if not os.fstat(file.fileno()).st_size:
+                    return []
+                data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
         except FileNotFoundError:
             return []
+        habits = []
+        for header, log_span, object_span in _stream_list(data):
+            summary = header.get('summary')
+            if not summary or summary.get('total') != _log_length(data, log_span):
+                summary = None
+            habit = Habit.lazy(
+                name=header['name'],
+                start_date=parse_timestamp(header['start_date']),
+                log_loader=self._log_loader(data, log_span),
+                periodicity=header.get('periodicity', 'daily'),
+                summary=summary,
+                timezone=header.get('timezone'),
+                day_cutoff=header.get('day_cutoff', 0)
+            )
+            if habit.matches_summary(summary):
+                self._reuse_fragment(habit, data, log_span, object_span)
+            habits.append(habit)
+        return habits
 
-    def save_db(self):
+    def _load_named_habits(self):
+        """
+        Loads the habits listed in habit_names from a memory map of the snapshot.
+
+        Returns:
+            list: List of Habit objects with lazily parsed logs.
+        """
+        try:
+            with open(self.db_file, "rb") as file:
+                if not os.fstat(file.fileno()).st_size:
+                    return []
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    found = [find_habit(data, name) for name in self.habit_names]
+        except FileNotFoundError:
+            return []
+        return [Habit.lazy(
+            name=header['name'],
+            start_date=parse_timestamp(header['start_date']),
+            log_loader=self._log_loader(text, log_span),
+            periodicity=header.get('periodicity', 'daily'),
+            summary=header.get('summary'),
+            timezone=header.get('timezone'),
+            day_cutoff=header.get('day_cutoff', 0)
+        ) for header, log_span, text in filter(None, found)]
+
+    def _reuse_fragment(self, habit, data, log_span, object_span):
+        """
+        Caches the snapshot text of an unchanged habit, so saving writes it back
+        instead of serializing it again.
+
+        The text is only reused if its log is in the configured timestamp
+        format. It stays in the memory map until it is written.
+
+        Args:
+            habit (Habit): The habit read from the snapshot.
+            data (mmap): Contents of the snapshot file.
+            log_span (tuple): The (start, end) byte slice of the log array, or None.
+            object_span (tuple): The (start, end) byte slice of the habit object.
+        """
+        if log_span is None:
+            return
+        pos = _skip_bytes(data, log_span[0] + 1)
+        first = data[pos:pos + 1]
+        if first != b"]" and (first == b'"') != (self.timestamp_format == "text"):
+            return
+        habit.serialized(_fragment_key(habit, self.timestamp_format), lambda habit: (data, *object_span))
+
+    def _log_loader(self, text, log_span):
+        """
+        Returns a function that parses a log array of the snapshot on demand.
+
+        Args:
+            text (str): Contents of the snapshot file, or a memory map of it,
+                whose pages are released once the log is parsed.
+            log_span (tuple): The (start, end) slice of the log array, or None.
+
+        Returns:
+            callable: Function returning the parsed completion log.
+        """
+        def load():
+            if not log_span:
+                return log_from_json([], self.compact_logs)
+            values = json.loads(text[log_span[0]:log_span[1]])
+            _release(text, *log_span)
+            return log_from_json(values, self.compact_logs)
+        return load
+
+    def _write_snapshot(self, habits):
+        """
+        Atomically replaces the snapshot with the given habits.
+
+        Args:
+            habits (iterable): Habit objects to write.
+        """
+        os.replace(self._dump(habits), self.db_file)
+
+    def _dump(self, habits):
+        """
+        Writes habits to a new temporary file next to the snapshot.
+
+        The file is flushed to disk, so replacing the snapshot with it never
+        leaves a truncated database behind, even after a crash.
+
+        Args:
+            habits (iterable): Habit objects to write.
+
+        Returns:
+            str: The path of the temporary file.
+        """
+        fd, tmp_file = tempfile.mkstemp(prefix=os.path.basename(self.db_file) + ".",
+                                        dir=os.path.dirname(os.path.abspath(self.db_file)))
+        os.close(fd)
+        try:
+            shutil.copymode(self.db_file, tmp_file)
+        except FileNotFoundError:
+            os.chmod(tmp_file, 0o644)
+        if is_columnar_file(self.db_file):
+            save_columnar(tmp_file, list(habits))
+        else:
+            with open(tmp_file, "w") as file:
+                self._write_habits(file, habits)
+        fd = os.open(tmp_file, os.O_RDWR)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        return tmp_file
+
+    def _write_habits(self, file, habits):
+        """
+        Streams habits to a file as an indented JSON list.
+
+        Each habit is written from its cached JSON text if its log did not
+        change, so only changed habits are serialized and the list is never
+        built in memory. Text reused from a memory-mapped snapshot is
+        decoded as it is written. With compact_logs, new text is not kept on
+        the habits, to preserve their small footprint.
+
+        Args:
+            file (file): File open for writing.
+            habits (iterable): Habit objects to write.
         """
-        Saves the current habits to the JSON file.
+        separator = "[\n    "
+        for habit in habits:
+            text, start, end = habit_fragment(habit, self.timestamp_format, not self.compact_logs)
+            fragment = text[start:end]
+            file.write(separator)
+            file.write(fragment.decode("utf-8") if isinstance(fragment, bytes) else fragment)
+            separator = ",\n    "
+        file.write("[]" if separator == "[\n    " else "\n]")
+
+    def _replay_journal(self, habits, journal_file):
         """
-        data = []
-        for habit in self.habits:
-            data.append({
-                'name': habit.name,
-                'start_date': habit.start_date.strftime('%Y-%m-%d %H:%M:%S'),
-                'log': [log_datetime.strftime('%Y-%m-%d %H:%M:%S') for log_datetime in habit.log],
-                'periodicity': habit.periodicity
-            })
-        with open(self.db_file, "w") as file:
-            json.dump(data, file, indent=4)
+        Applies the events of a journal file to a list of habits.
+
+        Replaying is idempotent: an "add" replaces a habit of the same name,
+        a "delete" of a missing habit is ignored and "log" and "log_many"
+        deduplicate. A truncated final line left by a crash is skipped.
+
+        Args:
+            habits (list): Habits to apply the journal to.
+            journal_file (str): Path of the journal file.
+
+        Returns:
+            list: The habits with the journal applied.
+        """
+        if not os.path.exists(journal_file):
+            return habits
+        with open(journal_file, "r") as file:
+            return self._apply_events(habits, _read_events(file))
+
+    def _apply_events(self, habits, events):
+        """
+        Applies mutation events to a list of habits.
+
+        Args:
+            habits (list): Habits to apply the events to.
+            events (iterable): Events as recorded by _record.
+
+        Returns:
+            list: The habits with the events applied.
+        """
+        by_name = {habit.name: habit for habit in habits}
+        for event in events:
+            if event['op'] == 'add':
+                by_name.pop(event['habit']['name'], None)
+                by_name[event['habit']['name']] = habit_from_dict(event['habit'], self.compact_logs)
+            elif event['op'] == 'delete':
+                by_name.pop(event['name'], None)
+            elif event['op'] == 'log' and event['name'] in by_name:
+                by_name[event['name']].log_entry(parse_timestamp(event['timestamp']))
+            elif event['op'] == 'log_many' and event['name'] in by_name:
+                timestamps = event['timestamps']
+                if timestamps is None:
+                    current = self._habits.get(event['name'])
+                    timestamps = current.log if current is not None else ()
+                by_name[event['name']].log_entries(
+                    parse_timestamp(timestamp) if isinstance(timestamp, str) else timestamp
+                    for timestamp in timestamps
+                )
+        return list(by_name.values())
+
+    def _record(self, event):
+        """
+        Queues a mutation event for the next flush.
+
+        Must be called while holding the lock, together with the in-memory
+        change it describes.
+
+        Args:
+            event (dict): Description of the mutation.
+        """
+        self._pending.append(event)
+
+    def _maybe_flush(self):
+        """
+        Flushes the pending mutations if the flush policy asks for it.
+        """
+        with self._lock:
+            if self._batch_depth:
+                return
+        if self.flush_every is not None and len(self._pending) >= self.flush_every:
+            self.flush()
+        elif self.flush_interval is not None and self._flusher is None and not self._closed.is_set():
+            self._flusher = threading.Thread(target=self._flush_periodically, daemon=True)
+            self._flusher.start()
+
+    def _flush_periodically(self):
+        """
+        Flushes pending mutations every flush_interval seconds until closed.
+
+        Flushes are skipped while a batch is open, as its end flushes anyway.
+        The batch gate keeps a batch from starting during a flush; it is
+        separate from the lock, which a flush may wait for a compaction to
+        take.
+        """
+        while not self._closed.wait(self.flush_interval):
+            with self._batch_gate:
+                with self._lock:
+                    batched = self._batch_depth > 0
+                if not batched:
+                    self.flush()
 
     def get_all_habits(self):
         """
@@ -65,7 +1229,7 @@ class Database:
         Returns:
             list: List of all Habit objects.
         """
-        return self.habits
+        return list(self._habits.values())
 
     def get_habit(self, name):
         """
@@ -77,10 +1241,7 @@ class Database:
         Returns:
             Habit: Habit object with the specified name.
         """
-        for habit in self.habits:
-            if habit.name == name:
-                return habit
-        return None
+        return self._habits.get(name)
 
     def add_habit(self, habit):
         """
@@ -88,19 +1249,84 @@ class Database:
 
         Args:
             habit (Habit): Habit object to add.
+
+        Raises:
+            ValueError: If a habit with the same name already exists.
         """
-        self.habits.append(habit)
-        self.save_db()
+        with self._lock:
+            if habit.name in self._habits:
+                raise ValueError(f"Habit '{habit.name}' already exists.")
+            self._index(habit)
+            self._record({'op': 'add', 'habit': habit_to_dict(habit, self.timestamp_format)})
+        self._maybe_flush()
 
     def delete_habit(self, name):
         """
         Deletes a habit by name.
 
+        Nothing is recorded or written if no habit has that name.
+
         Args:
             name (str): Name of the habit to delete.
         """
-        self.habits = [habit for habit in self.habits if habit.name != name]
-        self.save_db()
+        with self._lock:
+            if self.get_habit(name) is None:
+                return
+            self._unindex(name)
+            self._record({'op': 'delete', 'name': name})
+        self._maybe_flush()
+
+    def log_entry(self, name, log_datetime):
+        """
+        Logs a new entry for a habit and persists it.
+
+        Args:
+            name (str): Name of the habit.
+            log_datetime (datetime): Datetime to log for the habit, naive in
+                the stored form or aware; see Habit.normalize.
+
+        Returns:
+            Habit: The updated habit, or None if no habit has that name.
+        """
+        with self._lock:
+            habit = self.get_habit(name)
+            if habit is None:
+                return None
+            log_datetime = habit.normalize(log_datetime)
+            habit.log_entry(log_datetime)
+            if self._completions is not None:
+                self._completions.add_entries(habit, [log_datetime])
+            self._record({'op': 'log', 'name': name, 'timestamp': format_timestamp(log_datetime)})
+        self._maybe_flush()
+        return habit
+
+    def log_entries(self, name, log_datetimes):
+        """
+        Logs a batch of entries for a habit with one sorted merge.
+
+        Args:
+            name (str): Name of the habit.
+            log_datetimes (iterable): Datetimes to log for the habit, as for
+                log_entry.
+
+        Returns:
+            int: Number of entries that were not already logged, or None if
+            no habit has that name.
+        """
+        with self._lock:
+            habit = self.get_habit(name)
+            if habit is None:
+                return None
+            log_datetimes = list(map(habit.normalize, log_datetimes))
+            added = habit.log_entries(log_datetimes)
+            if self._completions is not None:
+                self._completions.add_entries(habit, log_datetimes)
+            # The datetimes are only formatted if the event is written to the
+            # journal. A snapshot keeps no copy of them: the habit holds them,
+            # and a merge with another writer takes them from its log.
+            self._record({'op': 'log_many', 'name': name, 'timestamps': log_datetimes if self.journal else None})
+        self._maybe_flush()
+        return added
 
     def get_habits_by_periodicity(self, periodicity):
         """
@@ -112,7 +1338,106 @@ class Database:
         Returns:
             list: List of Habit objects.
         """
-        return [habit for habit in self.habits if habit.periodicity == periodicity]
+        return list(self._by_periodicity.get(periodicity, {}).values())
+
+    def get_summary(self, name):
+        """
+        Retrieves the materialized summary of a habit.
+
+        Args:
+            name (str): Name of the habit.
+
+        Returns:
+            dict: The summary described in Habit.summary, or None if no habit
+            has that name.
+        """
+        habit = self.get_habit(name)
+        return habit.summary() if habit else None
+
+    def get_summaries(self):
+        """
+        Retrieves the materialized summaries of all habits.
+
+        Habits loaded lazily return their stored summaries without parsing
+        their logs.
+
+        Returns:
+            dict: Summary by habit name.
+        """
+        return {habit.name: habit.summary() for habit in self._habits.values()}
+
+    def get_habits_completed_on(self, day):
+        """
+        Retrieves the habits completed on a day.
+
+        Args:
+            day (date): Day to look up.
+
+        Returns:
+            list: List of Habit objects, ordered by name.
+        """
+        return self._habits_named(self._completion_index().names_on(day))
+
+    def get_habits_completed_in_week(self, year, week):
+        """
+        Retrieves the habits completed in an ISO calendar week.
+
+        Args:
+            year (int): ISO year.
+            week (int): ISO week number.
+
+        Returns:
+            list: List of Habit objects, ordered by name.
+        """
+        return self._habits_named(self._completion_index().names_in_week(year, week))
+
+    def get_habits_completed_between(self, start, end):
+        """
+        Retrieves the habits completed at least once between two days.
+
+        Args:
+            start (date): First day, inclusive.
+            end (date): Last day, inclusive.
+
+        Returns:
+            list: List of Habit objects, ordered by name.
+        """
+        return self._habits_named(self._completion_index().names_between(start, end))
+
+    def get_completion_counts(self, start, end):
+        """
+        Counts the habits completed on every day between two days, e.g. for
+        a calendar heatmap.
+
+        Args:
+            start (date): First day, inclusive.
+            end (date): Last day, inclusive.
+
+        Returns:
+            dict: Number of completed habits by date.
+        """
+        return self._completion_index().counts_between(start, end)
+
+    def _habits_named(self, names):
+        """
+        Looks up habits by name.
+
+        Args:
+            names (iterable): Names of the habits.
+
+        Returns:
+            list: The Habit objects that exist, ordered by name.
+        """
+        return [self._habits[name] for name in sorted(names) if name in self._habits]
+
+    def get_longest_streaks(self):
+        """
+        Retrieves the longest streak every habit has ever reached.
+
+        Returns:
+            dict: Longest streak by habit name.
+        """
+        return longest_streaks(self._habits.values())
 
     def get_longest_streak_all_habits(self):
         """
@@ -121,10 +1446,11 @@ class Database:
         Returns:
             int: Longest streak and the name of the habit.
         """
-        if not self.habits:
+        streaks = self.get_longest_streaks()
+        if not streaks:
             return 0, None
-        longest_streak_habit = max(self.habits, key=lambda habit: habit.calculate_streak())
-        return longest_streak_habit.calculate_streak(), longest_streak_habit.name
+        name = max(streaks, key=streaks.get)
+        return streaks[name], name
 
     def get_longest_streak_for_habit(self, name):
         """
@@ -137,4 +1463,4 @@ class Database:
             int: The longest streak for the specific habit.
         """
         habit = self.get_habit(name)
-        return habit.calculate_streak() if habit else 0
+        return longest_streak(habit) if habit else 0
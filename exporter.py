@@ -0,0 +1,427 @@
+"""
+This module exports completion histories to CSV, JSONL or columnar chunk files.
+
+Each output row is one completion event of a habit, in the formats read by
+the importer module:
+
+    CSV:      habit,timestamp
+    JSONL:    {"habit": "...", "timestamp": "YYYY-MM-DD HH:MM:SS"}
+    Columnar: b"HBTX" | version (uint32), then for every chunk:
+              metadata length (uint32) | count (uint64) | metadata | padding | column
+
+Columnar chunks hold JSON metadata (habit, periodicity, timezone) and a
+little-endian int64 column of epoch seconds, similar to Parquet row groups.
+Timestamps of habits with a timezone are UTC, marked with '+00:00' in the
+text formats.
+
+A JSON snapshot without a journal is memory-mapped and streamed: its habit
+list is scanned byte by byte and each log array is parsed a chunk at a time,
+so memory use does not grow with the size of the database. Other databases
+are exported one habit at a time, holding one log in memory (columnar
+.hbt logs stay memory-mapped). Date ranges are found with a binary search in
+each sorted log or chunk.
+"""
+
+import argparse
+import csv
+import io
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from bisect import bisect_left
+from datetime import date, datetime, time as day_time, timedelta
+from itertools import repeat
+from contextlib import contextmanager
+from columnar_db import is_columnar_file
+from db import open_database, stream_habits, stream_log
+from habits_class import CompactLog, Habit, parse_timestamp, to_timestamp
+from periodicity import DAY_SECONDS, EPOCH_ORDINAL
+
+CHUNK_SIZE = 65536
+CHUNK_MAGIC = b"HBTX"
+CHUNK_VERSION = 1
+FILE_HEADER = struct.Struct("<4sI")
+CHUNK_HEADER = struct.Struct("<IQ")
+FORMATS = ("csv", "jsonl", "columnar")
+
+# 'HH:MM:SS' of every second of a day, built on the first text export.
+_clock_texts = None
+
+class _DayTexts(dict):
+    """
+    Caches the 'YYYY-MM-DD ' prefix of timestamps by day number.
+    """
+
+    def __missing__(self, day):
+        text = self[day] = date.fromordinal(day + EPOCH_ORDINAL).isoformat() + " "
+        return text
+
+_day_texts = _DayTexts()
+
+def export_habits(db, periodicity=None):
+    """
+    Returns the habits to export.
+
+    Args:
+        db (Database): Database to export from.
+        periodicity (str): Only export habits with this periodicity spec.
+
+    Returns:
+        list: Habit objects.
+    """
+    return db.get_habits_by_periodicity(periodicity) if periodicity else db.get_all_habits()
+
+def completion_chunks(habits, start=None, end=None, chunk_size=CHUNK_SIZE):
+    """
+    Streams the completion logs of habits in chunks.
+
+    Logs that are not loaded yet are read without keeping them on the habit.
+
+    Args:
+        habits (iterable): Habit objects to export.
+        start (date): First local day to export, inclusive.
+        end (date): Last local day to export, inclusive.
+        chunk_size (int): Maximum number of completions per chunk.
+
+    Yields:
+        tuple: A habit and a chunk of its log, a CompactLog or a list of
+        datetimes in the stored form.
+    """
+    for habit in habits:
+        log = habit.peek_log()
+        first, last = _log_range(habit, log, start, end)
+        for index in range(first, last, chunk_size):
+            yield habit, log[index:min(index + chunk_size, last)]
+
+def streamable(db_file):
+    """
+    Tells whether a database can be exported straight from a memory map.
+
+    That holds for a non-empty JSON snapshot without a journal, whose
+    pending events would otherwise be missed.
+
+    Args:
+        db_file (str): The path to the database.
+
+    Returns:
+        bool: True if snapshot_chunks can read the file.
+    """
+    if db_file.endswith((".sqlite", ".sqlite3", ".db")) or is_columnar_file(db_file) or not os.path.isfile(db_file):
+        return False
+    journals = (db_file + ".journal", db_file + ".journal.compacting")
+    return os.path.getsize(db_file) > 0 and not any(map(os.path.exists, journals))
+
+@contextmanager
+def mapped_snapshot(db_file):
+    """
+    Memory-maps a JSON snapshot for the duration of a block.
+
+    Args:
+        db_file (str): The path to the snapshot, as accepted by streamable.
+
+    Yields:
+        mmap: The read-only contents of the file.
+    """
+    with open(db_file, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        yield data
+
+def snapshot_habits(data, periodicity=None):
+    """
+    Returns the habits of a mapped JSON snapshot, without their logs.
+
+    Args:
+        data (mmap): Contents of the snapshot.
+        periodicity (str): Only return habits with this periodicity spec.
+
+    Returns:
+        list: (habit, log_span) pairs, where habit is a Habit with an empty
+        log and log_span the byte slice of its log array in data.
+    """
+    found = []
+    for header, log_span in stream_habits(data):
+        habit = Habit(header['name'], parse_timestamp(header['start_date']), [],
+                      periodicity=header.get('periodicity', 'daily'),
+                      timezone=header.get('timezone'), day_cutoff=header.get('day_cutoff', 0))
+        if periodicity is None or habit.periodicity == periodicity:
+            found.append((habit, log_span))
+    return found
+
+def snapshot_chunks(data, habits, start=None, end=None, chunk_size=CHUNK_SIZE):
+    """
+    Streams the completion logs of a mapped JSON snapshot in chunks.
+
+    Args:
+        data (mmap): Contents of the snapshot.
+        habits (iterable): (habit, log_span) pairs from snapshot_habits.
+        start (date): First local day to export, inclusive.
+        end (date): Last local day to export, inclusive.
+        chunk_size (int): Maximum number of completions per chunk.
+
+    Yields:
+        tuple: A habit and a CompactLog chunk of its log.
+    """
+    for habit, log_span in habits:
+        for chunk in stream_log(data, log_span, chunk_size):
+            first, last = _log_range(habit, chunk, start, end)
+            if last - first == len(chunk):
+                yield habit, chunk
+            elif first < last:
+                yield habit, chunk[first:last]
+
+def _log_range(habit, log, start, end):
+    """
+    Returns the slice of a sorted log between two local days.
+
+    Args:
+        habit (Habit): Owner of the log.
+        log (list): Sorted completion datetimes, or a CompactLog.
+        start (date): First day, inclusive, or None.
+        end (date): Last day, inclusive, or None.
+
+    Returns:
+        tuple: Start and end index of the slice.
+    """
+    def position(day):
+        bound = habit.from_local(datetime.combine(day, day_time(habit.day_cutoff)))
+        if isinstance(log, CompactLog):
+            return bisect_left(log.timestamps, to_timestamp(bound))
+        return bisect_left(log, bound)
+    first = position(start) if start is not None else 0
+    last = position(end + timedelta(days=1)) if end is not None else len(log)
+    return first, max(first, last)
+
+def _texts(habit, chunk):
+    """
+    Formats a chunk of completions as 'YYYY-MM-DD HH:MM:SS' timestamps.
+
+    The text is assembled from cached day and time-of-day strings, which is
+    several times faster than creating and formatting datetimes.
+    """
+    global _clock_texts
+    if _clock_texts is None:
+        _clock_texts = [f"{hour:02d}:{minute:02d}:{second:02d}"
+                        for hour in range(24) for minute in range(60) for second in range(60)]
+    days, clock = _day_texts, _clock_texts
+    texts = [days[day] + clock[second] for day, second in map(divmod, _timestamps(chunk), repeat(DAY_SECONDS))]
+    if habit.timezone is not None:
+        return [text + "+00:00" for text in texts]
+    return texts
+
+def _timestamps(chunk):
+    """
+    Returns a chunk of completions as int64 epoch seconds.
+    """
+    if isinstance(chunk, CompactLog):
+        return chunk.timestamps
+    return array('q', map(to_timestamp, chunk))
+
+def write_csv(file, chunks):
+    """
+    Writes completion chunks as CSV rows with a header.
+
+    The habit name is quoted once per chunk; timestamps never need quoting.
+
+    Args:
+        file (file): Text file opened with newline="".
+        chunks (iterable): (habit, chunk) pairs, as from completion_chunks.
+
+    Returns:
+        int: Number of rows written.
+    """
+    file.write("habit,timestamp\n")
+    rows = 0
+    for habit, chunk in chunks:
+        field = io.StringIO()
+        csv.writer(field, lineterminator="").writerow([habit.name])
+        prefix = field.getvalue() + ","
+        file.writelines(prefix + text + "\n" for text in _texts(habit, chunk))
+        rows += len(chunk)
+    return rows
+
+def write_jsonl(file, chunks):
+    """
+    Writes completion chunks as JSON lines.
+
+    Args:
+        file (file): Text file.
+        chunks (iterable): (habit, chunk) pairs, as from completion_chunks.
+
+    Returns:
+        int: Number of lines written.
+    """
+    rows = 0
+    for habit, chunk in chunks:
+        prefix = '{"habit": ' + json.dumps(habit.name) + ', "timestamp": "'
+        file.writelines(prefix + text + '"}\n' for text in _texts(habit, chunk))
+        rows += len(chunk)
+    return rows
+
+def write_columnar_chunks(file, chunks):
+    """
+    Writes completion chunks in the columnar chunk format.
+
+    Args:
+        file (file): Binary file.
+        chunks (iterable): (habit, chunk) pairs, as from completion_chunks.
+
+    Returns:
+        int: Number of completions written.
+    """
+    file.write(FILE_HEADER.pack(CHUNK_MAGIC, CHUNK_VERSION))
+    position, rows = FILE_HEADER.size, 0
+    for habit, chunk in chunks:
+        metadata = json.dumps({'habit': habit.name, 'periodicity': habit.periodicity,
+                               'timezone': habit.timezone}).encode("utf-8")
+        column = _timestamps(chunk)
+        if sys.byteorder == "big":
+            column = array('q', column)
+            column.byteswap()
+        position += CHUNK_HEADER.size + len(metadata)
+        padding = -position % 8
+        file.write(CHUNK_HEADER.pack(len(metadata), len(chunk)))
+        file.write(metadata)
+        file.write(b"\0" * padding)
+        file.write(column)
+        position += padding + len(chunk) * 8
+        rows += len(chunk)
+    return rows
+
+def read_columnar_chunks(file):
+    """
+    Streams the chunks of a columnar chunk file.
+
+    Args:
+        file (file): Binary file.
+
+    Yields:
+        tuple: The metadata dict and the epoch seconds of every chunk.
+
+    Raises:
+        ValueError: If the file is not a columnar chunk file.
+    """
+    magic, version = FILE_HEADER.unpack(file.read(FILE_HEADER.size))
+    if magic != CHUNK_MAGIC or version != CHUNK_VERSION:
+        raise ValueError("Not a columnar chunk file.")
+    position = FILE_HEADER.size
+    while True:
+        header = file.read(CHUNK_HEADER.size)
+        if not header:
+            return
+        length, count = CHUNK_HEADER.unpack(header)
+        metadata = json.loads(file.read(length))
+        position += CHUNK_HEADER.size + length
+        file.read(-position % 8)
+        position += -position % 8 + count * 8
+        column = array('q')
+        column.frombytes(file.read(count * 8))
+        if sys.byteorder == "big":
+            column.byteswap()
+        yield metadata, column
+
+WRITERS = {'csv': write_csv, 'jsonl': write_jsonl, 'columnar': write_columnar_chunks}
+
+def export_completions(db, output_file, file_format=None, periodicity=None, start=None, end=None,
+                       chunk_size=CHUNK_SIZE):
+    """
+    Exports the completions of a database to a file.
+
+    Args:
+        db (Database): Database to export from, or the path of a JSON
+            snapshot to stream from a memory map (see streamable).
+        output_file (str): The path to write, or '-' for standard output in
+            the text formats.
+        file_format (str): 'csv', 'jsonl' or 'columnar'. Chosen by the file
+            extension if not given.
+        periodicity (str): Only export habits with this periodicity spec.
+        start (date): First local day to export, inclusive.
+        end (date): Last local day to export, inclusive.
+        chunk_size (int): Maximum number of completions held per chunk.
+
+    Returns:
+        dict: Number of exported 'habits' and 'rows', 'seconds' taken and
+        'rows_per_second'.
+    """
+    if file_format is None:
+        file_format = output_format(output_file)
+    started = time.perf_counter()
+    if isinstance(db, str):
+        with mapped_snapshot(db) as data:
+            habits = snapshot_habits(data, periodicity)
+            rows = _write(snapshot_chunks(data, habits, start, end, chunk_size), output_file, file_format)
+    else:
+        habits = export_habits(db, periodicity)
+        rows = _write(completion_chunks(habits, start, end, chunk_size), output_file, file_format)
+    stats = {'habits': len(habits), 'rows': rows, 'seconds': time.perf_counter() - started}
+    stats['rows_per_second'] = stats['rows'] / stats['seconds'] if stats['seconds'] else 0.0
+    return stats
+
+def _write(chunks, output_file, file_format):
+    """
+    Writes completion chunks to a file, or to standard output for the text formats.
+
+    Returns:
+        int: Number of rows written.
+    """
+    if output_file == "-" and file_format != "columnar":
+        return WRITERS[file_format](sys.stdout, chunks)
+    mode, newline = ("wb", None) if file_format == "columnar" else ("w", "")
+    with open(output_file, mode, newline=newline) as file:
+        return WRITERS[file_format](file, chunks)
+
+def output_format(output_file):
+    """
+    Chooses the export format by file extension.
+
+    Args:
+        output_file (str): The path to write.
+
+    Returns:
+        str: 'jsonl', 'columnar' or 'csv'.
+    """
+    if output_file.endswith((".jsonl", ".ndjson")):
+        return "jsonl"
+    return "columnar" if output_file.endswith(".hbx") else "csv"
+
+def date_argument(text):
+    """
+    Parses a date given on the command line.
+
+    Args:
+        text (str): 'YYYY-MM-DD'.
+
+    Returns:
+        date: The parsed date.
+
+    Raises:
+        argparse.ArgumentTypeError: If the date is malformed.
+    """
+    try:
+        return parse_timestamp(text).date()
+    except ValueError:
+        raise argparse.ArgumentTypeError("Invalid date format. Please use YYYY-MM-DD.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export completion events to CSV, JSONL or columnar chunks.")
+    parser.add_argument("output_file", help="file to write, or - for standard output")
+    parser.add_argument("--db", default="db.json", help="database to export from")
+    parser.add_argument("--format", choices=FORMATS, help="output format (default: by extension, .hbx for columnar)")
+    parser.add_argument("--periodicity", help="only export habits with this periodicity spec")
+    parser.add_argument("--start", type=date_argument, help="first day to export (YYYY-MM-DD)")
+    parser.add_argument("--end", type=date_argument, help="last day to export (YYYY-MM-DD)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="completions held in memory at once")
+    args = parser.parse_args()
+    periodicity = args.periodicity
+    if periodicity:
+        from periodicity import canonical_spec
+        try:
+            periodicity = canonical_spec(periodicity)
+        except ValueError as error:
+            parser.error(str(error))
+    db = args.db if streamable(args.db) else open_database(args.db, compact_logs=True, lazy=True)
+    stats = export_completions(db, args.output_file, args.format, periodicity, args.start, args.end, args.chunk_size)
+    print(f"{stats['rows']} rows of {stats['habits']} habits in {stats['seconds']:.1f}s "
+          f"({stats['rows_per_second']:,.0f} rows/s).", file=sys.stderr)
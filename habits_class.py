@@ -2,71 +2,549 @@
 This module provides the Habit class for managing individual habits.
 """
 
-from datetime import datetime, timedelta
+import heapq
+from array import array
+from bisect import bisect_left
+from collections.abc import Sequence
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from itertools import groupby
+from periodicity import EPOCH_ORDINAL, canonical_spec, get_periodicity, start_day
+from timezones import check_day_cutoff, check_timezone, local_day, zone_offsets
+
+EPOCH = datetime(1970, 1, 1)
+ONE_SECOND = timedelta(seconds=1)
+
+class CompactLog(Sequence):
+    """
+    A sorted completion log stored as an array of epoch-second integers.
+
+    Each entry takes 8 bytes instead of a full datetime object. Indexing and
+    iteration still yield datetimes, so it can be used wherever Habit.log is
+    read. Timestamps are naive and counted from 1970-01-01 00:00:00.
+
+    The timestamps may also be a read-only memoryview, for example over a
+    memory-mapped file; it is copied into an array on the first write.
+    """
+
+    __slots__ = ('timestamps',)
+
+    def __init__(self, log=()):
+        """
+        Initializes the log from completion datetimes.
+
+        Args:
+            log (iterable): Completion datetimes in any order.
+        """
+        self.timestamps = array('q', sorted(set(to_timestamp(log_datetime) for log_datetime in log)))
+
+    @classmethod
+    def from_timestamps(cls, timestamps):
+        """
+        Builds a log directly from sorted, unique epoch-second integers.
+
+        Arrays and int64 memoryviews are used without copying.
+
+        Args:
+            timestamps (iterable): Sorted epoch-second integers.
+
+        Returns:
+            CompactLog: The new log.
+        """
+        log = cls.__new__(cls)
+        log.timestamps = timestamps if isinstance(timestamps, (array, memoryview)) else array('q', timestamps)
+        return log
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return CompactLog.from_timestamps(self.timestamps[index])
+        return from_timestamp(self.timestamps[index])
+
+    def __iter__(self):
+        return map(from_timestamp, self.timestamps)
+
+    def __reversed__(self):
+        return map(from_timestamp, reversed(self.timestamps))
+
+    def __contains__(self, log_datetime):
+        timestamp = to_timestamp(log_datetime)
+        index = bisect_left(self.timestamps, timestamp)
+        return index < len(self.timestamps) and self.timestamps[index] == timestamp
+
+    def __eq__(self, other):
+        if isinstance(other, CompactLog):
+            return self.timestamps == other.timestamps
+        return isinstance(other, Sequence) and list(self) == list(other)
+
+    def __repr__(self):
+        return f"CompactLog({list(self)!r})"
+
+    def insert(self, index, log_datetime):
+        """
+        Inserts a completion datetime at the given position.
+        """
+        self._writable().insert(index, to_timestamp(log_datetime))
+
+    def append(self, log_datetime):
+        """
+        Appends a completion datetime.
+        """
+        self._writable().append(to_timestamp(log_datetime))
+
+    def extend(self, log_datetimes):
+        """
+        Appends several completion datetimes.
+        """
+        self._writable().extend(to_timestamp(log_datetime) for log_datetime in log_datetimes)
+
+    def _writable(self):
+        """
+        Returns the timestamps as an array, copying a memoryview if necessary.
+        """
+        if not isinstance(self.timestamps, array):
+            timestamps = array('q')
+            timestamps.frombytes(self.timestamps.cast('B'))
+            self.timestamps = timestamps
+        return self.timestamps
+
+def to_timestamp(log_datetime):
+    """
+    Converts a naive datetime into epoch seconds.
+
+    Args:
+        log_datetime (datetime): Datetime to convert.
+
+    Returns:
+        int: Seconds since 1970-01-01 00:00:00.
+    """
+    return (log_datetime - EPOCH) // ONE_SECOND
+
+def from_timestamp(timestamp):
+    """
+    Converts epoch seconds into a naive datetime.
+
+    Args:
+        timestamp (int): Seconds since 1970-01-01 00:00:00.
+
+    Returns:
+        datetime: The corresponding datetime.
+    """
+    return EPOCH + timedelta(seconds=timestamp)
+
+def parse_timestamp(text):
+    """
+    Parses a timestamp in the fixed 'YYYY-MM-DD HH:MM:SS' format.
+
+    Uses datetime.fromisoformat, which is much faster than strptime.
+
+    Args:
+        text (str): Timestamp to parse.
+
+    Returns:
+        datetime: The parsed datetime.
+    """
+    return datetime.fromisoformat(text)
+
+def format_timestamp(log_datetime):
+    """
+    Formats a datetime in the fixed 'YYYY-MM-DD HH:MM:SS' format.
+
+    Args:
+        log_datetime (datetime): Datetime to format.
+
+    Returns:
+        str: The formatted timestamp.
+    """
+    return log_datetime.isoformat(' ', 'seconds')
 
 class Habit:
     """
     Represents a habit.
+
+    Without a timezone, completions are naive local wall-clock datetimes.
+    With one, they are stored as naive UTC datetimes and only converted to
+    local days for bucketing into periods; see the timezones module.
     """
 
-    def __init__(self, name, start_date, log, periodicity='daily'):
+    __slots__ = ('name', 'start_date', 'periodicity', 'timezone', 'day_cutoff', '_log', '_log_loader', '_streak',
+                 '_last_day', '_summary', '_serialized')
+
+    def __init__(self, name, start_date, log, periodicity='daily', summary=None, timezone=None, day_cutoff=0):
         """
         Initializes a new Habit.
 
         Args:
             name (str): Name of the habit.
-            start_date (datetime): Start date of the habit.
-            log (list): List of completion datetimes.
-            periodicity (str): Periodicity of the habit ('daily' or 'weekly').
+            start_date (datetime): Start date of the habit, a local date.
+            log (list): List of completion datetimes, or a CompactLog.
+            periodicity (str): Periodicity spec of the habit, e.g. 'daily',
+                'weekly' or 'every:3'; see the periodicity module.
+            summary (dict): Stored summary of the log, as returned by summary().
+                Computed from the log when needed if not given or if it was
+                computed for another periodicity, timezone or day cutoff.
+            timezone (str): IANA timezone of the habit, e.g. 'Europe/Berlin',
+                or None for naive local time.
+            day_cutoff (int): Hour from 0 to 23 at which the habit's day
+                starts; earlier completions count for the previous day.
+
+        Raises:
+            ValueError: If the periodicity spec, timezone or day cutoff is
+                invalid.
         """
         self.name = name
         self.start_date = start_date
+        self.periodicity = canonical_spec(periodicity)
+        self.timezone = check_timezone(timezone)
+        self.day_cutoff = check_day_cutoff(day_cutoff)
+        self._log_loader = None
         self.log = log
-        self.periodicity = periodicity
+        self._summary = self._stored_summary(summary)
+
+    @classmethod
+    def lazy(cls, name, start_date, log_loader, periodicity='daily', summary=None, timezone=None, day_cutoff=0):
+        """
+        Creates a habit whose log is only loaded when it is first accessed.
+
+        Args:
+            name (str): Name of the habit.
+            start_date (datetime): Start date of the habit.
+            log_loader (callable): Returns the completion log when called.
+            periodicity (str): Periodicity spec of the habit.
+            summary (dict): Stored summary of the log, as returned by summary(),
+                so it can be read without loading the log.
+            timezone (str): IANA timezone of the habit, or None.
+            day_cutoff (int): Hour at which the habit's day starts.
+
+        Returns:
+            Habit: The new Habit object.
+
+        Raises:
+            ValueError: If the periodicity spec, timezone or day cutoff is
+                invalid.
+        """
+        habit = cls.__new__(cls)
+        habit.name = name
+        habit.start_date = start_date
+        habit.periodicity = canonical_spec(periodicity)
+        habit.timezone = check_timezone(timezone)
+        habit.day_cutoff = check_day_cutoff(day_cutoff)
+        habit._log = None
+        habit._log_loader = log_loader
+        habit._streak = None
+        habit._last_day = None
+        habit._summary = habit._stored_summary(summary)
+        habit._serialized = None
+        return habit
+
+    @property
+    def log_loaded(self):
+        """
+        bool: Whether the completion log has been loaded.
+        """
+        return self._log is not None
+
+    @property
+    def log(self):
+        """
+        list: Completion datetimes, sorted in ascending order. This is a
+        CompactLog if the habit was created with one.
+
+        Use log_entry to add entries so that the cached streak stays valid.
+        """
+        if self._log is None:
+            summary, serialized = self._summary, self._serialized
+            self.log = self._log_loader()
+            self._log_loader = None
+            self._summary, self._serialized = summary, serialized
+        return self._log
+
+    def peek_log(self):
+        """
+        Returns the completion log without keeping a lazily loaded log in memory.
+
+        Streaming readers use this, so visiting every habit of a large
+        database does not leave every log loaded.
+
+        Returns:
+            list: Completion datetimes, sorted in ascending order, or a
+            CompactLog.
+        """
+        if self._log is not None:
+            return self._log
+        log = self._log_loader()
+        return log if isinstance(log, CompactLog) else sorted(log)
+
+    @log.setter
+    def log(self, log):
+        """
+        Replaces the completion log and invalidates the cached streak,
+        summary and serialization.
+
+        Args:
+            log (list): List of completion datetimes, or a CompactLog.
+        """
+        self._log = log if isinstance(log, CompactLog) else sorted(log)
+        self._streak = None
+        self._summary = None
+        self._serialized = None
+        self._last_day = self.day_number(self._log[-1]) if self._log else None
+
+    def normalize(self, log_datetime):
+        """
+        Converts a completion datetime into the form stored in the log.
+
+        Aware datetimes are converted to UTC for habits with a timezone and
+        to their own wall-clock time otherwise; naive datetimes are taken as
+        already stored. Microseconds are dropped.
+
+        Args:
+            log_datetime (datetime): Completion datetime.
+
+        Returns:
+            datetime: The naive datetime to store.
+        """
+        if log_datetime.tzinfo is not None:
+            if self.timezone is not None:
+                log_datetime = log_datetime.astimezone(dt_timezone.utc)
+            log_datetime = log_datetime.replace(tzinfo=None)
+        return log_datetime.replace(microsecond=0)
+
+    def from_local(self, local_datetime):
+        """
+        Converts a wall-clock time in the habit's timezone into the stored form.
+
+        Use this for times entered by the user. Ambiguous times at the end of
+        daylight saving time resolve to the first occurrence.
+
+        Args:
+            local_datetime (datetime): Naive local datetime.
+
+        Returns:
+            datetime: The naive datetime to store.
+        """
+        if self.timezone is not None and local_datetime.tzinfo is None:
+            local_datetime = local_datetime.replace(tzinfo=zone_offsets(self.timezone).zone)
+        return self.normalize(local_datetime)
+
+    def day_number(self, log_datetime):
+        """
+        Returns the local day a stored completion counts for.
+
+        Args:
+            log_datetime (datetime): Stored completion datetime.
+
+        Returns:
+            int: Days since 1970-01-01 in the habit's timezone, shifted by
+            its day cutoff.
+        """
+        if self.timezone is None and not self.day_cutoff:
+            return log_datetime.toordinal() - EPOCH_ORDINAL
+        return local_day(to_timestamp(log_datetime), self.timezone, self.day_cutoff)
 
     def calculate_streak(self):
         """
-        Calculates the current streak of the habit.
+        Returns the current streak of the habit.
+
+        The streak is cached and kept up to date by log_entry, so repeated
+        calls do not walk the log again.
 
         Returns:
             int: Current streak of consecutive completions.
         """
-        streak = 0
-        today = datetime.today().date()
-
-        if not self.log:
-            return streak
-
-        sorted_log = sorted(self.log, reverse=True)
-        current_date = sorted_log[0].date()
-
-        if self.periodicity == 'daily':
-            for log_datetime in sorted_log:
-                log_date = log_datetime.date()
-                if log_date == current_date:
-                    streak += 1
-                    current_date -= timedelta(days=1)
-                else:
-                    break
-        elif self.periodicity == 'weekly':
-            for log_datetime in sorted_log:
-                log_date = log_datetime.date()
-                if log_date >= current_date - timedelta(days=6):
-                    streak += 1
-                    current_date -= timedelta(days=7)
-                else:
-                    break
-
-        return streak
+        if self._streak is None:
+            self._streak = self._compute_streak()
+        return self._streak
+
+    def summary(self):
+        """
+        Returns the materialized summary of the habit.
+
+        The summary is computed from the log on first use and afterwards kept
+        up to date by log_entry, or taken from storage for lazily loaded
+        habits, so reading it does not touch the log. It must not be modified.
+
+        Returns:
+            dict: 'total' completions, 'first' and 'last' completion as
+            'YYYY-MM-DD HH:MM:SS' (None without completions), 'current_streak',
+            'longest_streak', 'current_run' (the run of completed periods
+            ending with the last completed period), 'weekly_counts' by local
+            ISO week ('YYYY-Www') and the 'periodicity' it was computed for,
+            plus the 'timezone' and 'day_cutoff' if the habit has them.
+        """
+        if self._summary is None:
+            from streaks import summarize
+            self._summary = summarize(self)
+        return self._summary
+
+    def _stored_summary(self, summary):
+        """
+        Returns a stored summary if it was computed for the habit's settings.
+
+        Args:
+            summary (dict): Stored summary, or None.
+
+        Returns:
+            dict: The summary, or None if it must be recomputed.
+        """
+        return summary if self.matches_summary(summary) else None
+
+    def matches_summary(self, summary):
+        """
+        Checks whether a stored summary was computed for the habit's settings.
+
+        Args:
+            summary (dict): Stored summary, or None.
+
+        Returns:
+            bool: False if there is no summary or it was computed for another
+            periodicity, timezone or day cutoff.
+        """
+        return bool(summary) and summary.get('periodicity') == self.periodicity and (
+            summary.get('timezone') == self.timezone and summary.get('day_cutoff', 0) == self.day_cutoff)
+
+    def serialized(self, key, serialize, cache=True):
+        """
+        Returns the cached serialization of the habit, serializing it if needed.
+
+        The cache is dropped whenever the log changes, so storage backends
+        only serialize the habits that changed since they were last written.
+
+        Args:
+            key (tuple): Describes the serialization, e.g. its format and the
+                habit's attributes; a value cached under another key is
+                replaced.
+            serialize (callable): Called with the habit to serialize it.
+            cache (bool): Keep a newly computed serialization for later calls.
+
+        Returns:
+            object: The serialization returned by serialize.
+        """
+        if self._serialized is not None and self._serialized[0] == key:
+            return self._serialized[1]
+        value = serialize(self)
+        if cache:
+            self._serialized = (key, value)
+        return value
+
+    def _compute_streak(self):
+        """
+        Calculates the current streak with the periodicity engine.
+
+        Returns:
+            int: Current streak of consecutive completed periods.
+        """
+        from streaks import current_streak
+        return current_streak(self)
 
     def log_entry(self, log_datetime):
         """
         Logs a new entry for the habit.
 
+        The entry is placed with a binary search, so duplicates are detected
+        without scanning the log. A newer entry updates the cached streak in
+        constant time when every period needs a single completion; otherwise,
+        and after an out-of-order backfill, the streak is recomputed on demand.
+
+        Args:
+            log_datetime (datetime): Datetime to log for the habit, naive in
+                the stored form or aware; see normalize.
+        """
+        log_datetime = self.normalize(log_datetime)
+        index = bisect_left(self.log, log_datetime)
+        if index < len(self._log):
+            if self._log[index] != log_datetime:
+                self._log.insert(index, log_datetime)
+                self._streak = None
+                self._summary = None
+                self._serialized = None
+            return
+        day = self.day_number(log_datetime)
+        strategy = get_periodicity(self.periodicity)
+        if self._streak is not None and self._last_day is not None and strategy.required == 1:
+            start = start_day(self)
+            period = strategy.ordinal(day, start)
+            last = strategy.ordinal(self._last_day, start)
+            if period is None or last is None:
+                self._streak = None
+            elif period == last + 1:
+                self._streak += 1
+            elif period != last:
+                self._streak = 1
+        else:
+            self._streak = None
+        self._log.append(log_datetime)
+        self._last_day = day
+        self._serialized = None
+        if self._summary is not None:
+            self._update_summary(log_datetime)
+
+    def _update_summary(self, log_datetime):
+        """
+        Updates the summary for an entry appended after all others.
+
+        Summaries of periodicities needing several completions per period, or
+        ignoring some days, are recomputed on demand instead.
+
+        Args:
+            log_datetime (datetime): The appended entry.
+        """
+        summary = self._summary
+        strategy = get_periodicity(self.periodicity)
+        start = start_day(self)
+        day = self.day_number(log_datetime)
+        period = strategy.ordinal(day, start)
+        last = None
+        if summary['last'] is not None:
+            last = strategy.ordinal(self.day_number(parse_timestamp(summary['last'])), start)
+        if strategy.required != 1 or period is None or (last is None and summary['last'] is not None):
+            self._summary = None
+            return
+        year, week, _ = date.fromordinal(day + EPOCH_ORDINAL).isocalendar()
+        week_key = f"{year}-W{week:02d}"
+        if last is None:
+            summary['current_run'] = 1
+        else:
+            summary['current_run'] = summary['current_run'] + 1 if period == last + 1 else (
+                summary['current_run'] if period == last else 1)
+        summary['total'] += 1
+        summary['first'] = summary['first'] or format_timestamp(log_datetime)
+        summary['last'] = format_timestamp(log_datetime)
+        summary['weekly_counts'][week_key] = summary['weekly_counts'].get(week_key, 0) + 1
+        summary['current_streak'] = self.calculate_streak()
+        summary['longest_streak'] = max(summary['longest_streak'], summary['current_run'])
+
+    def log_entries(self, log_datetimes):
+        """
+        Logs a batch of entries for the habit.
+
+        The batch is sorted once and merged with the existing log in a single
+        linear pass, which is much faster than calling log_entry per entry
+        when backfilling history.
+
         Args:
-            log_datetime (datetime): Datetime to log for the habit.
+            log_datetimes (iterable): Datetimes to log for the habit, as for
+                log_entry.
+
+        Returns:
+            int: Number of entries that were not already logged.
         """
-        log_datetime = log_datetime.replace(second=0, microsecond=0)
-        if log_datetime not in self.log:
-            self.log.append(log_datetime)
-            self.log = sorted(self.log)
+        new_entries = sorted(set(map(self.normalize, log_datetimes)))
+        if not new_entries:
+            return 0
+        size = len(self.log)
+        if not self._log or new_entries[0] > self._log[-1]:
+            self._log.extend(new_entries)
+        elif isinstance(self._log, CompactLog):
+            new_timestamps = map(to_timestamp, new_entries)
+            self._log = CompactLog.from_timestamps(
+                timestamp for timestamp, _ in groupby(heapq.merge(self._log.timestamps, new_timestamps))
+            )
+        else:
+            self._log = [log_datetime for log_datetime, _ in groupby(heapq.merge(self._log, new_entries))]
+        self._streak = None
+        self._summary = None
+        self._serialized = None
+        self._last_day = self.day_number(self._log[-1])
+        return len(self._log) - size
@@ -0,0 +1,143 @@
+"""
+This module imports completion histories from CSV or JSONL files.
+
+Each input row is one completion event of a habit:
+
+    CSV:   habit,timestamp            (the header row is optional)
+    JSONL: {"habit": "...", "timestamp": "YYYY-MM-DD HH:MM:SS"}
+
+JSONL timestamps may also be epoch seconds. Naive timestamps are stored as
+given, so for habits with a timezone they must be in UTC or carry a UTC
+offset. Events are streamed from the file and grouped per habit in chunks of
+bounded size; each chunk is merged into the existing logs with one sorted
+merge per habit, and the database is written once at the end of the import.
+"""
+
+import argparse
+import csv
+import json
+import os
+import time
+from contextlib import nullcontext
+from datetime import datetime
+from itertools import islice
+from db import open_database
+from habits_class import Habit, from_timestamp, parse_timestamp
+from periodicity import canonical_spec
+
+CHUNK_SIZE = 1000000
+
+def read_events(event_file, file_format=None):
+    """
+    Streams completion events from a CSV or JSONL file.
+
+    Args:
+        event_file (str): The path to the file to read.
+        file_format (str): 'csv' or 'jsonl'. Chosen by the file extension if
+            not given.
+
+    Yields:
+        tuple: The habit name and the completion datetime of every event.
+
+    Raises:
+        ValueError: If a row cannot be parsed; CSV errors name the line.
+            Blank lines are skipped.
+    """
+    if file_format is None:
+        file_format = "jsonl" if event_file.endswith((".jsonl", ".ndjson")) else "csv"
+    with open(event_file, "r", newline="") as file:
+        if file_format == "jsonl":
+            for line in file:
+                if not line.strip():
+                    continue
+                event = json.loads(line)
+                timestamp = event['timestamp']
+                yield event['habit'], from_timestamp(timestamp) if isinstance(timestamp, int) else parse_timestamp(timestamp)
+            return
+        rows = csv.reader(file)
+        first = True
+        for row in rows:
+            if not any(column.strip() for column in row):
+                continue
+            if first and [column.strip().lower() for column in row[:2]] == ['habit', 'timestamp']:
+                first = False
+                continue
+            first = False
+            if len(row) < 2:
+                raise ValueError(f"{event_file}, line {rows.line_num}: expected habit,timestamp, got {row!r}.")
+            try:
+                log_datetime = parse_timestamp(row[1])
+            except ValueError:
+                raise ValueError(f"{event_file}, line {rows.line_num}: invalid timestamp {row[1]!r}.") from None
+            yield row[0], log_datetime
+
+def import_events(db, events, create_missing=False, periodicity="daily", chunk_size=CHUNK_SIZE):
+    """
+    Imports completion events into a database.
+
+    Args:
+        db (Database): Database to import into.
+        events (iterable): (habit name, datetime) pairs, e.g. from read_events.
+        create_missing (bool): Add habits that are not in the database yet,
+            starting on the day of their first event in the chunk.
+        periodicity (str): Periodicity of created habits.
+        chunk_size (int): Maximum number of events grouped in memory. Pending
+            events are checkpointed after every chunk, so memory stays
+            bounded by it.
+
+    Returns:
+        dict: Number of 'rows' read, 'imported' new entries, 'skipped' rows of
+        unknown habits, 'seconds' taken and 'rows_per_second'.
+    """
+    stats = {'rows': 0, 'imported': 0, 'skipped': 0}
+    started = time.perf_counter()
+    events = iter(events)
+    with db.batch() if hasattr(db, "batch") else nullcontext():
+        for chunk in iter(lambda: list(islice(events, chunk_size)), []):
+            groups = {}
+            for name, log_datetime in chunk:
+                groups.setdefault(name, []).append(log_datetime)
+            stats['rows'] += len(chunk)
+            del chunk
+            for name, log_datetimes in groups.items():
+                if create_missing and db.get_habit(name) is None:
+                    start_date = datetime.combine(min(log_datetimes).date(), datetime.min.time())
+                    db.add_habit(Habit(name, start_date, [], periodicity))
+                added = db.log_entries(name, log_datetimes)
+                if added is None:
+                    stats['skipped'] += len(log_datetimes)
+                else:
+                    stats['imported'] += added
+            del groups
+            if hasattr(db, "checkpoint"):
+                db.checkpoint()
+    stats['seconds'] = time.perf_counter() - started
+    stats['rows_per_second'] = stats['rows'] / stats['seconds'] if stats['seconds'] else 0.0
+    return stats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import completion events from CSV or JSONL files.")
+    parser.add_argument("event_files", nargs="+", help="files with habit,timestamp events")
+    parser.add_argument("--db", default="db.json", help="database to import into")
+    parser.add_argument("--format", choices=("csv", "jsonl"), help="input format (default: by extension)")
+    parser.add_argument("--create-missing", action="store_true", help="add habits that do not exist yet")
+    parser.add_argument("--periodicity", default="daily",
+                        help="periodicity spec of created habits, e.g. daily, weekly:3 or every:2")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="events grouped in memory at once")
+    parser.add_argument("--profile", nargs="?", const="summary", metavar="FILE",
+                        help="record timings of the database hot paths; print them at exit or write them to FILE")
+    args = parser.parse_args()
+    try:
+        canonical_spec(args.periodicity)
+    except ValueError as error:
+        parser.error(str(error))
+    if args.profile or os.environ.get("HABIT_PROFILE"):
+        from instrumentation import enable_from_environment
+        enable_from_environment(args.profile)
+    db = open_database(args.db, compact_logs=True, flush_every=None)
+    for event_file in args.event_files:
+        stats = import_events(db, read_events(event_file, args.format), args.create_missing,
+                              args.periodicity, args.chunk_size)
+        print(f"{event_file}: {stats['rows']} rows, {stats['imported']} new entries, "
+              f"{stats['skipped']} skipped in {stats['seconds']:.1f}s ({stats['rows_per_second']:,.0f} rows/s).")
+    db.close()
@@ -0,0 +1,285 @@
+"""
+This module provides opt-in instrumentation of the database and habit hot paths.
+
+When enabled, the methods listed in INSTRUMENTED, including every public
+query method of the database classes, are replaced by wrappers
+that record call counts, total and extreme latencies, a latency histogram
+and, for methods touching the database files, the bytes read or written.
+When disabled the original methods are left in place, so there is no
+overhead at all.
+
+Enable it with the HABIT_PROFILE environment variable or the --profile flag
+of main.py:
+
+    HABIT_PROFILE=1 python main.py              summary table on stderr at exit
+    HABIT_PROFILE=stats.json python main.py     JSON stats written at exit
+"""
+
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+import db
+from db import Database, file_state
+from habits_class import Habit
+from sharded_db import ShardedDatabase
+from sqlite_db import SQLiteDatabase
+
+ENVIRONMENT_VARIABLE = "HABIT_PROFILE"
+
+# Upper bounds of the latency histogram buckets, in seconds; the last bucket
+# collects everything slower.
+BUCKETS = (1e-6, 1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1.0, 10.0)
+BUCKET_LABELS = ("<1us", "<10us", "<100us", "<1ms", "<10ms", "<100ms", "<1s", "<10s", ">=10s")
+
+MUTATIONS = ("add_habit", "delete_habit", "log_entry", "log_entries")
+
+def query_methods(cls):
+    """
+    Returns the public query methods of a class, those named get_*.
+
+    Args:
+        cls (type): The class to inspect.
+
+    Returns:
+        tuple: Method names, sorted.
+    """
+    return tuple(sorted(name for name, value in vars(cls).items() if name.startswith("get_") and callable(value)))
+
+INSTRUMENTED = {
+    Database: ("load_db", "save_db", "flush") + query_methods(Database) + MUTATIONS,
+    SQLiteDatabase: ("load_db", "save_db", "flush") + query_methods(SQLiteDatabase) + MUTATIONS,
+    ShardedDatabase: query_methods(ShardedDatabase) + MUTATIONS,
+    Habit: ("calculate_streak", "log_entry", "log_entries")
+}
+
+# Methods whose file I/O is measured, as 'read' or 'write'.
+FILE_IO = {"load_db": "read", "save_db": "write", "flush": "write"}
+
+_stats = {}
+_stats_lock = threading.Lock()
+_originals = {}
+_exit_output = None
+
+def enable(output="summary"):
+    """
+    Installs the instrumentation wrappers.
+
+    Calling it again only changes where the stats are reported.
+
+    Args:
+        output (str): 'summary' to print a table on stderr at exit, the path
+            of a JSON file to write the stats to at exit, or None to only
+            collect them.
+    """
+    global _exit_output
+    if not _originals:
+        for cls, names in INSTRUMENTED.items():
+            for name in names:
+                original = cls.__dict__[name]
+                _originals[cls, name] = original
+                setattr(cls, name, _wrap(f"{cls.__name__}.{name}", original, FILE_IO.get(name)))
+        atexit.register(_report_at_exit)
+    _exit_output = output
+
+def disable():
+    """
+    Restores the original methods and stops reporting at exit.
+    """
+    global _exit_output
+    for (cls, name), original in _originals.items():
+        setattr(cls, name, original)
+    _originals.clear()
+    _exit_output = None
+    atexit.unregister(_report_at_exit)
+
+def enabled():
+    """
+    Tells whether the instrumentation is installed.
+
+    Returns:
+        bool: True if the methods are wrapped.
+    """
+    return bool(_originals)
+
+def enable_from_environment(flag=None):
+    """
+    Enables the instrumentation if requested by a CLI flag or HABIT_PROFILE.
+
+    Args:
+        flag (str): Value of a --profile command line option, if given.
+            Takes precedence over the environment variable.
+
+    Returns:
+        bool: True if the instrumentation was enabled.
+    """
+    value = flag if flag is not None else os.environ.get(ENVIRONMENT_VARIABLE, "")
+    if value in ("", "0"):
+        return False
+    enable("summary" if value in ("1", "summary") else value)
+    return True
+
+def reset():
+    """
+    Discards all collected stats.
+    """
+    with _stats_lock:
+        _stats.clear()
+
+def snapshot():
+    """
+    Returns a copy of the collected stats.
+
+    Returns:
+        dict: Stats by qualified method name, each with 'calls', 'total',
+        'min' and 'max' seconds, 'histogram' counts by BUCKET_LABELS, and
+        'bytes_read' and 'bytes_written'.
+    """
+    with _stats_lock:
+        return {
+            name: dict(stats, histogram=dict(zip(BUCKET_LABELS, stats['histogram'])))
+            for name, stats in sorted(_stats.items())
+        }
+
+def summary():
+    """
+    Formats the collected stats as a table.
+
+    Returns:
+        str: One line per method, slowest total first.
+    """
+    rows = sorted(snapshot().items(), key=lambda item: item[1]['total'], reverse=True)
+    lines = [f"{'method':<45}{'calls':>10}{'total ms':>12}{'mean us':>12}{'max ms':>10}{'read KiB':>11}{'written KiB':>13}"]
+    for name, stats in rows:
+        lines.append(
+            f"{name:<45}{stats['calls']:>10}{stats['total'] * 1e3:>12.2f}"
+            f"{stats['total'] / stats['calls'] * 1e6:>12.1f}{stats['max'] * 1e3:>10.2f}"
+            f"{stats['bytes_read'] / 1024:>11.1f}{stats['bytes_written'] / 1024:>13.1f}"
+        )
+    return "\n".join(lines)
+
+def dump(output):
+    """
+    Reports the collected stats.
+
+    Args:
+        output (str): 'summary' to print a table on stderr, or the path of a
+            JSON file to write.
+    """
+    if output == "summary":
+        print(summary(), file=sys.stderr)
+    else:
+        with open(output, "w") as file:
+            json.dump(snapshot(), file, indent=4)
+
+def record(name, seconds, bytes_read=0, bytes_written=0):
+    """
+    Adds one call to the stats of a method.
+
+    Args:
+        name (str): Qualified method name.
+        seconds (float): Latency of the call.
+        bytes_read (int): Bytes read from the database files.
+        bytes_written (int): Bytes written to the database files.
+    """
+    with _stats_lock:
+        stats = _stats.get(name)
+        if stats is None:
+            stats = _stats[name] = {'calls': 0, 'total': 0.0, 'min': seconds, 'max': seconds,
+                                    'histogram': [0] * len(BUCKET_LABELS), 'bytes_read': 0, 'bytes_written': 0}
+        stats['calls'] += 1
+        stats['total'] += seconds
+        stats['min'] = min(stats['min'], seconds)
+        stats['max'] = max(stats['max'], seconds)
+        stats['histogram'][bisect_left(BUCKETS, seconds)] += 1
+        stats['bytes_read'] += bytes_read
+        stats['bytes_written'] += bytes_written
+
+def _wrap(name, method, file_io):
+    """
+    Returns a wrapper recording the calls of a method.
+
+    Args:
+        name (str): Qualified method name.
+        method (callable): The original method.
+        file_io (str): 'read' or 'write' to measure the database files, or None.
+
+    Returns:
+        callable: The wrapper.
+    """
+    if file_io is None:
+        @wraps(method)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                record(name, time.perf_counter() - started)
+        return wrapper
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        files = _database_files(self)
+        before = [file_state(path) for path in files]
+        started = time.perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - started
+            if file_io == "read":
+                record(name, seconds, bytes_read=sum(state[1] for state in before if state))
+            else:
+                record(name, seconds, bytes_written=_bytes_written(before, [file_state(path) for path in files]))
+    return wrapper
+
+def _database_files(database):
+    """
+    Returns the files backing a database.
+
+    Args:
+        database (Database): Database or SQLiteDatabase.
+
+    Returns:
+        list: The data file, and the journal files of a JSON database.
+    """
+    if isinstance(database, Database):
+        return [database.db_file, database._compacting_file(), database.journal_file]
+    return [database.db_file]
+
+def _bytes_written(before, after):
+    """
+    Estimates the bytes written from file fingerprints taken around a call.
+
+    A file that grew in place was appended to; any other changed file was
+    rewritten as a whole.
+
+    Args:
+        before (list): file_state of every file before the call.
+        after (list): file_state of every file after the call.
+
+    Returns:
+        int: Estimated number of bytes written.
+    """
+    written = 0
+    for old, new in zip(before, after):
+        if new is None or new == old:
+            continue
+        if old is not None and old[0] == new[0] and new[1] >= old[1]:
+            written += new[1] - old[1]
+        else:
+            written += new[1]
+    return written
+
+def _report_at_exit():
+    """
+    Flushes open databases, so their writes are counted, then reports the stats.
+    """
+    if _exit_output is None:
+        return
+    db._flush_open_databases()
+    if _stats:
+        dump(_exit_output)
@@ -3,16 +3,32 @@
 This module provides the main interface for interacting with the habit tracker.
 """
 
-from db import Database
-from habits_class import Habit
-import questionary
+import argparse
+import os
+import sys
+from db import open_database
+from habits_class import Habit, parse_timestamp
+from periodicity import canonical_spec, get_periodicity
 from datetime import datetime
 
-def main():
+# questionary pulls in prompt_toolkit, which takes longer to import than the
+# rest of the application, so it is only imported for the interactive menu.
+questionary = None
+
+# Subcommands replay the journal on every start; at this size that takes about
+# 30 ms, and folding it into the snapshot costs about the same once.
+JOURNAL_LIMIT = 256 * 1024
+
+def main(db_file=None):
     """
     Main function to run the habit tracker application.
+
+    Args:
+        db_file (str): The path to the database. Defaults to $HABIT_DB or db.json.
     """
-    db = Database()
+    global questionary
+    import questionary
+    db = open_database(db_file or os.environ.get("HABIT_DB", "db.json"), lazy=True)
 
     greeting_message = """
     ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -46,6 +62,9 @@ def add_habit(db):
     name = questionary.text("Enter the name of the habit (type 'menu' to return to main menu):").ask()
     if name.lower() == 'menu':
         return
+    if db.get_habit(name) is not None:
+        print(f"Habit '{name}' already exists.")
+        return
 
     start_date_str = questionary.text("Enter the start date (YYYY-MM-DD) (type 'menu' to return to main menu):").ask()
     if start_date_str.lower() == 'menu':
@@ -53,28 +72,46 @@ def add_habit(db):
 
     try:
         start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
-        periodicity = questionary.select(
-            "Select the periodicity of the habit (type 'menu' to return to main menu):",
-            choices=["daily", "weekly"]
-        ).ask()
-        if periodicity.lower() == 'menu':
-            return
-
-        habit = Habit(name=name, start_date=start_date, log=[], periodicity=periodicity)
-        db.add_habit(habit)
-        print(f"Habit '{name}' added with {periodicity} periodicity.")
     except ValueError:
         print("Invalid date format. Please use YYYY-MM-DD.")
+        return
+
+    periodicity = questionary.select(
+        "Select the periodicity of the habit (type 'menu' to return to main menu):",
+        choices=["daily", "weekly", "monthly", "weekdays", "every N days", "N times per week"]
+    ).ask()
+    if periodicity.lower() == 'menu':
+        return
+    if periodicity in ("every N days", "N times per week"):
+        count = questionary.text("Enter N:").ask()
+        periodicity = f"every:{count}" if periodicity == "every N days" else f"weekly:{count}"
+
+    timezone = questionary.text("Enter the timezone (e.g. Europe/Berlin), or leave empty for local time:").ask()
+    day_cutoff = questionary.text("Enter the hour at which the day starts (0-23), or leave empty for midnight:").ask()
+
+    try:
+        habit = Habit(name=name, start_date=start_date, log=[], periodicity=periodicity, timezone=timezone or None,
+                      day_cutoff=int(day_cutoff) if day_cutoff else 0)
+    except ValueError as error:
+        print(error)
+        return
+    db.add_habit(habit)
+    print(f"Habit '{name}' added with {habit.periodicity} periodicity.")
 
 def view_habits(db):
     """
-    Displays all habits in the database.
+    Displays all habits in the database with their stored summaries, without
+    reading the completion logs.
     """
     habits = db.get_all_habits()
     if not habits:
         print("No habits found.")
+    summaries = db.get_summaries()
     for habit in habits:
-        print(f"Habit: {habit.name}, Start Date: {habit.start_date}, Periodicity: {habit.periodicity}")
+        summary = summaries[habit.name]
+        print(f"Habit: {habit.name}, Start Date: {habit.start_date}, Periodicity: {habit.periodicity}, "
+              f"Completions: {summary['total']}, Last: {summary['last'] or '-'}, "
+              f"Current streak: {summary['current_streak']}, Longest streak: {summary['longest_streak']}")
 
 def analyze_habits(db):
     """
@@ -82,7 +119,7 @@ def analyze_habits(db):
     """
     action = questionary.select(
         "Select an analytical function:",
-        choices=["Analyze a specific habit", "Longest run streak of all habits", "Longest run streak for a given habit", "List habits by periodicity", "Return to main menu"]
+        choices=["Analyze a specific habit", "Longest run streak of all habits", "Longest run streak for a given habit", "Longest run streaks of every habit", "List habits by periodicity", "Return to main menu"]
     ).ask()
 
     if action == "Analyze a specific habit":
@@ -92,6 +129,9 @@ def analyze_habits(db):
         print(f"The longest run streak of all habits is {longest_streak} entries by '{habit_name}'.")
     elif action == "Longest run streak for a given habit":
         longest_streak_for_habit(db)
+    elif action == "Longest run streaks of every habit":
+        for habit_name, longest_streak in db.get_longest_streaks().items():
+            print(f"Habit: {habit_name}, Longest run streak: {longest_streak}")
     elif action == "List habits by periodicity":
         list_habits_by_periodicity(db)
 
@@ -120,8 +160,7 @@ def log_entry(db):
 
     try:
         date = datetime.strptime(date_str, '%Y-%m-%d')
-        habit.log_entry(date)
-        db.save_db()
+        db.log_entry(habit.name, habit.from_local(date))
         print(f"Logged entry for habit: {habit.name} on {date.strftime('%Y-%m-%d')}")
     except ValueError:
         print("Invalid date format. Please use YYYY-MM-DD.")
@@ -191,11 +230,8 @@ def longest_streak_for_habit(db):
         return
 
     longest_streak = db.get_longest_streak_for_habit(habit_name)
-    habit = db.get_habit(habit_name)
-    if habit.periodicity == 'weekly':
-        print(f"The longest run streak for habit '{habit_name}' is {longest_streak} week(s).")
-    else:
-        print(f"The longest run streak for habit '{habit_name}' is {longest_streak} day(s).")
+    unit = get_periodicity(db.get_habit(habit_name).periodicity).unit
+    print(f"The longest run streak for habit '{habit_name}' is {longest_streak} {unit}(s).")
 
 def list_habits_by_periodicity(db):
     """
@@ -203,7 +239,7 @@ def list_habits_by_periodicity(db):
     """
     periodicity = questionary.select(
         "Select the periodicity:",
-        choices=["daily", "weekly"]
+        choices=sorted({habit.periodicity for habit in db.get_all_habits()}) or ["daily"]
     ).ask()
     habits = db.get_habits_by_periodicity(periodicity)
     if not habits:
@@ -211,5 +247,175 @@ def list_habits_by_periodicity(db):
     for habit in habits:
         print(f"Habit: {habit.name}, Start Date: {habit.start_date}")
 
+def command_log(db, args):
+    """
+    Logs an entry for a habit from the command line.
+
+    Args:
+        db (Database): The database to update.
+        args (argparse.Namespace): Parsed arguments with habit and date, a
+            wall-clock time in the habit's timezone.
+
+    Returns:
+        int: Exit status.
+    """
+    habit = db.get_habit(args.habit)
+    if habit is None:
+        print(f"Habit '{args.habit}' not found.", file=sys.stderr)
+        return 1
+    log_datetime = args.date or datetime.now()
+    db.log_entry(habit.name, habit.from_local(args.date) if args.date else log_datetime.astimezone())
+    print(f"Logged entry for habit: {args.habit} on {log_datetime.strftime('%Y-%m-%d')}")
+    return 0
+
+def command_streak(db, args):
+    """
+    Prints the current and longest streak of a habit from its stored summary.
+
+    Args:
+        db (Database): The database to read.
+        args (argparse.Namespace): Parsed arguments with habit.
+
+    Returns:
+        int: Exit status.
+    """
+    summary = db.get_summary(args.habit)
+    if summary is None:
+        print(f"Habit '{args.habit}' not found.", file=sys.stderr)
+        return 1
+    print(f"Habit: {args.habit}, Current streak: {summary['current_streak']}, "
+          f"Longest streak: {summary['longest_streak']}")
+    return 0
+
+def command_list(db, args):
+    """
+    Lists habits, optionally filtered by periodicity.
+
+    Args:
+        db (Database): The database to read.
+        args (argparse.Namespace): Parsed arguments with periodicity.
+
+    Returns:
+        int: Exit status.
+    """
+    habits = db.get_habits_by_periodicity(args.periodicity) if args.periodicity else db.get_all_habits()
+    for habit in habits:
+        print(f"Habit: {habit.name}, Start Date: {habit.start_date}, Periodicity: {habit.periodicity}")
+    return 0
+
+def command_compact(db, args):
+    """
+    Folds the journal of a database into its snapshot.
+
+    Args:
+        db (Database): The database to compact.
+        args (argparse.Namespace): Parsed arguments.
+
+    Returns:
+        int: Exit status.
+    """
+    if not hasattr(db, "compact"):
+        print("This database has no journal to compact.")
+        return 0
+    db.compact(background=False)
+    print("Compacted the journal.")
+    return 0
+
+def date_argument(text):
+    """
+    Parses a date given on the command line.
+
+    Args:
+        text (str): 'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM:SS'.
+
+    Returns:
+        datetime: The parsed datetime.
+
+    Raises:
+        argparse.ArgumentTypeError: If the date is malformed.
+    """
+    try:
+        return parse_timestamp(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError("Invalid date format. Please use YYYY-MM-DD.")
+
+def periodicity_argument(text):
+    """
+    Parses a periodicity spec given on the command line.
+
+    Args:
+        text (str): A spec such as 'daily', 'weekly:3' or 'every:2'.
+
+    Returns:
+        str: The canonical spec.
+
+    Raises:
+        argparse.ArgumentTypeError: If the spec is invalid.
+    """
+    try:
+        return canonical_spec(text)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(str(error))
+
+def build_parser():
+    """
+    Builds the command line parser.
+
+    Each subcommand names its handler and the database options it needs:
+    commands about one habit only locate that habit in the file, and "log"
+    appends to the journal instead of rewriting the file. Once the journal
+    outgrows JOURNAL_LIMIT, closing the database compacts it, so startup
+    does not slow down with use.
+
+    Returns:
+        argparse.ArgumentParser: The parser.
+    """
+    parser = argparse.ArgumentParser(description="Track your habits. Without a command, the interactive menu starts.")
+    parser.add_argument("--db", help="database file or shard directory (default: $HABIT_DB or db.json)")
+    parser.add_argument("--profile", nargs="?", const="summary", metavar="FILE",
+                        help="record timings of the database hot paths; print them at exit or write them to FILE")
+    commands = parser.add_subparsers(dest="command")
+    log_parser = commands.add_parser("log", help="log an entry for a habit")
+    log_parser.add_argument("habit", help="name of the habit")
+    log_parser.add_argument("date", nargs="?", type=date_argument, help="YYYY-MM-DD (default: now)")
+    log_parser.set_defaults(handler=command_log, db_options={'journal': True, 'compact_after': JOURNAL_LIMIT})
+    streak_parser = commands.add_parser("streak", help="show the current and longest streak of a habit")
+    streak_parser.add_argument("habit", help="name of the habit")
+    streak_parser.set_defaults(handler=command_streak, db_options={'journal': True, 'compact_after': JOURNAL_LIMIT})
+    list_parser = commands.add_parser("list", help="list habits")
+    list_parser.add_argument("--periodicity", type=periodicity_argument,
+                             help="only list habits of this periodicity, e.g. daily or weekly:3")
+    list_parser.set_defaults(handler=command_list, db_options={'lazy': True})
+    compact_parser = commands.add_parser("compact", help="fold the journal into the database file")
+    compact_parser.set_defaults(handler=command_compact, db_options={'journal': True, 'lazy': True})
+    return parser
+
+def run(argv=None):
+    """
+    Runs a subcommand, or the interactive menu if none is given.
+
+    Args:
+        argv (list): Command line arguments. Defaults to sys.argv[1:].
+
+    Returns:
+        int: Exit status.
+    """
+    args = build_parser().parse_args(argv)
+    if args.profile or os.environ.get("HABIT_PROFILE"):
+        from instrumentation import enable_from_environment
+        enable_from_environment(args.profile)
+    db_file = args.db or os.environ.get("HABIT_DB", "db.json")
+    if args.command is None:
+        main(db_file)
+        return 0
+    db_options = dict(args.db_options)
+    if 'habit' in args:
+        db_options['habit_names'] = [args.habit]
+    db = open_database(db_file, **db_options)
+    try:
+        return args.handler(db, args)
+    finally:
+        db.close()
+
 if __name__ == "__main__":
-    main()
+    sys.exit(run())
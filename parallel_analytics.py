@@ -0,0 +1,186 @@
+"""
+This module computes analytics for every habit in parallel worker processes.
+
+Habits are partitioned into chunks of similar total log size. Each chunk is
+sent to a ProcessPoolExecutor as plain tuples whose logs are the raw bytes of
+an int64 epoch-second array, which pickles far more cheaply than Habit
+objects holding datetimes. The workers return per-habit statistics, which are
+reduced into one global report.
+"""
+
+import argparse
+import json
+import os
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from operator import sub
+from db import open_database
+from habits_class import CompactLog, Habit, format_timestamp, parse_timestamp, to_timestamp
+from streaks import DAY_SECONDS, longest_run, period_number, period_numbers
+
+CHUNKS_PER_WORKER = 4
+
+def pack_habit(habit):
+    """
+    Converts a habit into a compact, cheaply picklable tuple.
+
+    Args:
+        habit (Habit): Habit to pack.
+
+    Returns:
+        tuple: Name, start date, periodicity, timezone, day cutoff and the log
+        as int64 epoch bytes.
+    """
+    if isinstance(habit.log, CompactLog):
+        timestamps = habit.log.timestamps
+    else:
+        timestamps = array('q', map(to_timestamp, habit.log))
+    return (habit.name, format_timestamp(habit.start_date), habit.periodicity, habit.timezone, habit.day_cutoff,
+            bytes(timestamps))
+
+def analyze_habit(packed, as_of_day):
+    """
+    Computes the statistics of one packed habit.
+
+    Args:
+        packed (tuple): Habit as returned by pack_habit.
+        as_of_day (int): Day number (days since 1970-01-01) the report ends on.
+
+    Returns:
+        dict: Current and longest streak, completion count, completion rate
+        since the start date, and the number and longest length of gaps
+        between completed periods.
+    """
+    name, start_date, periodicity, timezone, day_cutoff, data = packed
+    timestamps = array('q')
+    timestamps.frombytes(data)
+    log = CompactLog.from_timestamps(timestamps)
+    habit = Habit(name, parse_timestamp(start_date), log, periodicity, timezone=timezone, day_cutoff=day_cutoff)
+    start = to_timestamp(habit.start_date) // DAY_SECONDS
+    periods = period_numbers(log, periodicity, start, timezone, day_cutoff)
+    first = _period_near(start, periodicity, start, 1)
+    last = _period_near(as_of_day, periodicity, start, -1)
+    completed = sum(first <= period <= last for period in periods)
+    steps = list(map(sub, periods[1:], periods[:-1]))
+    return {
+        'periodicity': periodicity,
+        'completions': len(log),
+        'current_streak': habit.calculate_streak(),
+        'longest_streak': longest_run(periods),
+        'completion_rate': completed / (last - first + 1) if last >= first else 0.0,
+        'gaps': sum(step > 1 for step in steps),
+        'longest_gap': max(steps, default=1) - 1
+    }
+
+def _period_near(day, periodicity, start, step):
+    """
+    Returns the period of a day, or of the nearest day in the direction of
+    step that belongs to a period, e.g. the Monday after a weekend.
+    """
+    period = period_number(day, periodicity, start)
+    while period is None:
+        day += step
+        period = period_number(day, periodicity, start)
+    return period
+
+def analyze_chunk(chunk, as_of_day):
+    """
+    Computes the statistics of a chunk of packed habits.
+
+    Args:
+        chunk (list): Habits as returned by pack_habit.
+        as_of_day (int): Day number the report ends on.
+
+    Returns:
+        list: (name, statistics) pairs.
+    """
+    return [(packed[0], analyze_habit(packed, as_of_day)) for packed in chunk]
+
+def partition(packed_habits, count):
+    """
+    Splits packed habits into chunks of similar total log size.
+
+    Args:
+        packed_habits (list): Habits as returned by pack_habit.
+        count (int): Number of chunks to aim for.
+
+    Returns:
+        list: Non-empty lists of packed habits.
+    """
+    target = sum(len(packed[-1]) + 64 for packed in packed_habits) / max(count, 1)
+    chunks, chunk, size = [], [], 0
+    for packed in packed_habits:
+        chunk.append(packed)
+        size += len(packed[-1]) + 64
+        if size >= target:
+            chunks.append(chunk)
+            chunk, size = [], 0
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+def reduce_report(results):
+    """
+    Combines per-habit statistics into a global report.
+
+    Args:
+        results (iterable): (name, statistics) pairs.
+
+    Returns:
+        dict: Per-habit statistics under 'habits', plus totals and the habits
+        with the best current streak, the best longest streak and the
+        longest gap as (value, name) pairs.
+    """
+    habits = dict(results)
+
+    def best(key):
+        if not habits:
+            return 0, None
+        name = max(habits, key=lambda name: habits[name][key])
+        return habits[name][key], name
+
+    return {
+        'habits': habits,
+        'habit_count': len(habits),
+        'total_completions': sum(stats['completions'] for stats in habits.values()),
+        'average_completion_rate': (sum(stats['completion_rate'] for stats in habits.values()) / len(habits)
+                                    if habits else 0.0),
+        'best_current_streak': best('current_streak'),
+        'best_longest_streak': best('longest_streak'),
+        'longest_gap': best('longest_gap')
+    }
+
+def analyze_parallel(habits, workers=None, as_of=None):
+    """
+    Computes the analytics report of all habits across worker processes.
+
+    Args:
+        habits (iterable): Habit objects to analyze.
+        workers (int): Number of worker processes. Defaults to the number of
+            CPUs; with one worker the chunks are analyzed in this process.
+        as_of (datetime): End of the reporting period. Defaults to now.
+
+    Returns:
+        dict: The report described in reduce_report.
+    """
+    workers = workers or os.cpu_count() or 1
+    as_of_day = to_timestamp(as_of or datetime.now()) // DAY_SECONDS
+    chunks = partition([pack_habit(habit) for habit in habits], workers * CHUNKS_PER_WORKER)
+    if workers == 1 or len(chunks) <= 1:
+        return reduce_report(pair for chunk in chunks for pair in analyze_chunk(chunk, as_of_day))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(analyze_chunk, chunks, [as_of_day] * len(chunks))
+        return reduce_report(pair for chunk_results in results for pair in chunk_results)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compute analytics of every habit in parallel.")
+    parser.add_argument("--db", default="db.json", help="database to analyze")
+    parser.add_argument("--workers", type=int, help="worker processes (default: number of CPUs)")
+    parser.add_argument("--as-of", type=parse_timestamp, help="end of the reporting period (default: now)")
+    parser.add_argument("--per-habit", action="store_true", help="include the statistics of every habit")
+    args = parser.parse_args()
+    report = analyze_parallel(open_database(args.db, compact_logs=True).get_all_habits(), args.workers, args.as_of)
+    if not args.per_habit:
+        del report['habits']
+    print(json.dumps(report, indent=4))
@@ -0,0 +1,294 @@
+"""
+This module provides the periodicity strategies of habits.
+
+A periodicity maps completion days (days since 1970-01-01) to period
+ordinals, consecutive integers for consecutive periods, so one run-length
+computation finds the streaks of every kind of habit. A period counts as
+completed once it holds the required number of distinct completion days.
+
+Periodicities are given as spec strings, which are stored as the habit's
+periodicity:
+
+    daily       every day
+    weekly      every ISO calendar week
+    weekly:N    on N different days of every ISO calendar week
+    monthly     every calendar month
+    weekdays    Monday to Friday; weekend completions are ignored
+    every:N     every N days, counted from the start date of the habit
+
+New strategies are added with the register decorator.
+"""
+
+from datetime import date
+from functools import lru_cache
+
+DAY_SECONDS = 86400
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+EPOCH_WEEKDAY = 3
+
+PERIODICITIES = {}
+
+def register(name):
+    """
+    Returns a class decorator registering a periodicity strategy.
+
+    Args:
+        name (str): Name of the strategy in spec strings.
+
+    Returns:
+        callable: The decorator.
+    """
+    def decorator(cls):
+        cls.name = name
+        PERIODICITIES[name] = cls
+        return cls
+    return decorator
+
+@lru_cache(maxsize=None)
+def get_periodicity(spec):
+    """
+    Returns the strategy for a periodicity spec.
+
+    Args:
+        spec (str): 'name' or 'name:N', e.g. 'daily' or 'every:3'.
+
+    Returns:
+        Periodicity: The strategy. Equal specs share one instance.
+
+    Raises:
+        ValueError: If the spec does not name a registered strategy or its
+            count is invalid.
+    """
+    name, _, count = str(spec).partition(":")
+    cls = PERIODICITIES.get(name)
+    if cls is None:
+        raise ValueError(f"Unknown periodicity '{spec}'. Use one of: {', '.join(PERIODICITIES)}.")
+    if count:
+        if not count.isdigit() or int(count) < 1:
+            raise ValueError(f"Invalid count in periodicity '{spec}'.")
+        return cls(int(count))
+    return cls()
+
+def canonical_spec(spec):
+    """
+    Validates a periodicity spec and returns its canonical form.
+
+    Args:
+        spec (str): Periodicity spec, e.g. 'weekly:1'.
+
+    Returns:
+        str: The canonical spec, e.g. 'weekly'.
+
+    Raises:
+        ValueError: If the spec is invalid.
+    """
+    return get_periodicity(spec).spec
+
+def start_day(habit):
+    """
+    Returns the day number of a habit's start date.
+
+    Args:
+        habit (Habit): The habit.
+
+    Returns:
+        int: Days since 1970-01-01.
+    """
+    return habit.start_date.toordinal() - EPOCH_ORDINAL
+
+class Periodicity:
+    """
+    Base class of the periodicity strategies.
+
+    Subclasses implement ordinal for one day and ordinals for a NumPy array
+    of days. Ordinals never decrease for increasing days.
+    """
+
+    name = None
+    unit = "period"
+
+    def __init__(self, count=None):
+        """
+        Initializes the strategy.
+
+        Args:
+            count (int): The N of 'name:N' specs; strategies without one
+                reject it.
+
+        Raises:
+            ValueError: If a count is given.
+        """
+        if count is not None:
+            raise ValueError(f"Periodicity '{self.name}' takes no count.")
+        self.required = 1
+
+    @property
+    def spec(self):
+        """
+        str: The canonical spec string of the strategy.
+        """
+        return self.name
+
+    def ordinal(self, day, start):
+        """
+        Returns the period of a day.
+
+        Args:
+            day (int): Days since 1970-01-01.
+            start (int): Day number of the habit's start date.
+
+        Returns:
+            int: The period ordinal, or None if the day belongs to no period.
+        """
+        raise NotImplementedError
+
+    def ordinal_list(self, days, start):
+        """
+        Returns the periods of days, leaving out days that belong to none.
+
+        Args:
+            days (iterable): Day numbers.
+            start (int): Day number of the habit's start date.
+
+        Returns:
+            list: Period ordinals.
+        """
+        periods = (self.ordinal(day, start) for day in days)
+        return [period for period in periods if period is not None]
+
+    def ordinals(self, days, starts):
+        """
+        Returns the periods of a NumPy array of days.
+
+        Args:
+            days (numpy.ndarray): Day numbers.
+            starts (numpy.ndarray): Start day of the habit of every day.
+
+        Returns:
+            tuple: The period ordinals, and a boolean array of the days that
+            belong to a period, or None if all do.
+        """
+        raise NotImplementedError
+
+@register("daily")
+class Daily(Periodicity):
+    """
+    One completion every day.
+    """
+
+    unit = "day"
+
+    def ordinal(self, day, start):
+        return day
+
+    def ordinal_list(self, days, start):
+        return list(days)
+
+    def ordinals(self, days, starts):
+        return days, None
+
+@register("weekly")
+class Weekly(Periodicity):
+    """
+    Completions on a number of different days of every ISO calendar week.
+    """
+
+    unit = "week"
+
+    def __init__(self, count=None):
+        """
+        Initializes the strategy.
+
+        Args:
+            count (int): Distinct completion days required per week.
+
+        Raises:
+            ValueError: If the count is not from 1 to 7.
+        """
+        if count is not None and not 1 <= count <= 7:
+            raise ValueError(f"Invalid count in periodicity '{self.name}:{count}'. A week has 1 to 7 days.")
+        self.required = count or 1
+
+    @property
+    def spec(self):
+        return self.name if self.required == 1 else f"{self.name}:{self.required}"
+
+    def ordinal(self, day, start):
+        return (day + EPOCH_WEEKDAY) // 7
+
+    def ordinal_list(self, days, start):
+        return [(day + EPOCH_WEEKDAY) // 7 for day in days]
+
+    def ordinals(self, days, starts):
+        return (days + EPOCH_WEEKDAY) // 7, None
+
+@register("monthly")
+class Monthly(Periodicity):
+    """
+    One completion every calendar month.
+    """
+
+    unit = "month"
+
+    def ordinal(self, day, start):
+        month = date.fromordinal(day + EPOCH_ORDINAL)
+        return month.year * 12 + month.month - 1
+
+    def ordinal_list(self, days, start):
+        return [self.ordinal(day, start) for day in days]
+
+    def ordinals(self, days, starts):
+        import numpy
+        return days.astype("datetime64[D]").astype("datetime64[M]").astype(numpy.int64) + 1970 * 12, None
+
+@register("weekdays")
+class Weekdays(Periodicity):
+    """
+    One completion every day from Monday to Friday.
+    """
+
+    unit = "weekday"
+
+    def ordinal(self, day, start):
+        week, weekday = divmod(day + EPOCH_WEEKDAY, 7)
+        return week * 5 + weekday if weekday < 5 else None
+
+    def ordinals(self, days, starts):
+        week, weekday = divmod(days + EPOCH_WEEKDAY, 7)
+        return week * 5 + weekday, weekday < 5
+
+@register("every")
+class EveryNDays(Periodicity):
+    """
+    One completion in every block of N days from the start date.
+    """
+
+    def __init__(self, count=None):
+        """
+        Initializes the strategy.
+
+        Args:
+            count (int): Length of the periods in days.
+
+        Raises:
+            ValueError: If no count is given.
+        """
+        if count is None:
+            raise ValueError("Periodicity 'every' needs a number of days, e.g. 'every:3'.")
+        self.days = count
+        self.required = 1
+        self.unit = f"{count}-day period"
+
+    @property
+    def spec(self):
+        return f"{self.name}:{self.days}"
+
+    def ordinal(self, day, start):
+        return (day - start) // self.days
+
+    def ordinal_list(self, days, start):
+        step = self.days
+        return [(day - start) // step for day in days]
+
+    def ordinals(self, days, starts):
+        return (days - starts) // self.days, None
@@ -130,14 +130,15 @@ def preload_db():
         }
     ]
 
-    for habit_data in predefined_habits:
-        habit = Habit(
-            name=habit_data['name'],
-            start_date=datetime.strptime(habit_data['start_date'], '%Y-%m-%d %H:%M:%S'),
-            log=[datetime.strptime(log, '%Y-%m-%d %H:%M:%S') for log in habit_data['log']],
-            periodicity=habit_data['periodicity']
-        )
-        db.add_habit(habit)
+    with db.batch():
+        for habit_data in predefined_habits:
+            habit = Habit(
+                name=habit_data['name'],
+                start_date=datetime.strptime(habit_data['start_date'], '%Y-%m-%d %H:%M:%S'),
+                log=[datetime.strptime(log, '%Y-%m-%d %H:%M:%S') for log in habit_data['log']],
+                periodicity=habit_data['periodicity']
+            )
+            db.add_habit(habit)
 
     print("Predefined habits have been added to the database.")
 
@@ -0,0 +1,308 @@
+"""
+This module provides an asyncio HTTP/JSON service that shares one habit database.
+
+Endpoints:
+    GET    /habits[?periodicity=daily]   List habits, optionally by periodicity.
+    POST   /habits                       Add a habit: {"name", "start_date", "periodicity"},
+                                         with a periodicity spec such as "weekly:3",
+                                         and optionally "timezone" and "day_cutoff".
+    DELETE /habits/<name>                Delete a habit.
+    POST   /habits/<name>/log            Log an entry: {"timestamp"}, defaults to now.
+    GET    /habits/<name>/streak         Current and longest streak of a habit.
+
+Reads are answered directly from memory. Mutations are queued to a single
+writer task, which applies everything that is waiting, flushes the database
+once in an executor thread and then answers all of the queued requests.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+from datetime import datetime
+from urllib.parse import parse_qs, unquote, urlsplit
+from db import open_database
+from habits_class import Habit, format_timestamp, parse_timestamp
+from streaks import longest_streak
+
+REASONS = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found",
+           405: "Method Not Allowed", 409: "Conflict", 500: "Internal Server Error"}
+
+class HTTPError(Exception):
+    """
+    An error that is reported to the client with an HTTP status code.
+    """
+
+    def __init__(self, status, message):
+        """
+        Initializes the error.
+
+        Args:
+            status (int): HTTP status code.
+            message (str): Error message for the client.
+        """
+        super().__init__(message)
+        self.status = status
+
+class HabitServer:
+    """
+    Serves a habit database over HTTP/JSON.
+    """
+
+    def __init__(self, db):
+        """
+        Initializes the server.
+
+        Args:
+            db (Database): Database to serve, opened with flush_every=None;
+                the writer task flushes once per group of mutations.
+        """
+        self.db = db
+        self._queue = None
+        self._writer = None
+
+    async def start(self, host="127.0.0.1", port=8000):
+        """
+        Starts the writer task and listens for connections.
+
+        Args:
+            host (str): Interface to listen on.
+            port (int): Port to listen on, or 0 for any free port.
+
+        Returns:
+            asyncio.Server: The listening server.
+        """
+        self._queue = asyncio.Queue()
+        self._writer = asyncio.create_task(self._write_loop())
+        return await asyncio.start_server(self._handle_connection, host, port)
+
+    async def stop(self):
+        """
+        Stops the writer task and flushes the database.
+        """
+        if self._writer is not None:
+            self._writer.cancel()
+            try:
+                await self._writer
+            except asyncio.CancelledError:
+                pass
+        await asyncio.get_running_loop().run_in_executor(None, self.db.flush)
+
+    async def mutate(self, mutation):
+        """
+        Runs a mutation on the writer task and waits until it is on disk.
+
+        Args:
+            mutation (callable): Function applying the change to the database.
+
+        Returns:
+            object: The return value of the mutation.
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((mutation, future))
+        return await future
+
+    async def _write_loop(self):
+        """
+        Applies queued mutations and flushes them in groups.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            queued = [await self._queue.get()]
+            while not self._queue.empty():
+                queued.append(self._queue.get_nowait())
+            results = []
+            for mutation, future in queued:
+                try:
+                    results.append((future, mutation(), None))
+                except Exception as error:
+                    results.append((future, None, error))
+            try:
+                await loop.run_in_executor(None, self.db.flush)
+            except Exception as error:
+                results = [(future, None, error) for future, _, _ in results]
+            for future, result, error in results:
+                if future.done():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+
+    async def _handle_connection(self, reader, writer):
+        """
+        Serves HTTP/1.1 requests on one connection until it is closed.
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    key, _, value = line.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", 0))
+                body = await reader.readexactly(length) if length else b""
+                try:
+                    status, payload = await self.dispatch(method, target, body)
+                except HTTPError as error:
+                    status, payload = error.status, {"error": str(error)}
+                except Exception as error:
+                    status, payload = 500, {"error": str(error)}
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                data = json.dumps(payload).encode("utf-8")
+                writer.write(
+                    f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + data
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, method, target, body):
+        """
+        Routes a request to its handler.
+
+        Args:
+            method (str): HTTP method.
+            target (str): Request target, including the query string.
+            body (bytes): Request body.
+
+        Returns:
+            tuple: HTTP status code and JSON-serializable payload.
+
+        Raises:
+            HTTPError: If the request cannot be served.
+        """
+        url = urlsplit(target)
+        parts = [unquote(part) for part in url.path.strip("/").split("/")]
+        if parts[0] != "habits":
+            raise HTTPError(404, "Unknown endpoint.")
+        try:
+            data = json.loads(body) if body else {}
+        except ValueError:
+            raise HTTPError(400, "The request body is not valid JSON.")
+        if len(parts) == 1 and method == "GET":
+            periodicity = parse_qs(url.query).get("periodicity", [None])[0]
+            return 200, self.list_habits(periodicity)
+        if len(parts) == 1 and method == "POST":
+            return 201, await self.add_habit(data)
+        if len(parts) == 2 and method == "DELETE":
+            return 200, await self.delete_habit(parts[1])
+        if len(parts) == 3 and parts[2] == "log" and method == "POST":
+            return 200, await self.log_entry(parts[1], data)
+        if len(parts) == 3 and parts[2] == "streak" and method == "GET":
+            return 200, self.streak(parts[1])
+        raise HTTPError(405 if len(parts) <= 3 else 404, "Unsupported request.")
+
+    def list_habits(self, periodicity=None):
+        """
+        Lists habits, optionally filtered by periodicity.
+        """
+        habits = self.db.get_habits_by_periodicity(periodicity) if periodicity else self.db.get_all_habits()
+        return [{"name": habit.name, "start_date": format_timestamp(habit.start_date),
+                 "periodicity": habit.periodicity} for habit in habits]
+
+    async def add_habit(self, data):
+        """
+        Adds a habit described by a JSON payload.
+        """
+        try:
+            habit = Habit(name=data["name"], start_date=parse_timestamp(data["start_date"]), log=[],
+                          periodicity=data.get("periodicity", "daily"), timezone=data.get("timezone"),
+                          day_cutoff=data.get("day_cutoff", 0))
+        except (KeyError, TypeError, ValueError):
+            raise HTTPError(400, "Expected a name, a start_date and optionally a valid periodicity, timezone "
+                                 "and day_cutoff.")
+        try:
+            await self.mutate(lambda: self.db.add_habit(habit))
+        except ValueError as error:
+            raise HTTPError(409, str(error))
+        return {"name": habit.name}
+
+    async def delete_habit(self, name):
+        """
+        Deletes a habit by name.
+        """
+        if self.db.get_habit(name) is None:
+            raise HTTPError(404, f"Habit '{name}' not found.")
+        await self.mutate(lambda: self.db.delete_habit(name))
+        return {"name": name}
+
+    async def log_entry(self, name, data):
+        """
+        Logs an entry for a habit and returns its current streak.
+
+        Timestamps without a UTC offset are wall-clock times in the habit's
+        timezone.
+        """
+        try:
+            log_datetime = parse_timestamp(data["timestamp"]) if "timestamp" in data else datetime.now().astimezone()
+        except (TypeError, ValueError):
+            raise HTTPError(400, "Expected the timestamp as 'YYYY-MM-DD HH:MM:SS'.")
+        habit = self.db.get_habit(name)
+        if habit is None:
+            raise HTTPError(404, f"Habit '{name}' not found.")
+        log_datetime = habit.from_local(log_datetime)
+        habit = await self.mutate(lambda: self.db.log_entry(name, log_datetime))
+        if habit is None:
+            raise HTTPError(404, f"Habit '{name}' not found.")
+        return {"name": name, "streak": habit.calculate_streak()}
+
+    def streak(self, name):
+        """
+        Returns the current and longest streak of a habit.
+        """
+        habit = self.db.get_habit(name)
+        if habit is None:
+            raise HTTPError(404, f"Habit '{name}' not found.")
+        return {"name": name, "current_streak": habit.calculate_streak(), "longest_streak": longest_streak(habit)}
+
+async def serve(db_file, host, port, journal=True):
+    """
+    Runs the server until it is interrupted.
+
+    Args:
+        db_file (str): The path to the database file.
+        host (str): Interface to listen on.
+        port (int): Port to listen on.
+        journal (bool): Open a JSON database in journaled mode, so a group
+            of mutations is appended instead of rewriting the snapshot.
+    """
+    server = HabitServer(open_database(db_file, journal=journal, flush_every=None))
+    listener = await server.start(host, port)
+    print(f"Serving {db_file} on http://{host}:{port}")
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        await server.stop()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the habit database over HTTP/JSON.")
+    parser.add_argument("--db", default="db.json", help="database file")
+    parser.add_argument("--host", default="127.0.0.1", help="interface to listen on")
+    parser.add_argument("--port", type=int, default=8000, help="port to listen on")
+    parser.add_argument("--no-journal", dest="journal", action="store_false",
+                        help="rewrite the JSON file on every write instead of appending to a journal")
+    parser.add_argument("--profile", nargs="?", const="summary", metavar="FILE",
+                        help="record timings of the database hot paths; print them at exit or write them to FILE")
+    args = parser.parse_args()
+    if args.profile or os.environ.get("HABIT_PROFILE"):
+        from instrumentation import enable_from_environment
+        enable_from_environment(args.profile)
+    try:
+        asyncio.run(serve(args.db, args.host, args.port, args.journal))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,502 @@
+"""
+This module provides the ShardedDatabase class, which partitions the habits
+into several JSON database files.
+
+Every habit lives in the shard selected by the CRC-32 of its name. Each shard
+is an ordinary Database, loaded only when one of its habits is touched and
+kept in a least-recently-used cache bounded by a shard count and by an
+estimate of the memory used. Mutations only rewrite the shard they touch.
+Queries over all habits fan out to the shards that exist on disk.
+"""
+
+import argparse
+import json
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from contextlib import ExitStack, contextmanager
+from db import Database
+
+MANIFEST = "shards.json"
+DEFAULT_SHARD_COUNT = 16
+
+class ShardedDatabase:
+    """
+    Manages habits partitioned into shard files inside a directory.
+    """
+
+    def __init__(self, directory, shard_count=None, max_loaded_shards=None, memory_budget=None, **options):
+        """
+        Opens or creates a sharded database.
+
+        Args:
+            directory (str): Directory holding the shard files.
+            shard_count (int): Number of shards. Read from the directory if it
+                already holds a sharded database, else DEFAULT_SHARD_COUNT.
+            max_loaded_shards (int): Keep at most this many shards in memory.
+            memory_budget (int): Keep the loaded shards within roughly this many
+                bytes, estimated from their file sizes. The most recently used
+                shard always stays loaded.
+            **options: Options for the Database of every shard.
+
+        Raises:
+            ValueError: If shard_count differs from the existing database.
+        """
+        self.directory = directory
+        self.max_loaded_shards = max_loaded_shards
+        self.memory_budget = memory_budget
+        self.options = options
+        self._lock = threading.RLock()
+        self._loaded = OrderedDict()
+        self._sizes = {}
+        self._batch = None
+        os.makedirs(directory, exist_ok=True)
+        manifest_file = os.path.join(directory, MANIFEST)
+        if os.path.exists(manifest_file):
+            with open(manifest_file, "r") as file:
+                stored_count = json.load(file)['shard_count']
+            if shard_count is not None and shard_count != stored_count:
+                raise ValueError(f"{directory} holds {stored_count} shards, not {shard_count}.")
+            shard_count = stored_count
+        else:
+            shard_count = shard_count or DEFAULT_SHARD_COUNT
+            with open(manifest_file, "w") as file:
+                json.dump({'shard_count': shard_count}, file)
+        self.shard_count = shard_count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def shard_index(self, name):
+        """
+        Returns the shard a habit belongs to.
+
+        Args:
+            name (str): Name of the habit.
+
+        Returns:
+            int: Index of the shard.
+        """
+        return zlib.crc32(name.encode("utf-8")) % self.shard_count
+
+    def shard_file(self, index):
+        """
+        Returns the path of a shard file.
+
+        Args:
+            index (int): Index of the shard.
+
+        Returns:
+            str: The path to the shard's JSON file.
+        """
+        return os.path.join(self.directory, f"shard_{index:03d}.json")
+
+    def loaded_shards(self):
+        """
+        Returns the indexes of the shards currently in memory.
+
+        Returns:
+            list: Shard indexes, least recently used first.
+        """
+        return list(self._loaded)
+
+    def save_db(self):
+        """
+        Writes the deferred mutations of every loaded shard.
+
+        Only shards with pending mutations are rewritten.
+        """
+        self.flush()
+
+    def flush(self):
+        """
+        Writes the deferred mutations of every loaded shard.
+        """
+        with self._lock:
+            shards = list(self._loaded.values())
+        for shard in shards:
+            shard.flush()
+
+    def checkpoint(self):
+        """
+        Bounds the memory held by a long batch in every loaded shard.
+        """
+        with self._lock:
+            shards = list(self._loaded.values())
+        for shard in shards:
+            shard.checkpoint()
+
+    def compact(self, background=True):
+        """
+        Folds the journal of every shard into its snapshot.
+
+        Args:
+            background (bool): Run the compactions in background threads.
+        """
+        for shard in self._shards():
+            shard.compact(background)
+
+    @contextmanager
+    def batch(self):
+        """
+        Defers writing until the end of the block, then flushes every touched
+        shard once. Shards stay loaded until then, even beyond the cache
+        limits.
+
+        Yields:
+            ShardedDatabase: This database.
+        """
+        with self._lock:
+            outermost = self._batch is None
+            if outermost:
+                self._batch = ExitStack()
+                for shard in self._loaded.values():
+                    self._batch.enter_context(shard.batch())
+        try:
+            yield self
+        finally:
+            if outermost:
+                with self._lock:
+                    batch, self._batch = self._batch, None
+                batch.close()
+                self._evict()
+
+    def close(self):
+        """
+        Flushes and closes every loaded shard.
+        """
+        with self._lock:
+            while self._loaded:
+                self._loaded.popitem(last=False)[1].close()
+
+    def get_all_habits(self):
+        """
+        Retrieves all habits, loading every shard.
+
+        Returns:
+            list: List of all Habit objects.
+        """
+        return [habit for shard in self._shards() for habit in shard.get_all_habits()]
+
+    def get_habit(self, name):
+        """
+        Retrieves a habit by name, loading only its shard.
+
+        Args:
+            name (str): Name of the habit.
+
+        Returns:
+            Habit: Habit object with the specified name.
+        """
+        return self._shard_of(name).get_habit(name)
+
+    def add_habit(self, habit):
+        """
+        Adds a new habit to its shard.
+
+        Args:
+            habit (Habit): Habit object to add.
+
+        Raises:
+            ValueError: If a habit with the same name already exists.
+        """
+        self._mutate(habit.name, 'add_habit', habit)
+
+    def delete_habit(self, name):
+        """
+        Deletes a habit by name.
+
+        Args:
+            name (str): Name of the habit to delete.
+        """
+        self._mutate(name, 'delete_habit', name)
+
+    def log_entry(self, name, log_datetime):
+        """
+        Logs a new entry for a habit and persists its shard.
+
+        Args:
+            name (str): Name of the habit.
+            log_datetime (datetime): Datetime to log for the habit.
+
+        Returns:
+            Habit: The updated habit, or None if no habit has that name.
+        """
+        return self._mutate(name, 'log_entry', name, log_datetime)
+
+    def log_entries(self, name, log_datetimes):
+        """
+        Logs a batch of entries for a habit with one sorted merge.
+
+        Args:
+            name (str): Name of the habit.
+            log_datetimes (iterable): Datetimes to log for the habit.
+
+        Returns:
+            int: Number of entries that were not already logged, or None if
+            no habit has that name.
+        """
+        return self._mutate(name, 'log_entries', name, log_datetimes)
+
+    def get_habits_by_periodicity(self, periodicity):
+        """
+        Retrieves habits by periodicity from every shard.
+
+        Args:
+            periodicity (str): Filter by periodicity.
+
+        Returns:
+            list: List of Habit objects.
+        """
+        return [habit for shard in self._shards() for habit in shard.get_habits_by_periodicity(periodicity)]
+
+    def get_summary(self, name):
+        """
+        Retrieves the materialized summary of a habit.
+
+        Args:
+            name (str): Name of the habit.
+
+        Returns:
+            dict: The summary described in Habit.summary, or None if no habit
+            has that name.
+        """
+        return self._shard_of(name).get_summary(name)
+
+    def get_summaries(self):
+        """
+        Retrieves the materialized summaries of all habits.
+
+        Returns:
+            dict: Summary by habit name.
+        """
+        summaries = {}
+        for shard in self._shards():
+            summaries.update(shard.get_summaries())
+        return summaries
+
+    def get_habits_completed_on(self, day):
+        """
+        Retrieves the habits completed on a day.
+
+        Args:
+            day (date): Day to look up.
+
+        Returns:
+            list: List of Habit objects, ordered by name.
+        """
+        return self._merge_by_name(shard.get_habits_completed_on(day) for shard in self._shards())
+
+    def get_habits_completed_in_week(self, year, week):
+        """
+        Retrieves the habits completed in an ISO calendar week.
+
+        Args:
+            year (int): ISO year.
+            week (int): ISO week number.
+
+        Returns:
+            list: List of Habit objects, ordered by name.
+        """
+        return self._merge_by_name(shard.get_habits_completed_in_week(year, week) for shard in self._shards())
+
+    def get_habits_completed_between(self, start, end):
+        """
+        Retrieves the habits completed at least once between two days.
+
+        Args:
+            start (date): First day, inclusive.
+            end (date): Last day, inclusive.
+
+        Returns:
+            list: List of Habit objects, ordered by name.
+        """
+        return self._merge_by_name(shard.get_habits_completed_between(start, end) for shard in self._shards())
+
+    def get_completion_counts(self, start, end):
+        """
+        Counts the habits completed on every day between two days.
+
+        Args:
+            start (date): First day, inclusive.
+            end (date): Last day, inclusive.
+
+        Returns:
+            dict: Number of completed habits by date.
+        """
+        counts = {}
+        for shard in self._shards():
+            for day, count in shard.get_completion_counts(start, end).items():
+                counts[day] = counts.get(day, 0) + count
+        return counts
+
+    def get_longest_streaks(self):
+        """
+        Retrieves the longest streak every habit has ever reached.
+
+        Returns:
+            dict: Longest streak by habit name.
+        """
+        streaks = {}
+        for shard in self._shards():
+            streaks.update(shard.get_longest_streaks())
+        return streaks
+
+    def get_longest_streak_all_habits(self):
+        """
+        Retrieves the longest streak of all habits.
+
+        Returns:
+            int: Longest streak and the name of the habit.
+        """
+        streaks = self.get_longest_streaks()
+        if not streaks:
+            return 0, None
+        name = max(streaks, key=streaks.get)
+        return streaks[name], name
+
+    def get_longest_streak_for_habit(self, name):
+        """
+        Retrieves the longest streak for a specific habit.
+
+        Args:
+            name (str): Name of the habit.
+
+        Returns:
+            int: The longest streak for the specific habit.
+        """
+        return self._shard_of(name).get_longest_streak_for_habit(name)
+
+    def _shard_of(self, name):
+        """
+        Returns the loaded shard holding a habit.
+        """
+        return self._load(self.shard_index(name))
+
+    def _mutate(self, name, method, *args):
+        """
+        Applies a mutation to the shard of a habit and refreshes its size estimate.
+
+        Args:
+            name (str): Name of the habit.
+            method (str): Name of the Database method to call.
+            *args: Arguments of the method.
+
+        Returns:
+            object: The return value of the method.
+        """
+        index = self.shard_index(name)
+        result = getattr(self._load(index), method)(*args)
+        with self._lock:
+            if index in self._loaded:
+                self._sizes[index] = self._file_size(index)
+            self._evict()
+        return result
+
+    def _shards(self):
+        """
+        Yields every shard that has data, loading them one at a time.
+
+        Shards without a file on disk and not in memory are empty and skipped.
+        """
+        for index in range(self.shard_count):
+            shard_file = self.shard_file(index)
+            if index in self._loaded or os.path.exists(shard_file) or os.path.exists(shard_file + ".journal"):
+                yield self._load(index)
+
+    def _load(self, index):
+        """
+        Returns a shard, loading it and evicting others if necessary.
+
+        Args:
+            index (int): Index of the shard.
+
+        Returns:
+            Database: The shard.
+        """
+        with self._lock:
+            shard = self._loaded.get(index)
+            if shard is not None:
+                self._loaded.move_to_end(index)
+                return shard
+            shard = Database(self.shard_file(index), **self.options)
+            if self._batch is not None:
+                self._batch.enter_context(shard.batch())
+            self._loaded[index] = shard
+            self._sizes[index] = self._file_size(index)
+            self._evict()
+            return shard
+
+    def _evict(self):
+        """
+        Closes least recently used shards until the cache is within its limits.
+
+        Nothing is evicted while a batch is open, and shards with unflushed
+        mutations are kept, so eviction never writes. The end of the
+        outermost batch evicts again.
+        """
+        with self._lock:
+            if self._batch is not None:
+                return
+            for index in list(self._loaded)[:-1]:
+                if not self._over_limits():
+                    break
+                if self._loaded[index].dirty:
+                    continue
+                self._loaded.pop(index).close()
+                self._sizes.pop(index, None)
+
+    def _over_limits(self):
+        """
+        Tells whether the loaded shards exceed max_loaded_shards or memory_budget.
+        """
+        return ((self.max_loaded_shards is not None and len(self._loaded) > self.max_loaded_shards)
+                or (self.memory_budget is not None
+                    and sum(self._sizes.get(index, 0) for index in self._loaded) > self.memory_budget))
+
+    def _file_size(self, index):
+        """
+        Estimates the memory used by a shard from the size of its files.
+        """
+        shard_file = self.shard_file(index)
+        return sum(os.path.getsize(path) for path in (shard_file, shard_file + ".journal") if os.path.exists(path))
+
+    @staticmethod
+    def _merge_by_name(results):
+        """
+        Merges per-shard lists of habits into one list ordered by name.
+        """
+        return sorted((habit for habits in results for habit in habits), key=lambda habit: habit.name)
+
+def split_database(source_file, directory, shard_count=DEFAULT_SHARD_COUNT):
+    """
+    Distributes the habits of a database into a new sharded database.
+
+    Args:
+        source_file (str): The path to the database to read.
+        directory (str): Directory for the shard files.
+        shard_count (int): Number of shards.
+
+    Returns:
+        int: Number of copied habits.
+    """
+    habits = Database(source_file, compact_logs=True).get_all_habits()
+    sharded = ShardedDatabase(directory, shard_count, compact_logs=True, flush_every=None)
+    with sharded.batch():
+        for habit in habits:
+            sharded.add_habit(habit)
+    sharded.close()
+    return len(habits)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Split a habit database into shard files.")
+    parser.add_argument("source_file", help="database to split")
+    parser.add_argument("directory", help="directory for the shard files")
+    parser.add_argument("--shards", type=int, default=DEFAULT_SHARD_COUNT, help="number of shards")
+    args = parser.parse_args()
+    count = split_database(args.source_file, args.directory, args.shards)
+    print(f"Split {count} habits into {args.shards} shards in {args.directory}.")
@@ -0,0 +1,569 @@
+"""
+This module provides the SQLiteDatabase class, a SQLite storage backend with
+the same interface as the JSON-backed Database class.
+
+Calendar queries group the completions of naive habits by the date prefix of
+their timestamps in SQL. Completions of habits with a timezone or day cutoff
+are stored in UTC or wall-clock time respectively and are bucketed into local
+days in Python instead.
+"""
+
+import argparse
+import json
+import sqlite3
+import threading
+from datetime import timedelta
+from functools import wraps
+from completion_index import day_number, iso_week_days
+from habits_class import Habit, format_timestamp, from_timestamp, parse_timestamp
+from streaks import longest_streak, longest_streaks
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS habits (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    start_date TEXT NOT NULL,
+    periodicity TEXT NOT NULL DEFAULT 'daily',
+    timezone TEXT,
+    day_cutoff INTEGER NOT NULL DEFAULT 0
+);
+CREATE UNIQUE INDEX IF NOT EXISTS habits_name ON habits (name);
+CREATE INDEX IF NOT EXISTS habits_periodicity ON habits (periodicity);
+CREATE TABLE IF NOT EXISTS completions (
+    habit_id INTEGER NOT NULL REFERENCES habits (id),
+    timestamp TEXT NOT NULL,
+    PRIMARY KEY (habit_id, timestamp)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS completions_timestamp ON completions (timestamp);
+"""
+
+# Columns added after the first release, with their definitions, for files
+# created before them.
+ADDED_COLUMNS = {
+    'timezone': "TEXT",
+    'day_cutoff': "INTEGER NOT NULL DEFAULT 0"
+}
+
+HABIT_COLUMNS = "id, name, start_date, periodicity, timezone, day_cutoff"
+
+# Completions of shifted habits are looked up this many days around a range of
+# local days; UTC offsets and day cutoffs together stay below two days.
+SHIFT_MARGIN = timedelta(days=2)
+
+def migrate_schema(connection):
+    """
+    Creates the tables and adds columns missing from older files.
+
+    Args:
+        connection (sqlite3.Connection): Connection to the database.
+    """
+    connection.executescript(SCHEMA)
+    columns = {row[1] for row in connection.execute("PRAGMA table_info(habits)")}
+    for column, definition in ADDED_COLUMNS.items():
+        if column not in columns:
+            connection.execute(f"ALTER TABLE habits ADD COLUMN {column} {definition}")
+    connection.commit()
+
+def synchronized(method):
+    """
+    Runs a method of SQLiteDatabase while holding its connection lock.
+
+    Args:
+        method (callable): The method to wrap.
+
+    Returns:
+        callable: The wrapped method.
+    """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+class SQLiteDatabase:
+    """
+    Manages the database of habits stored in a SQLite file.
+
+    Habits are only read from disk when they are queried, so opening a large
+    history does not parse all of it. Loaded habits are kept in an identity
+    map so that repeated lookups return the same Habit object.
+
+    The connection may be used from any thread, e.g. when the server flushes
+    from an executor; every use of it holds a lock.
+
+    By default every mutation is committed immediately. With ``flush_every``
+    the commits are grouped, and ``flush`` commits the pending rows.
+    """
+
+    def __init__(self, db_file="habits.sqlite", flush_every=1):
+        """
+        Initializes the SQLiteDatabase with a specified file.
+
+        Args:
+            db_file (str): The path to the SQLite file storing the habits.
+            flush_every (int): Commit after this many mutations, or only on
+                flush if None.
+        """
+        self.db_file = db_file
+        self.flush_every = flush_every
+        self.connection = sqlite3.connect(db_file, check_same_thread=False)
+        self._lock = threading.RLock()
+        migrate_schema(self.connection)
+        self._habits = {}
+        self._uncommitted = 0
+
+    @synchronized
+    def close(self):
+        """
+        Commits pending changes and closes the connection.
+        """
+        self.save_db()
+        self.connection.close()
+
+    @synchronized
+    def flush(self):
+        """
+        Commits the rows written by the mutating methods since the last commit.
+        """
+        self.connection.commit()
+        self._uncommitted = 0
+
+    @synchronized
+    def load_db(self):
+        """
+        Loads all habits from the SQLite file.
+
+        Only the habits table is read; each log is queried when it is first
+        accessed.
+
+        Returns:
+            list: List of Habit objects.
+        """
+        rows = self.connection.execute(f"SELECT {HABIT_COLUMNS} FROM habits ORDER BY id")
+        return [self._cache(row) for row in rows.fetchall()]
+
+    @synchronized
+    def save_db(self):
+        """
+        Writes the logs of all loaded habits and commits the transaction.
+
+        Only needed after calling Habit.log_entry directly; the mutating
+        methods of this class write their changes themselves, and flush
+        commits them.
+        """
+        for habit_id, habit in self._habits.values():
+            if not habit.log_loaded:
+                continue
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO completions (habit_id, timestamp) VALUES (?, ?)",
+                ((habit_id, format_timestamp(log_datetime)) for log_datetime in habit.log)
+            )
+        self.flush()
+
+    def get_all_habits(self):
+        """
+        Retrieves all habits.
+
+        Returns:
+            list: List of all Habit objects.
+        """
+        return self.load_db()
+
+    @synchronized
+    def get_habit(self, name):
+        """
+        Retrieves a habit by name.
+
+        Args:
+            name (str): Name of the habit.
+
+        Returns:
+            Habit: Habit object with the specified name.
+        """
+        if name in self._habits:
+            return self._habits[name][1]
+        row = self.connection.execute(
+            f"SELECT {HABIT_COLUMNS} FROM habits WHERE name = ?", (name,)
+        ).fetchone()
+        return self._cache(row) if row else None
+
+    @synchronized
+    def add_habit(self, habit):
+        """
+        Adds a new habit to the database.
+
+        Args:
+            habit (Habit): Habit object to add.
+
+        Raises:
+            ValueError: If a habit with the same name already exists.
+        """
+        try:
+            cursor = self.connection.execute(
+                "INSERT INTO habits (name, start_date, periodicity, timezone, day_cutoff) VALUES (?, ?, ?, ?, ?)",
+                (habit.name, format_timestamp(habit.start_date), habit.periodicity, habit.timezone, habit.day_cutoff)
+            )
+        except sqlite3.IntegrityError:
+            raise ValueError(f"Habit '{habit.name}' already exists.")
+        self._habits[habit.name] = (cursor.lastrowid, habit)
+        self.connection.executemany(
+            "INSERT OR IGNORE INTO completions (habit_id, timestamp) VALUES (?, ?)",
+            ((cursor.lastrowid, format_timestamp(log_datetime)) for log_datetime in habit.log)
+        )
+        self._mutated()
+
+    @synchronized
+    def delete_habit(self, name):
+        """
+        Deletes a habit by name.
+
+        Args:
+            name (str): Name of the habit to delete.
+        """
+        self._habits.pop(name, None)
+        self.connection.execute(
+            "DELETE FROM completions WHERE habit_id IN (SELECT id FROM habits WHERE name = ?)", (name,)
+        )
+        self.connection.execute("DELETE FROM habits WHERE name = ?", (name,))
+        self._mutated()
+
+    @synchronized
+    def log_entry(self, name, log_datetime):
+        """
+        Logs a new entry for a habit and persists it.
+
+        Args:
+            name (str): Name of the habit.
+            log_datetime (datetime): Datetime to log for the habit, naive in
+                the stored form or aware; see Habit.normalize.
+
+        Returns:
+            Habit: The updated habit, or None if no habit has that name.
+        """
+        habit = self.get_habit(name)
+        if habit is None:
+            return None
+        log_datetime = habit.normalize(log_datetime)
+        habit.log_entry(log_datetime)
+        self.connection.execute(
+            "INSERT OR IGNORE INTO completions (habit_id, timestamp) VALUES (?, ?)",
+            (self._habits[name][0], format_timestamp(log_datetime))
+        )
+        self._mutated()
+        return habit
+
+    @synchronized
+    def log_entries(self, name, log_datetimes):
+        """
+        Logs a batch of entries for a habit in one transaction.
+
+        Args:
+            name (str): Name of the habit.
+            log_datetimes (iterable): Datetimes to log for the habit, as for
+                log_entry.
+
+        Returns:
+            int: Number of entries that were not already logged, or None if
+            no habit has that name.
+        """
+        habit = self.get_habit(name)
+        if habit is None:
+            return None
+        log_datetimes = list(map(habit.normalize, log_datetimes))
+        added = habit.log_entries(log_datetimes)
+        self.connection.executemany(
+            "INSERT OR IGNORE INTO completions (habit_id, timestamp) VALUES (?, ?)",
+            ((self._habits[name][0], format_timestamp(log_datetime)) for log_datetime in log_datetimes)
+        )
+        self._mutated()
+        return added
+
+    @synchronized
+    def get_habits_by_periodicity(self, periodicity):
+        """
+        Retrieves habits by periodicity.
+
+        Args:
+            periodicity (str): Filter by periodicity.
+
+        Returns:
+            list: List of Habit objects.
+        """
+        names = self.connection.execute(
+            "SELECT name FROM habits WHERE periodicity = ? ORDER BY id", (periodicity,)
+        ).fetchall()
+        return [self.get_habit(name) for (name,) in names]
+
+    def get_summary(self, name):
+        """
+        Retrieves the summary of a habit.
+
+        Summaries are not stored in SQLite; they are computed from the log on
+        first use and cached on the habit.
+
+        Args:
+            name (str): Name of the habit.
+
+        Returns:
+            dict: The summary described in Habit.summary, or None if no habit
+            has that name.
+        """
+        habit = self.get_habit(name)
+        return habit.summary() if habit else None
+
+    def get_summaries(self):
+        """
+        Retrieves the summaries of all habits.
+
+        Returns:
+            dict: Summary by habit name.
+        """
+        return {habit.name: habit.summary() for habit in self.get_all_habits()}
+
+    def get_habits_completed_on(self, day):
+        """
+        Retrieves the habits completed on a day.
+
+        Args:
+            day (date): Day to look up.
+
+        Returns:
+            list: List of Habit objects, ordered by name.
+        """
+        return self.get_habits_completed_between(day, day)
+
+    def get_habits_completed_in_week(self, year, week):
+        """
+        Retrieves the habits completed in an ISO calendar week.
+
+        Args:
+            year (int): ISO year.
+            week (int): ISO week number.
+
+        Returns:
+            list: List of Habit objects, ordered by name.
+        """
+        return self.get_habits_completed_between(*iso_week_days(year, week))
+
+    @synchronized
+    def get_habits_completed_between(self, start, end):
+        """
+        Retrieves the habits completed at least once between two days.
+
+        Args:
+            start (date): First day, inclusive.
+            end (date): Last day, inclusive.
+
+        Returns:
+            list: List of Habit objects, ordered by name.
+        """
+        names = {name for (name,) in self.connection.execute(
+            "SELECT DISTINCT habits.name FROM completions JOIN habits ON habits.id = completions.habit_id "
+            "WHERE habits.timezone IS NULL AND habits.day_cutoff = 0 "
+            "AND completions.timestamp >= ? AND completions.timestamp < ?",
+            self._day_range(start, end)
+        )}
+        for day_names in self._shifted_completions(start, end).values():
+            names.update(day_names)
+        return [self.get_habit(name) for name in sorted(names)]
+
+    @synchronized
+    def get_completion_counts(self, start, end):
+        """
+        Counts the habits completed on every day between two days, e.g. for
+        a calendar heatmap.
+
+        Args:
+            start (date): First day, inclusive.
+            end (date): Last day, inclusive.
+
+        Returns:
+            dict: Number of completed habits by date.
+        """
+        start_text, end_text = self._day_range(start, end)
+        rows = self.connection.execute(
+            "SELECT substr(completions.timestamp, 1, 10) AS day, COUNT(DISTINCT habit_id) FROM completions "
+            "JOIN habits ON habits.id = completions.habit_id WHERE habits.timezone IS NULL AND habits.day_cutoff = 0 "
+            "AND completions.timestamp >= ? AND completions.timestamp < ? GROUP BY day", (start_text, end_text)
+        )
+        counts = dict(rows.fetchall())
+        shifted = self._shifted_completions(start, end)
+        first = parse_timestamp(start_text).date()
+        days = (parse_timestamp(end_text).date() - first).days
+        return {first + timedelta(days=offset): counts.get((first + timedelta(days=offset)).isoformat(), 0)
+                + len(shifted.get(day_number(first) + offset, ())) for offset in range(days)}
+
+    def _shifted_completions(self, start, end):
+        """
+        Buckets the completions of habits with a timezone or day cutoff into
+        their local days.
+
+        Args:
+            start (date): First day, inclusive.
+            end (date): Last day, inclusive.
+
+        Returns:
+            dict: Names of the habits completed by local day number.
+        """
+        rows = self.connection.execute(
+            "SELECT habits.name, completions.timestamp FROM completions JOIN habits ON habits.id = completions.habit_id "
+            "WHERE (habits.timezone IS NOT NULL OR habits.day_cutoff != 0) "
+            "AND completions.timestamp >= ? AND completions.timestamp < ?",
+            self._day_range(start - SHIFT_MARGIN, end + SHIFT_MARGIN)
+        )
+        first, last = day_number(start), day_number(end)
+        days = {}
+        for name, timestamp in rows:
+            day = self.get_habit(name).day_number(parse_timestamp(timestamp))
+            if first <= day <= last:
+                days.setdefault(day, set()).add(name)
+        return days
+
+    def _day_range(self, start, end):
+        """
+        Converts an inclusive range of days into half-open timestamp bounds.
+
+        Args:
+            start (date): First day, inclusive.
+            end (date): Last day, inclusive.
+
+        Returns:
+            tuple: Timestamps of the start of the first day and of the day after the last.
+        """
+        return f"{start:%Y-%m-%d} 00:00:00", f"{end + timedelta(days=1):%Y-%m-%d} 00:00:00"
+
+    def get_longest_streaks(self):
+        """
+        Retrieves the longest streak every habit has ever reached.
+
+        Returns:
+            dict: Longest streak by habit name.
+        """
+        return longest_streaks(self.get_all_habits())
+
+    def get_longest_streak_all_habits(self):
+        """
+        Retrieves the longest streak of all habits.
+
+        Returns:
+            int: Longest streak and the name of the habit.
+        """
+        streaks = self.get_longest_streaks()
+        if not streaks:
+            return 0, None
+        name = max(streaks, key=streaks.get)
+        return streaks[name], name
+
+    def get_longest_streak_for_habit(self, name):
+        """
+        Retrieves the longest streak for a specific habit.
+
+        Args:
+            name (str): Name of the habit.
+
+        Returns:
+            int: The longest streak for the specific habit.
+        """
+        habit = self.get_habit(name)
+        return longest_streak(habit) if habit else 0
+
+    def _mutated(self):
+        """
+        Commits once flush_every mutations are pending.
+        """
+        self._uncommitted += 1
+        if self.flush_every is not None and self._uncommitted >= self.flush_every:
+            self.flush()
+
+    def _cache(self, row):
+        """
+        Returns the cached Habit for a habits row, creating it if necessary.
+
+        Args:
+            row (tuple): The (id, name, start_date, periodicity, timezone,
+                day_cutoff) row.
+
+        Returns:
+            Habit: The cached Habit object, whose log is loaded on first access.
+        """
+        habit_id, name, start_date, periodicity, timezone, day_cutoff = row
+        if name in self._habits:
+            return self._habits[name][1]
+        habit = Habit.lazy(
+            name=name,
+            start_date=parse_timestamp(start_date),
+            log_loader=lambda: self._load_log(habit_id),
+            periodicity=periodicity,
+            timezone=timezone,
+            day_cutoff=day_cutoff
+        )
+        self._habits[name] = (habit_id, habit)
+        return habit
+
+    @synchronized
+    def _load_log(self, habit_id):
+        """
+        Queries the completion log of a habit.
+
+        Args:
+            habit_id (int): Id of the habit.
+
+        Returns:
+            list: Completion datetimes in ascending order.
+        """
+        return [parse_timestamp(timestamp) for (timestamp,) in self.connection.execute(
+            "SELECT timestamp FROM completions WHERE habit_id = ? ORDER BY timestamp", (habit_id,)
+        )]
+
+def migrate_json(json_file, sqlite_file):
+    """
+    Imports the habits of a JSON database into a SQLite database.
+
+    Text timestamps are copied as strings, so no datetime objects are created
+    for them. Epoch-second logs are converted to text. Habits whose name is
+    already in the SQLite database, or repeated in the JSON file, are skipped
+    and reported, so running the migration again changes nothing.
+
+    Args:
+        json_file (str): The path to the JSON file to import.
+        sqlite_file (str): The path to the SQLite file to import into.
+
+    Returns:
+        tuple: Number of imported habits, and the list of skipped duplicate
+        names.
+    """
+    with open(json_file, "r") as file:
+        data = json.load(file)
+    connection = sqlite3.connect(sqlite_file)
+    migrate_schema(connection)
+    imported, duplicates = 0, []
+    with connection:
+        names = {name for name, in connection.execute("SELECT name FROM habits")}
+        for item in data:
+            if item['name'] in names:
+                duplicates.append(item['name'])
+                continue
+            names.add(item['name'])
+            imported += 1
+            cursor = connection.execute(
+                "INSERT INTO habits (name, start_date, periodicity, timezone, day_cutoff) VALUES (?, ?, ?, ?, ?)",
+                (item['name'], item['start_date'], item.get('periodicity', 'daily'), item.get('timezone'),
+                 item.get('day_cutoff', 0))
+            )
+            connection.executemany(
+                "INSERT OR IGNORE INTO completions (habit_id, timestamp) VALUES (?, ?)",
+                ((cursor.lastrowid, format_timestamp(from_timestamp(timestamp)) if isinstance(timestamp, int) else timestamp)
+                 for timestamp in item['log'])
+            )
+    connection.close()
+    return imported, duplicates
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import a JSON habit database into SQLite.")
+    parser.add_argument("json_file", help="JSON database to import")
+    parser.add_argument("sqlite_file", help="SQLite database to create or extend")
+    args = parser.parse_args()
+    count, duplicates = migrate_json(args.json_file, args.sqlite_file)
+    print(f"Imported {count} habits into {args.sqlite_file}.")
+    if duplicates:
+        print(f"Skipped {len(duplicates)} habits already present: {', '.join(duplicates)}.")
@@ -0,0 +1,325 @@
+"""
+This module provides batched streak analytics over the completion logs of habits.
+
+Logs are converted to local day numbers in the habit's timezone and day
+cutoff, see the timezones module, and then to the numbers of the periods they
+complete, as defined by the periodicity strategies of the periodicity module. A run of
+consecutive periods starts wherever the period number does not grow by
+exactly one, and the longest streak is the longest such run.
+
+If NumPy is installed, the logs of all habits are concatenated into one
+array and the runs of every habit are found with a few vectorized passes.
+Otherwise each habit is analyzed with C-level iterator passes: for sorted,
+distinct period numbers p, the value p[i] - i is constant within a run, so
+run lengths are the counts of equal keys.
+"""
+
+from collections import Counter
+from datetime import date
+from itertools import count, repeat
+from operator import floordiv, sub
+from habits_class import CompactLog, format_timestamp, to_timestamp
+from periodicity import DAY_SECONDS, EPOCH_ORDINAL, EPOCH_WEEKDAY, get_periodicity, start_day
+from timezones import local_day_array, local_days
+
+# NumPy is imported on first use, as it takes longer to import than the
+# whole application.
+numpy = None
+_numpy_imported = False
+
+def day_numbers(log, timezone=None, day_cutoff=0):
+    """
+    Converts a completion log into local day numbers.
+
+    Args:
+        log (list): Completion datetimes, or a CompactLog.
+        timezone (str): IANA timezone the log is kept in UTC for, or None.
+        day_cutoff (int): Hour at which a new day starts.
+
+    Returns:
+        list: Days since 1970-01-01 of every entry, in log order.
+    """
+    if timezone is None and not day_cutoff:
+        if isinstance(log, CompactLog):
+            return list(map(floordiv, log.timestamps, repeat(DAY_SECONDS)))
+        return [log_datetime.toordinal() - EPOCH_ORDINAL for log_datetime in log]
+    timestamps = log.timestamps if isinstance(log, CompactLog) else map(to_timestamp, log)
+    return local_days(timestamps, timezone, day_cutoff)
+
+def habit_days(habit):
+    """
+    Converts the completion log of a habit into its local day numbers.
+
+    Args:
+        habit (Habit): Habit to analyze.
+
+    Returns:
+        list: Days since 1970-01-01 of every entry, in log order.
+    """
+    return day_numbers(habit.log, habit.timezone, habit.day_cutoff)
+
+def period_number(day, periodicity, start=0):
+    """
+    Converts a day number into the number of its period.
+
+    Args:
+        day (int): Days since 1970-01-01.
+        periodicity (str): Periodicity spec, e.g. 'daily' or 'weekly'.
+        start (int): Day number of the habit's start date.
+
+    Returns:
+        int: The period number, or None if the day belongs to no period.
+    """
+    return get_periodicity(periodicity).ordinal(day, start)
+
+def period_numbers(log, periodicity, start=0, timezone=None, day_cutoff=0):
+    """
+    Converts a completion log into the sorted, distinct periods it completes.
+
+    A period is completed once it holds the number of distinct completion
+    days its periodicity requires.
+
+    Args:
+        log (list): Completion datetimes in ascending order, or a CompactLog.
+        periodicity (str): Periodicity spec, e.g. 'daily' or 'weekly'.
+        start (int): Day number of the habit's start date.
+        timezone (str): IANA timezone the log is kept in UTC for, or None.
+        day_cutoff (int): Hour at which a new day starts.
+
+    Returns:
+        list: Distinct period numbers in ascending order.
+    """
+    strategy = get_periodicity(periodicity)
+    days = day_numbers(log, timezone, day_cutoff)
+    if strategy.required == 1:
+        return list(dict.fromkeys(strategy.ordinal_list(days, start)))
+    periods = Counter(strategy.ordinal_list(dict.fromkeys(days), start))
+    return [period for period, days in periods.items() if days >= strategy.required]
+
+def habit_periods(habit):
+    """
+    Returns the sorted, distinct periods a habit completed.
+
+    Args:
+        habit (Habit): Habit to analyze.
+
+    Returns:
+        list: Distinct period numbers in ascending order.
+    """
+    return period_numbers(habit.log, habit.periodicity, start_day(habit), habit.timezone, habit.day_cutoff)
+
+def current_streak(habit):
+    """
+    Calculates the run of completed periods that ends with the latest one.
+
+    The log is walked back from the latest entry until the run breaks. The
+    period of the latest entry may still be incomplete, e.g. a week with
+    fewer completion days than required; it then neither counts nor breaks
+    the streak.
+
+    Args:
+        habit (Habit): Habit to analyze.
+
+    Returns:
+        int: Length of the current streak.
+    """
+    strategy = get_periodicity(habit.periodicity)
+    streak, latest, expected = 0, None, None
+    for period, days in _periods_backwards(habit, strategy):
+        if latest is None:
+            latest = period
+        if days >= strategy.required:
+            if period != expected if expected is not None else period < latest - 1:
+                break
+            streak += 1
+            expected = period - 1
+        elif period != latest:
+            break
+    return streak
+
+def _periods_backwards(habit, strategy):
+    """
+    Groups the completion days of a habit by period, latest first.
+
+    Args:
+        habit (Habit): Habit to analyze.
+        strategy (Periodicity): The habit's periodicity.
+
+    Yields:
+        tuple: A period number and its number of distinct completion days.
+    """
+    start = start_day(habit)
+    period, days, last_day = None, 0, None
+    for log_datetime in reversed(habit.log):
+        day = habit.day_number(log_datetime)
+        if day == last_day:
+            continue
+        last_day = day
+        ordinal = strategy.ordinal(day, start)
+        if ordinal is None:
+            continue
+        if ordinal != period:
+            if period is not None:
+                yield period, days
+            period, days = ordinal, 0
+        days += 1
+    if period is not None:
+        yield period, days
+
+def longest_run(periods):
+    """
+    Calculates the longest run of consecutive periods.
+
+    Args:
+        periods (list): Distinct period numbers in ascending order.
+
+    Returns:
+        int: Length of the longest run.
+    """
+    if not periods:
+        return 0
+    return max(Counter(map(sub, periods, count())).values())
+
+def longest_streak(habit):
+    """
+    Calculates the longest streak a habit has ever reached.
+
+    Args:
+        habit (Habit): Habit to analyze.
+
+    Returns:
+        int: Length of the longest run of consecutive periods.
+    """
+    return longest_run(habit_periods(habit))
+
+def summarize(habit):
+    """
+    Computes the summary of a habit from its log.
+
+    Args:
+        habit (Habit): Habit to summarize.
+
+    Returns:
+        dict: The summary, in the format of Habit.summary.
+    """
+    log = habit.log
+    periods = habit_periods(habit)
+    runs = Counter(map(sub, periods, count()))
+    weeks = Counter(map(floordiv, map(EPOCH_WEEKDAY.__add__, habit_days(habit)), repeat(7)))
+    weekly_counts = {}
+    for week, completions in sorted(weeks.items()):
+        year, number, _ = date.fromordinal(week * 7 - EPOCH_WEEKDAY + EPOCH_ORDINAL).isocalendar()
+        weekly_counts[f"{year}-W{number:02d}"] = completions
+    summary = {
+        'total': len(log),
+        'first': format_timestamp(log[0]) if log else None,
+        'last': format_timestamp(log[-1]) if log else None,
+        'current_streak': habit.calculate_streak(),
+        'longest_streak': max(runs.values(), default=0),
+        'current_run': runs[periods[-1] - len(periods) + 1] if periods else 0,
+        'weekly_counts': weekly_counts,
+        'periodicity': habit.periodicity
+    }
+    if habit.timezone is not None:
+        summary['timezone'] = habit.timezone
+    if habit.day_cutoff:
+        summary['day_cutoff'] = habit.day_cutoff
+    return summary
+
+def longest_streaks(habits, vectorized=True):
+    """
+    Calculates the longest streak of every habit.
+
+    Args:
+        habits (iterable): Habit objects to analyze.
+        vectorized (bool): Use NumPy if it is installed.
+
+    Returns:
+        dict: Longest streak by habit name.
+    """
+    if vectorized and _import_numpy() is not None:
+        return _longest_streaks_numpy(list(habits))
+    return {habit.name: longest_streak(habit) for habit in habits}
+
+def _import_numpy():
+    """
+    Imports NumPy if it is installed.
+
+    Returns:
+        module: The numpy module, or None if it is not installed.
+    """
+    global numpy, _numpy_imported
+    if not _numpy_imported:
+        _numpy_imported = True
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+    return numpy
+
+def _day_array(habit):
+    """
+    Converts the completion log of a habit into a NumPy array of day numbers.
+
+    Args:
+        habit (Habit): Habit to analyze.
+
+    Returns:
+        numpy.ndarray: Local days since 1970-01-01 of every entry.
+    """
+    log = habit.log
+    if not log:
+        return numpy.empty(0, dtype=numpy.int64)
+    if habit.timezone is None and not habit.day_cutoff:
+        if isinstance(log, CompactLog):
+            return numpy.frombuffer(log.timestamps, dtype=numpy.int64) // DAY_SECONDS
+        return numpy.fromiter(day_numbers(log), dtype=numpy.int64, count=len(log))
+    if isinstance(log, CompactLog):
+        timestamps = numpy.frombuffer(log.timestamps, dtype=numpy.int64)
+    else:
+        timestamps = numpy.fromiter(map(to_timestamp, log), dtype=numpy.int64, count=len(log))
+    return local_day_array(timestamps, habit.timezone, habit.day_cutoff)
+
+def _longest_streaks_numpy(habits):
+    """
+    Calculates the longest streak of every habit in one vectorized pass.
+
+    Args:
+        habits (list): Habit objects to analyze.
+
+    Returns:
+        dict: Longest streak by habit name.
+    """
+    if not habits:
+        return {}
+    columns = [_day_array(habit) for habit in habits]
+    lengths = numpy.fromiter(map(len, columns), dtype=numpy.int64, count=len(columns))
+    owners = numpy.repeat(numpy.arange(len(habits)), lengths)
+    periods = numpy.concatenate(columns)
+    if not len(periods):
+        return {habit.name: 0 for habit in habits}
+    distinct = numpy.concatenate(([True], (owners[1:] != owners[:-1]) | (numpy.diff(periods) != 0)))
+    owners, periods = owners[distinct], periods[distinct]
+    specs = [habit.periodicity for habit in habits]
+    starts = numpy.fromiter(map(start_day, habits), dtype=numpy.int64, count=len(habits))
+    required = numpy.fromiter((get_periodicity(spec).required for spec in specs), dtype=numpy.int64, count=len(habits))
+    keep = numpy.ones(len(periods), dtype=bool)
+    for spec in set(specs):
+        members = numpy.fromiter((other == spec for other in specs), dtype=bool, count=len(specs))[owners]
+        ordinals, kept = get_periodicity(spec).ordinals(periods[members], starts[owners[members]])
+        periods[members] = ordinals
+        if kept is not None:
+            keep[members] = kept
+    owners, periods = owners[keep], periods[keep]
+    longest = numpy.zeros(len(habits), dtype=numpy.int64)
+    if len(periods):
+        new_period = numpy.concatenate(([True], (owners[1:] != owners[:-1]) | (numpy.diff(periods) != 0)))
+        firsts = numpy.flatnonzero(new_period)
+        completed = numpy.diff(numpy.append(firsts, len(owners))) >= required[owners[firsts]]
+        owners, periods = owners[firsts][completed], periods[firsts][completed]
+    if len(periods):
+        run_start = numpy.concatenate(([True], (owners[1:] != owners[:-1]) | (numpy.diff(periods) != 1)))
+        starts = numpy.flatnonzero(run_start)
+        runs = numpy.diff(numpy.append(starts, len(owners)))
+        numpy.maximum.at(longest, owners[starts], runs)
+    return dict(zip((habit.name for habit in habits), longest.tolist()))
@@ -3,10 +3,36 @@ This module contains the test cases for the Habit Tracking application.
 """
 
 import unittest
+import asyncio
 import json
-from datetime import datetime
-from habits_class import Habit
-from db import Database
+import multiprocessing
+import random
+import time
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+from contextlib import redirect_stderr, redirect_stdout
+from io import StringIO
+from datetime import date, datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+from habits_class import CompactLog, Habit, to_timestamp
+from db import Database, find_habit, open_database, scan_habits
+from sqlite_db import SQLiteDatabase, migrate_json
+from columnar_db import convert
+from server import HabitServer
+from importer import import_events, read_events
+from exporter import export_completions, read_columnar_chunks, streamable
+from parallel_analytics import analyze_parallel
+from benchmark import benchmark_startup, find_regressions, generate_database, generate_habits, run_benchmarks
+import instrumentation
+import main
+from periodicity import canonical_spec
+from sharded_db import ShardedDatabase, split_database
+from streaks import longest_run, longest_streak, longest_streaks, period_numbers
+from timezones import local_day_array, local_days
 
 class TestHabit(unittest.TestCase):
     """
@@ -65,6 +91,302 @@ class TestHabit(unittest.TestCase):
         self.habit_weekly.log_entry(new_log_date)
         self.assertIn(new_log_date, self.habit_weekly.log)
 
+    def test_cached_streak_follows_log_entry(self):
+        """
+        Tests that the cached streak matches a fresh calculation after new and backfilled entries.
+        """
+        for entry in ["2024-07-03 08:00", "2024-07-03 09:00", "2024-07-04 08:00", "2024-06-30 08:00"]:
+            for habit in (self.habit_daily, self.habit_weekly):
+                habit.calculate_streak()
+                habit.log_entry(datetime.strptime(entry, '%Y-%m-%d %H:%M'))
+                fresh = Habit(habit.name, habit.start_date, list(habit.log), habit.periodicity)
+                self.assertEqual(habit.calculate_streak(), fresh.calculate_streak())
+        self.assertEqual(self.habit_daily.calculate_streak(), 5)
+
+    def test_log_entries(self):
+        """
+        Tests merging a batch of entries into the log.
+        """
+        added = self.habit_daily.log_entries([
+            datetime.strptime("2024-07-04 08:00", '%Y-%m-%d %H:%M'),
+            datetime.strptime("2024-06-30 08:00:30", '%Y-%m-%d %H:%M:%S'),
+            datetime.strptime("2024-07-02 08:00", '%Y-%m-%d %H:%M'),
+            datetime.strptime("2024-07-03 08:00", '%Y-%m-%d %H:%M'),
+        ])
+        self.assertEqual(added, 3)
+        self.assertEqual([log_datetime.day for log_datetime in self.habit_daily.log], [30, 1, 2, 3, 4])
+        self.assertEqual(self.habit_daily.calculate_streak(), 5)
+
+    def test_compact_log(self):
+        """
+        Tests that a habit backed by a CompactLog behaves like a list-backed one.
+        """
+        compact = Habit(self.habit_daily.name, self.habit_daily.start_date,
+                        CompactLog(self.habit_daily.log), "daily")
+        entries = ["2024-07-03 08:00", "2024-06-29 08:00", "2024-07-02 08:00"]
+        for entry in entries:
+            compact.log_entry(datetime.strptime(entry, '%Y-%m-%d %H:%M'))
+            self.habit_daily.log_entry(datetime.strptime(entry, '%Y-%m-%d %H:%M'))
+        compact.log_entries([datetime(2024, 6, 30, 8), datetime(2024, 7, 1, 8)])
+        self.habit_daily.log_entries([datetime(2024, 6, 30, 8), datetime(2024, 7, 1, 8)])
+        self.assertIsInstance(compact.log, CompactLog)
+        self.assertEqual(compact.log, self.habit_daily.log)
+        self.assertIn(datetime(2024, 6, 29, 8), compact.log)
+        self.assertEqual(compact.calculate_streak(), self.habit_daily.calculate_streak())
+
+class TestStreaks(unittest.TestCase):
+    """
+    Test cases for the streak analytics.
+    """
+
+    def test_longest_run(self):
+        """
+        Tests finding the longest run of consecutive periods.
+        """
+        self.assertEqual(longest_run([]), 0)
+        self.assertEqual(longest_run([1, 2, 3, 5, 6, 9]), 3)
+        self.assertEqual(longest_run([1, 3, 4, 5, 6]), 4)
+
+    def test_longest_streak_before_current_streak(self):
+        """
+        Tests that the longest streak is found even if it is not the current one.
+        """
+        log = [datetime(2024, 7, day, 8) for day in (1, 2, 3, 4, 10, 11)] + [datetime(2024, 7, 2, 20)]
+        for habit_log in (log, CompactLog(log)):
+            habit = Habit("Streaky", datetime(2024, 7, 1), habit_log, "daily")
+            self.assertEqual(habit.calculate_streak(), 2)
+            self.assertEqual(longest_streak(habit), 4)
+
+    def test_weekly_periods_are_iso_weeks(self):
+        """
+        Tests that weekly habits are grouped by ISO calendar week.
+        """
+        log = [datetime(2024, 7, 1), datetime(2024, 7, 7), datetime(2024, 7, 8), datetime(2024, 7, 22)]
+        periods = period_numbers(log, "weekly")
+        self.assertEqual(len(periods), 3)
+        self.assertEqual(longest_streaks([Habit("Weekly", datetime(2024, 7, 1), log, "weekly")]), {"Weekly": 2})
+
+    def test_vectorized_matches_per_habit(self):
+        """
+        Tests that the batched calculation matches the per-habit one.
+        """
+        habits = [
+            Habit("Empty", datetime(2024, 7, 1), [], "daily"),
+            Habit("Daily", datetime(2024, 7, 1), [datetime(2024, 7, day, hour) for day in (1, 2, 2, 3, 6, 7) for hour in (8, 9)], "daily"),
+            Habit("Weekly", datetime(2024, 7, 1), CompactLog(datetime(2024, 7, day) for day in (1, 3, 8, 15, 29)), "weekly"),
+            Habit("Single", datetime(2024, 7, 1), [datetime(2024, 7, 4)], "daily"),
+        ]
+        expected = {"Empty": 0, "Daily": 3, "Weekly": 3, "Single": 1}
+        self.assertEqual(longest_streaks(habits, vectorized=False), expected)
+        self.assertEqual(longest_streaks(habits), expected)
+        self.assertEqual(longest_streaks(habits[:1]), {"Empty": 0})
+
+class TestPeriodicity(unittest.TestCase):
+    """
+    Test cases for the periodicity strategies.
+    """
+
+    def streaks(self, periodicity, days, start=datetime(2024, 7, 1)):
+        """
+        Returns the current and longest streak of a habit completed on days of July 2024.
+        """
+        habit = Habit("Habit", start, [datetime(2024, 7, 1, 8) + timedelta(days=day - 1) for day in days], periodicity)
+        return habit.calculate_streak(), longest_streak(habit)
+
+    def test_specs(self):
+        """
+        Tests parsing and validating periodicity specs.
+        """
+        self.assertEqual(canonical_spec("weekly:1"), "weekly")
+        self.assertEqual(canonical_spec("every:3"), "every:3")
+        for spec in ("fortnightly", "every", "daily:2", "weekly:0", "weekly:8", "weekly:-1", "every:x"):
+            self.assertRaises(ValueError, canonical_spec, spec)
+        self.assertRaises(ValueError, Habit, "Habit", datetime(2024, 7, 1), [], "fortnightly")
+
+    def test_weekly_uses_calendar_weeks(self):
+        """
+        Tests that a weekly streak breaks on a skipped ISO week, even within seven days.
+        """
+        self.assertEqual(self.streaks("weekly", [7, 15]), (1, 1))
+        self.assertEqual(self.streaks("weekly", [7, 8]), (2, 2))
+
+    def test_monthly(self):
+        """
+        Tests streaks of calendar months.
+        """
+        habit = Habit("Habit", datetime(2024, 1, 1), [datetime(2024, 1, 31), datetime(2024, 2, 1), datetime(2024, 3, 15)],
+                      "monthly")
+        self.assertEqual(habit.calculate_streak(), 3)
+        habit.log_entry(datetime(2024, 5, 1))
+        self.assertEqual((habit.calculate_streak(), longest_streak(habit)), (1, 3))
+
+    def test_weekdays(self):
+        """
+        Tests that weekends neither break nor extend a weekdays streak.
+        """
+        self.assertEqual(self.streaks("weekdays", [5, 8, 9]), (3, 3))
+        self.assertEqual(self.streaks("weekdays", [5, 6, 7, 8]), (2, 2))
+        self.assertEqual(self.streaks("weekdays", [4, 8]), (1, 1))
+
+    def test_every_n_days(self):
+        """
+        Tests periods of N days counted from the start date.
+        """
+        self.assertEqual(self.streaks("every:3", [1, 6, 7]), (3, 3))
+        self.assertEqual(self.streaks("every:3", [1, 6, 7, 13]), (1, 3))
+        self.assertEqual(self.streaks("every:3", [1, 6], start=datetime(2024, 6, 30)), (1, 1))
+
+    def test_times_per_week(self):
+        """
+        Tests that a week needs N distinct days and an incomplete latest week is skipped.
+        """
+        self.assertEqual(self.streaks("weekly:2", [1, 1, 2, 8, 10, 15]), (2, 2))
+        self.assertEqual(self.streaks("weekly:2", [1, 2, 8, 10, 15, 16]), (3, 3))
+        self.assertEqual(self.streaks("weekly:2", [1, 2, 15]), (0, 1))
+
+    def test_engine_is_consistent(self):
+        """
+        Tests that incremental, per-habit and vectorized streaks agree for every periodicity.
+        """
+        rng = random.Random(3)
+        specs = ["daily", "weekly", "weekly:3", "monthly", "weekdays", "every:2", "every:5"]
+        habits = []
+        for index in range(60):
+            spec = specs[index % len(specs)]
+            days = sorted(rng.sample(range(120), rng.randrange(0, 90)))
+            habit = Habit(f"Habit {index}", datetime(2024, 3, 1 + index % 7), [], spec)
+            habit.summary()
+            for day in days:
+                habit.log_entry(datetime(2024, 3, 1, 8) + timedelta(days=day))
+                habit.calculate_streak()
+            fresh = Habit(habit.name, habit.start_date, list(habit.log), spec)
+            self.assertEqual(habit.calculate_streak(), fresh.calculate_streak(), spec)
+            self.assertEqual(habit.summary(), fresh.summary(), spec)
+            habits.append(habit)
+        self.assertEqual(longest_streaks(habits), longest_streaks(habits, vectorized=False))
+
+    def test_specs_are_persisted(self):
+        """
+        Tests that periodicity specs survive a save and load, and that a stored
+        summary of another periodicity is recomputed.
+        """
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            db_file = os.path.join(tmp_dir, "db.json")
+            db = Database(db_file)
+            db.add_habit(Habit("Stretch", datetime(2024, 7, 1), [datetime(2024, 7, day, 8) for day in (1, 4, 7)], "every:3"))
+            for lazy in (False, True):
+                habit = Database(db_file, lazy=lazy).get_habit("Stretch")
+                self.assertEqual((habit.periodicity, habit.summary()['current_streak']), ("every:3", 3))
+            with open(db_file, "r") as file:
+                data = json.load(file)
+            data[0]['periodicity'] = "weekly:2"
+            with open(db_file, "w") as file:
+                json.dump(data, file)
+            for lazy in (False, True):
+                self.assertEqual(Database(db_file, lazy=lazy).get_summary("Stretch")['current_streak'], 1)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+class TestTimezones(unittest.TestCase):
+    """
+    Test cases for per-habit timezones and day cutoffs.
+    """
+
+    def test_day_cutoff(self):
+        """
+        Tests that completions after midnight count for the previous day before the cutoff.
+        """
+        log = [datetime(2024, 7, day, 20, 45) + timedelta(minutes=15 * (day - 1)) for day in range(1, 14)]
+        log += [datetime(2024, 7, 14, 0, 0), datetime(2024, 7, 15, 0, 15)]
+        self.assertEqual(Habit("Reading a Book", datetime(2024, 7, 1), log).calculate_streak(), 15)
+        habit = Habit("Reading a Book", datetime(2024, 7, 1), log, day_cutoff=4)
+        self.assertEqual((habit.calculate_streak(), longest_streak(habit)), (14, 14))
+        habit.log_entry(datetime(2024, 7, 16, 3, 59))
+        self.assertEqual(habit.calculate_streak(), 15)
+        habit.log_entry(datetime(2024, 7, 16, 4, 0))
+        self.assertEqual(habit.calculate_streak(), 16)
+
+    def test_timezone_stores_utc(self):
+        """
+        Tests that logs of habits with a timezone hold UTC and are bucketed into local days.
+        """
+        habit = Habit("Yoga", datetime(2024, 7, 1), [], timezone="America/New_York")
+        habit.log_entry(habit.from_local(datetime(2024, 7, 1, 22, 30, 15)))
+        habit.log_entry(datetime(2024, 7, 2, 8, 0, tzinfo=ZoneInfo("America/New_York")))
+        habit.log_entry(datetime(2024, 7, 4, 3, 0, tzinfo=timezone.utc))
+        self.assertEqual(habit.log[0], datetime(2024, 7, 2, 2, 30, 15))
+        self.assertEqual(habit.calculate_streak(), 3)
+        self.assertEqual(list(habit.summary()['weekly_counts'].values()), [3])
+        self.assertEqual(Habit("Yoga", datetime(2024, 7, 1), list(habit.log)).calculate_streak(), 1)
+        self.assertRaises(ValueError, Habit, "Yoga", datetime(2024, 7, 1), [], timezone="Mars/Olympus")
+        self.assertRaises(ValueError, Habit, "Yoga", datetime(2024, 7, 1), [], day_cutoff=24)
+
+    def test_conversion_matches_astimezone(self):
+        """
+        Tests the cached, vectorized conversion against astimezone across DST changes.
+        """
+        rng = random.Random(5)
+        timestamps = sorted(rng.randrange(1700000000, 1760000000) for _ in range(5000))
+        for name in ("Europe/Berlin", "America/New_York", "Australia/Lord_Howe", "Asia/Kathmandu"):
+            zone = ZoneInfo(name)
+            expected = [(datetime.fromtimestamp(timestamp, zone) - timedelta(hours=3)).date().toordinal()
+                        - date(1970, 1, 1).toordinal() for timestamp in timestamps]
+            self.assertEqual(local_days(timestamps, name, 3), expected, name)
+            self.assertEqual(local_days(reversed(timestamps), name, 3), expected[::-1], name)
+            try:
+                import numpy
+            except ImportError:
+                continue
+            self.assertEqual(local_day_array(numpy.array(timestamps), name, 3).tolist(), expected, name)
+
+    def test_engine_is_consistent(self):
+        """
+        Tests that incremental, per-habit and vectorized streaks agree with timezones and cutoffs.
+        """
+        rng = random.Random(7)
+        habits = []
+        for index, (name, cutoff) in enumerate([("Europe/Berlin", 0), ("Pacific/Auckland", 5), (None, 3)] * 4):
+            spec = ["daily", "weekly:2", "weekdays", "every:2"][index % 4]
+            hours = sorted(rng.sample(range(24 * 200), 150))
+            habit = Habit(f"Habit {index}", datetime(2024, 2, 1), [], spec, timezone=name, day_cutoff=cutoff)
+            habit.summary()
+            for hour in hours:
+                habit.log_entry(datetime(2024, 2, 1) + timedelta(hours=hour))
+                habit.calculate_streak()
+            fresh = Habit(habit.name, habit.start_date, list(habit.log), spec, timezone=name, day_cutoff=cutoff)
+            self.assertEqual(habit.calculate_streak(), fresh.calculate_streak(), spec)
+            self.assertEqual(habit.summary(), fresh.summary(), spec)
+            habits.append(habit)
+        self.assertEqual(longest_streaks(habits), longest_streaks(habits, vectorized=False))
+
+    def test_settings_are_persisted(self):
+        """
+        Tests that timezones and cutoffs survive every storage backend and drive calendar queries.
+        """
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            habit = Habit("Night Owl", datetime(2024, 7, 1), [datetime(2024, 7, 1, 23, 30), datetime(2024, 7, 3, 0, 30)],
+                          timezone="Asia/Tokyo", day_cutoff=2)
+            json_file = os.path.join(tmp_dir, "db.json")
+            db = Database(json_file)
+            db.add_habit(habit)
+            databases = [Database(json_file), Database(json_file, lazy=True), Database(json_file, compact_logs=True)]
+            convert(json_file, os.path.join(tmp_dir, "db.hbt"))
+            databases.append(open_database(os.path.join(tmp_dir, "db.hbt")))
+            migrate_json(json_file, os.path.join(tmp_dir, "habits.sqlite"))
+            databases.append(SQLiteDatabase(os.path.join(tmp_dir, "habits.sqlite")))
+            for db in databases:
+                loaded = db.get_habit("Night Owl")
+                self.assertEqual((loaded.timezone, loaded.day_cutoff), ("Asia/Tokyo", 2))
+                self.assertEqual(loaded.summary()['current_streak'], 2)
+                self.assertEqual([found.name for found in db.get_habits_completed_on(date(2024, 7, 2))], ["Night Owl"])
+                self.assertEqual(db.get_completion_counts(date(2024, 7, 1), date(2024, 7, 3)),
+                                 {date(2024, 7, 1): 0, date(2024, 7, 2): 1, date(2024, 7, 3): 1})
+            databases[-1].connection.close()
+        finally:
+            shutil.rmtree(tmp_dir)
+
 class TestDatabase(unittest.TestCase):
     """
     Test cases for the Database class.
@@ -72,9 +394,11 @@ class TestDatabase(unittest.TestCase):
 
     def setUp(self):
         """
-        Sets up the test cases.
+        Sets up the test cases in a temporary directory.
         """
-        self.db = Database(db_file="test_db.json")
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.tmp_dir, "test_db.json")
+        self.db = Database(db_file=self.db_file)
         self.habit = Habit(
             name="Test Habit",
             start_date=datetime.strptime("2024-07-01", '%Y-%m-%d'),
@@ -87,11 +411,10 @@ class TestDatabase(unittest.TestCase):
         self.db.add_habit(self.habit)
 
     def tearDown(self):
-
-        """Cleans up after the test cases."""
-
-        import os
-        os.remove("test_db.json")
+        """
+        Removes the temporary directory.
+        """
+        shutil.rmtree(self.tmp_dir)
 
     def test_add_habit(self):
         """
@@ -112,6 +435,29 @@ class TestDatabase(unittest.TestCase):
         """
         self.db.delete_habit(self.habit.name)
         self.assertNotIn(self.habit, self.db.get_all_habits())
+        self.assertIsNone(self.db.get_habit(self.habit.name))
+        self.assertNotIn(self.habit, self.db.get_habits_by_periodicity("daily"))
+
+    def test_delete_missing_habit(self):
+        """
+        Tests that deleting an unknown habit writes nothing.
+        """
+        state = os.stat(self.db_file).st_mtime_ns
+        self.db.delete_habit("Missing Habit")
+        self.assertEqual(os.stat(self.db_file).st_mtime_ns, state)
+        journaled = Database(db_file=self.db_file, journal=True)
+        journaled.delete_habit("Missing Habit")
+        self.assertFalse(os.path.exists(journaled.journal_file))
+
+    def test_add_duplicate_habit(self):
+        """
+        Tests that adding a habit with an existing name is rejected.
+        """
+        duplicate = Habit(self.habit.name, datetime(2024, 7, 3), [], "weekly")
+        with self.assertRaises(ValueError):
+            self.db.add_habit(duplicate)
+        self.assertIs(self.db.get_habit(self.habit.name), self.habit)
+        self.assertEqual(self.db.get_habits_by_periodicity("weekly"), [])
 
     def test_get_habits_by_periodicity(self):
         """
@@ -129,8 +475,9 @@ class TestDatabase(unittest.TestCase):
         self.assertEqual(habit_name, "Test Habit")
 
     def test_get_longest_streak_for_habit(self):
-
-    """Tests retrieving the longest streak for a specific habit."""
+        """
+        Tests retrieving the longest streak for a specific habit.
+        """
 
         longest_streak = self.db.get_longest_streak_for_habit(self.habit.name)
         self.assertEqual(longest_streak, 2)
@@ -140,17 +487,1164 @@ class TestDatabase(unittest.TestCase):
         Tests saving the database to a JSON file.
         """
         self.db.save_db()
-        with open("test_db.json", "r") as file:
+        with open(self.db_file, "r") as file:
             data = json.load(file)
             self.assertEqual(len(data), 1)
 
+    def test_load_db_compact(self):
+        """
+        Tests loading the database with compact logs.
+        """
+        new_db = Database(db_file=self.db_file, compact_logs=True)
+        habit = new_db.get_habit(self.habit.name)
+        self.assertIsInstance(habit.log, CompactLog)
+        self.assertEqual(list(habit.log), self.habit.log)
+
+    def test_epoch_timestamp_format(self):
+        """
+        Tests saving logs as epoch integers and detecting the format on load.
+        """
+        epoch_db = Database(db_file=self.db_file, timestamp_format="epoch")
+        epoch_db.save_db()
+        with open(self.db_file, "r") as file:
+            self.assertIsInstance(json.load(file)[0]['log'][0], int)
+        for compact_logs in (False, True):
+            habit = Database(db_file=self.db_file, compact_logs=compact_logs).get_habit(self.habit.name)
+            self.assertEqual(list(habit.log), self.habit.log)
+            self.assertEqual(habit.start_date, self.habit.start_date)
+
+    def test_load_db_lazy(self):
+        """
+        Tests that lazy loading defers parsing each log until it is accessed.
+        """
+        eager_habits = Database(db_file="db.json").get_all_habits()
+        lazy_db = Database(db_file="db.json", lazy=True)
+        lazy_habits = lazy_db.get_all_habits()
+        self.assertFalse(any(habit.log_loaded for habit in lazy_habits))
+        self.assertEqual([habit.name for habit in lazy_habits], [habit.name for habit in eager_habits])
+        self.assertEqual(lazy_habits[0].calculate_streak(), eager_habits[0].calculate_streak())
+        self.assertTrue(lazy_habits[0].log_loaded)
+        self.assertFalse(lazy_habits[1].log_loaded)
+        self.assertEqual(lazy_db.get_habits_by_periodicity("weekly")[0].log,
+                         [habit for habit in eager_habits if habit.periodicity == "weekly"][0].log)
+
+    def test_summaries(self):
+        """
+        Tests that summaries are persisted, updated on log_entry and read
+        without loading the logs of lazy habits.
+        """
+        db = Database(self.db_file)
+        db.log_entry("Test Habit", datetime(2024, 7, 22, 8))
+        summary = db.get_summary("Test Habit")
+        lazy_db = Database(self.db_file, lazy=True)
+        self.assertEqual(lazy_db.get_summaries()["Test Habit"], summary)
+        self.assertFalse(lazy_db.get_habit("Test Habit").log_loaded)
+        reference = Habit("Test Habit", datetime(2024, 7, 1), list(db.get_habit("Test Habit").log)).summary()
+        self.assertEqual(summary, reference)
+        self.assertEqual(summary['last'], "2024-07-22 08:00:00")
+        with open(self.db_file, "r") as file:
+            data = json.load(file)
+        data[0]['log'].append("2024-07-23 08:00:00")
+        with open(self.db_file, "w") as file:
+            json.dump(data, file)
+        self.assertEqual(Database(self.db_file).get_summary("Test Habit")['total'], summary['total'] + 1)
+        lazy_db = Database(self.db_file, lazy=True)
+        self.assertEqual(lazy_db.get_summary("Test Habit")['total'], summary['total'] + 1)
+        lazy_db.add_habit(Habit("Other Habit", datetime(2024, 7, 1), []))
+        with open(self.db_file, "r") as file:
+            self.assertEqual(json.load(file)[0]['summary']['total'], summary['total'] + 1)
+
+    def test_save_reuses_clean_habits(self):
+        """
+        Tests that saving only serializes habits whose log changed.
+        """
+        import db as db_module
+        self.db.add_habit(Habit("Other Habit", datetime(2024, 7, 1), [datetime(2024, 7, 1, 9)], "weekly"))
+        with open(self.db_file, "r") as file:
+            saved = file.read()
+        serialized = []
+        original = db_module.habit_to_dict
+        db_module.habit_to_dict = lambda habit, *args: serialized.append(habit.name) or original(habit, *args)
+        try:
+            lazy_db = Database(self.db_file, lazy=True)
+            lazy_db.save_db()
+            with open(self.db_file, "r") as file:
+                self.assertEqual(file.read(), saved)
+            lazy_db.get_habit("Test Habit").log_entry(datetime(2024, 6, 30, 8))
+            lazy_db.save_db()
+            lazy_db.save_db()
+            self.assertEqual(serialized, ["Test Habit"])
+            Database(self.db_file, lazy=True, timestamp_format="epoch").save_db()
+            self.assertEqual(serialized, ["Test Habit", "Test Habit", "Other Habit"])
+        finally:
+            db_module.habit_to_dict = original
+        with open(self.db_file, "r") as file:
+            data = json.load(file)
+        self.assertEqual(data[0]['log'][0], to_timestamp(datetime(2024, 6, 30, 8)))
+        self.assertEqual(data[0]['summary']['total'], 3)
+
+    def test_scan_habits(self):
+        """
+        Tests scanning habit headers and log positions without parsing the logs.
+        """
+        text = '[{"name": "A \\"quoted\\" habit", "log": [], "periodicity": "weekly"},{"log":[1, 2],"name":"B"}]'
+        scanned = list(scan_habits(text))
+        self.assertEqual(scanned[0][0], {"name": 'A "quoted" habit', "periodicity": "weekly"})
+        start, end = scanned[1][1]
+        self.assertEqual(json.loads(text[start:end]), [1, 2])
+        self.assertEqual(list(scan_habits(" [ ] ")), [])
+
     def test_load_db(self):
         """
         Tests loading the database from a JSON file.
         """
         self.db.save_db()
-        new_db = Database(db_file="test_db.json")
+        new_db = Database(db_file=self.db_file)
         self.assertEqual(len(new_db.get_all_habits()), 1)
 
+class TestCompletionIndex(unittest.TestCase):
+    """
+    Test cases for the calendar range queries backed by the completion index.
+    """
+
+    def setUp(self):
+        """
+        Copies the sample database into a temporary directory.
+        """
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.tmp_dir, "db.json")
+        shutil.copy("db.json", self.db_file)
+
+    def tearDown(self):
+        """
+        Removes the temporary directory.
+        """
+        shutil.rmtree(self.tmp_dir)
+
+    def completed_on(self, db, day):
+        """
+        Returns the names of the habits completed on a day by scanning every log.
+        """
+        return sorted(habit.name for habit in db.get_all_habits()
+                      if any(log_datetime.date() == day for log_datetime in habit.log))
+
+    def test_queries_match_scan(self):
+        """
+        Tests day, week, range and count queries against a full scan.
+        """
+        db = Database(self.db_file)
+        for day in range(1, 32):
+            expected = self.completed_on(db, date(2024, 7, day))
+            self.assertEqual([habit.name for habit in db.get_habits_completed_on(date(2024, 7, day))], expected)
+        counts = db.get_completion_counts(date(2024, 7, 1), date(2024, 7, 31))
+        self.assertEqual(len(counts), 31)
+        self.assertEqual(counts[date(2024, 7, 15)], len(self.completed_on(db, date(2024, 7, 15))))
+        week = {habit.name for habit in db.get_habits_completed_in_week(2024, 29)}
+        self.assertEqual(week, {habit.name for habit in db.get_habits_completed_between(date(2024, 7, 15),
+                                                                                         date(2024, 7, 21))})
+        self.assertEqual(len(db.get_habits_completed_between(date(2024, 7, 1), date(2024, 7, 31))),
+                         len(db.get_all_habits()))
+
+    def test_index_follows_mutations(self):
+        """
+        Tests that logging, adding and deleting habits update a built index.
+        """
+        db = Database(self.db_file)
+        day = date(2024, 8, 5)
+        self.assertEqual(db.get_habits_completed_on(day), [])
+        db.log_entry("Family Call", datetime(2024, 8, 5, 18))
+        db.add_habit(Habit("Stretch", datetime(2024, 8, 1), [datetime(2024, 8, 5, 7)]))
+        self.assertEqual([habit.name for habit in db.get_habits_completed_on(day)], ["Family Call", "Stretch"])
+        db.delete_habit("Stretch")
+        self.assertEqual([habit.name for habit in db.get_habits_completed_in_week(2024, 32)], ["Family Call"])
+
+    def test_sqlite_matches_json(self):
+        """
+        Tests that the SQLite backend answers the same range queries.
+        """
+        sqlite_file = os.path.join(self.tmp_dir, "db.sqlite")
+        migrate_json(self.db_file, sqlite_file)
+        db, sqlite = Database(self.db_file), SQLiteDatabase(sqlite_file)
+        start, end = date(2024, 7, 10), date(2024, 7, 24)
+        self.assertEqual(db.get_completion_counts(start, end), sqlite.get_completion_counts(start, end))
+        self.assertEqual([habit.name for habit in db.get_habits_completed_in_week(2024, 29)],
+                         [habit.name for habit in sqlite.get_habits_completed_in_week(2024, 29)])
+        sqlite.connection.close()
+
+class TestJournal(unittest.TestCase):
+    """
+    Test cases for the journaled storage mode of the Database class.
+    """
+
+    def setUp(self):
+        """
+        Sets up a journaled database in a temporary directory.
+        """
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.tmp_dir, "db.json")
+        self.db = Database(db_file=self.db_file, journal=True)
+        self.db.add_habit(Habit(
+            name="Journal Habit",
+            start_date=datetime.strptime("2024-07-01", '%Y-%m-%d'),
+            log=[],
+            periodicity="daily"
+        ))
+        self.db.log_entry("Journal Habit", datetime.strptime("2024-07-01 08:00", '%Y-%m-%d %H:%M'))
+
+    def tearDown(self):
+        """
+        Removes the temporary directory.
+        """
+        shutil.rmtree(self.tmp_dir)
+
+    def test_mutations_append_to_journal(self):
+        """
+        Tests that mutations are journaled instead of rewriting the snapshot.
+        """
+        self.assertFalse(os.path.exists(self.db_file))
+        with open(self.db.journal_file, "r") as file:
+            self.assertEqual(len(file.readlines()), 2)
+
+    def test_load_replays_journal(self):
+        """
+        Tests that loading replays the journal over the snapshot.
+        """
+        self.db.log_entry("Journal Habit", datetime.strptime("2024-07-02 08:00", '%Y-%m-%d %H:%M'))
+        self.db.delete_habit("Journal Habit")
+        self.db.add_habit(Habit("Other Habit", datetime(2024, 7, 1), [], "weekly"))
+        new_db = Database(db_file=self.db_file)
+        self.assertEqual([habit.name for habit in new_db.get_all_habits()], ["Other Habit"])
+
+    def test_compact(self):
+        """
+        Tests that compaction folds the journal into the JSON file.
+        """
+        self.db.compact().join()
+        self.assertFalse(os.path.exists(self.db.journal_file))
+        with open(self.db_file, "r") as file:
+            data = json.load(file)
+        self.assertEqual(data[0]['log'], ["2024-07-01 08:00:00"])
+
+    def test_habit_names(self):
+        """
+        Tests that a database opened for some habits only loads and journals those.
+        """
+        self.db.add_habit(Habit("Other Habit", datetime(2024, 7, 1), [], "weekly"))
+        self.db.compact(background=False)
+        partial = Database(self.db_file, journal=True, habit_names=["Journal Habit", "Missing"])
+        self.assertEqual([habit.name for habit in partial.get_all_habits()], ["Journal Habit"])
+        self.assertEqual(partial.get_summary("Journal Habit")['total'], 1)
+        partial.log_entry("Journal Habit", datetime(2024, 7, 2, 8))
+        self.assertRaises(ValueError, partial.save_db)
+        self.assertRaises(ValueError, Database, self.db_file, habit_names=["Journal Habit"])
+        partial.compact(background=False)
+        self.assertFalse(os.path.exists(partial.journal_file))
+        full = Database(self.db_file, journal=True)
+        self.assertEqual(len(full.get_all_habits()), 2)
+        self.assertEqual(full.get_summary("Journal Habit")['current_streak'], 2)
+
+    def test_compacts_past_threshold(self):
+        """
+        Tests that flushing compacts the journal once it outgrows compact_after.
+        """
+        db = Database(self.db_file, journal=True, compact_after=400)
+        for day in range(2, 6):
+            db.log_entry("Journal Habit", datetime(2024, 7, day, 8))
+            self.assertLess(os.path.getsize(db.journal_file) if os.path.exists(db.journal_file) else 0, 600)
+        db.close()
+        self.assertTrue(os.path.exists(self.db_file))
+        self.assertLess(os.path.getsize(db.journal_file), 400)
+        self.assertEqual(len(Database(self.db_file).get_habit("Journal Habit").log), 5)
+
+    def test_habit_names_in_other_key_order(self):
+        """
+        Tests that habits not starting with their name key are still found.
+        """
+        with open(self.db_file, "w") as file:
+            json.dump([{"log": ["2024-07-01 08:00:00"], "periodicity": "daily", "start_date": "2024-07-01 00:00:00",
+                        "name": "Reordered"}], file)
+        partial = Database(self.db_file, journal=True, habit_names=["Reordered", "Missing"])
+        self.assertEqual(partial.get_habit("Reordered").log, [datetime(2024, 7, 1, 8)])
+        self.assertEqual([habit.name for habit in partial.get_all_habits()], ["Reordered"])
+
+    def test_find_missing_habit(self):
+        """
+        Tests that a name missing from a file written by this module is not found.
+        """
+        self.db.compact(background=False)
+        with open(self.db_file, "rb") as file:
+            data = file.read()
+        self.assertIsNone(find_habit(data, "Missing"))
+        self.assertIsNone(find_habit(data, "Journal"))
+        self.assertEqual(find_habit(data, "Journal Habit")[0]['name'], "Journal Habit")
+
+class TestDeferredFlush(unittest.TestCase):
+    """
+    Test cases for batching and deferred flushing of Database mutations.
+    """
+
+    def setUp(self):
+        """
+        Sets up a temporary directory and counts snapshot writes.
+        """
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.tmp_dir, "db.json")
+
+    def tearDown(self):
+        """
+        Removes the temporary directory.
+        """
+        shutil.rmtree(self.tmp_dir)
+
+    def count_writes(self, db):
+        """
+        Replaces the snapshot writer of a database with a counting wrapper.
+        """
+        writes = []
+        write_snapshot = db._write_snapshot
+        db._write_snapshot = lambda habits: writes.append(1) or write_snapshot(habits)
+        return writes
+
+    def add_and_log(self, db):
+        """
+        Adds a habit and logs three entries for it.
+        """
+        db.add_habit(Habit("Batched Habit", datetime(2024, 7, 1), [], "daily"))
+        for day in (1, 2, 3):
+            db.log_entry("Batched Habit", datetime(2024, 7, day, 8))
+
+    def test_batch_writes_once(self):
+        """
+        Tests that a batch writes the snapshot once at the end of the block.
+        """
+        db = Database(db_file=self.db_file)
+        writes = self.count_writes(db)
+        with db.batch():
+            self.add_and_log(db)
+            self.assertEqual(writes, [])
+        self.assertEqual(writes, [1])
+        self.assertEqual(len(Database(db_file=self.db_file).get_habit("Batched Habit").log), 3)
+
+    def test_batch_journal(self):
+        """
+        Tests that a journaled batch appends all events in one flush.
+        """
+        db = Database(db_file=self.db_file, journal=True)
+        with db.batch():
+            self.add_and_log(db)
+            self.assertFalse(os.path.exists(db.journal_file))
+        with open(db.journal_file, "r") as file:
+            self.assertEqual(len(file.readlines()), 4)
+
+    def test_flush_every(self):
+        """
+        Tests flushing after a fixed number of mutations and on close.
+        """
+        with Database(db_file=self.db_file, flush_every=3) as db:
+            writes = self.count_writes(db)
+            self.add_and_log(db)
+            self.assertEqual(writes, [1])
+        self.assertEqual(writes, [1, 1])
+
+    def test_flush_interval(self):
+        """
+        Tests that the background thread flushes deferred mutations.
+        """
+        db = Database(db_file=self.db_file, flush_every=None, flush_interval=0.01)
+        self.add_and_log(db)
+        deadline = time.time() + 5
+        while db._pending and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(db._pending, [])
+        db.close()
+        self.assertEqual(len(Database(db_file=self.db_file).get_habit("Batched Habit").log), 3)
+
+    def test_flush_interval_waits_for_batch(self):
+        """
+        Tests that the background thread does not flush in the middle of a batch.
+        """
+        db = Database(db_file=self.db_file, flush_every=None, flush_interval=0.01)
+        db.add_habit(Habit("Batched Habit", datetime(2024, 7, 1), [], "daily"))
+        db.flush()
+        with db.batch():
+            db.log_entry("Batched Habit", datetime(2024, 7, 1, 8))
+            time.sleep(0.1)
+            self.assertEqual(Database(db_file=self.db_file).get_habit("Batched Habit").log, [])
+        self.assertEqual(len(Database(db_file=self.db_file).get_habit("Batched Habit").log), 1)
+        db.close()
+
+def log_in_process(db_file, journal, day):
+    """
+    Opens a database in a separate process and logs one entry per hour of a day.
+    """
+    db = Database(db_file=db_file, journal=journal)
+    for hour in range(10):
+        db.log_entry("Shared Habit", datetime(2024, 7, day, hour))
+
+class TestConcurrentWriters(unittest.TestCase):
+    """
+    Test cases for several Database instances writing to the same file.
+    """
+
+    def setUp(self):
+        """
+        Sets up a database with one habit in a temporary directory.
+        """
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.tmp_dir, "db.json")
+        Database(db_file=self.db_file).add_habit(Habit("Shared Habit", datetime(2024, 7, 1), [], "daily"))
+
+    def tearDown(self):
+        """
+        Removes the temporary directory.
+        """
+        shutil.rmtree(self.tmp_dir)
+
+    def test_stale_instance_merges_on_save(self):
+        """
+        Tests that saving from an outdated instance keeps the other instance's changes.
+        """
+        first = Database(db_file=self.db_file)
+        second = Database(db_file=self.db_file)
+        first.add_habit(Habit("First Habit", datetime(2024, 7, 1), [], "daily"))
+        second.log_entry("Shared Habit", datetime(2024, 7, 1, 8))
+        second.add_habit(Habit("Second Habit", datetime(2024, 7, 1), [], "weekly"))
+        reloaded = Database(db_file=self.db_file)
+        self.assertEqual(sorted(habit.name for habit in reloaded.get_all_habits()),
+                         ["First Habit", "Second Habit", "Shared Habit"])
+        self.assertEqual(len(reloaded.get_habit("Shared Habit").log), 1)
+
+    def test_lock_file_created_on_first_write(self):
+        """
+        Tests that opening a database to read it does not create the lock file.
+        """
+        os.remove(self.db_file + ".lock")
+        db = Database(db_file=self.db_file, lazy=True)
+        self.assertEqual(len(db.get_all_habits()), 1)
+        self.assertFalse(os.path.exists(self.db_file + ".lock"))
+        db.log_entry("Shared Habit", datetime(2024, 7, 1, 8))
+        self.assertTrue(os.path.exists(self.db_file + ".lock"))
+
+    def test_concurrent_processes(self):
+        """
+        Tests that no check-in is lost when several processes write at once.
+        """
+        for journal in (False, True):
+            Database(db_file=self.db_file).save_db()
+            processes = [multiprocessing.Process(target=log_in_process, args=(self.db_file, journal, day))
+                         for day in (1, 2, 3)]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+            self.assertEqual(len(Database(db_file=self.db_file).get_habit("Shared Habit").log), 30)
+            db = Database(db_file=self.db_file)
+            db.habits = [Habit("Shared Habit", datetime(2024, 7, 1), [], "daily")]
+            db.save_db()
+
+class TestShardedDatabase(unittest.TestCase):
+    """
+    Test cases for the sharded database.
+    """
+
+    def setUp(self):
+        """
+        Splits the sample database into shards in a temporary directory.
+        """
+        self.tmp_dir = tempfile.mkdtemp()
+        self.count = split_database("db.json", self.tmp_dir, shard_count=4)
+
+    def tearDown(self):
+        """
+        Removes the temporary directory.
+        """
+        shutil.rmtree(self.tmp_dir)
+
+    def test_split_and_queries(self):
+        """
+        Tests that sharded queries return the same habits as the original database.
+        """
+        original = Database("db.json")
+        sharded = open_database(self.tmp_dir)
+        self.assertEqual(sharded.shard_count, 4)
+        self.assertEqual(len(sharded.get_all_habits()), self.count)
+        self.assertEqual({habit.name for habit in sharded.get_habits_by_periodicity("weekly")},
+                         {habit.name for habit in original.get_habits_by_periodicity("weekly")})
+        self.assertEqual(sharded.get_longest_streak_all_habits(), original.get_longest_streak_all_habits())
+        self.assertEqual(sharded.get_summaries(), original.get_summaries())
+        with self.assertRaises(ValueError):
+            ShardedDatabase(self.tmp_dir, shard_count=8)
+
+    def test_lazy_loading_and_dirty_shards(self):
+        """
+        Tests that only touched shards are loaded and only dirty shards are rewritten.
+        """
+        sharded = ShardedDatabase(self.tmp_dir, max_loaded_shards=1)
+        index = sharded.shard_index("Morning Yoga")
+        states = {i: os.stat(sharded.shard_file(i)).st_mtime_ns
+                  for i in range(4) if os.path.exists(sharded.shard_file(i))}
+        sharded.log_entry("Morning Yoga", datetime(2024, 7, 22, 7))
+        self.assertEqual(sharded.loaded_shards(), [index])
+        sharded.get_all_habits()
+        self.assertEqual(len(sharded.loaded_shards()), 1)
+        for i, mtime in states.items():
+            changed = os.stat(sharded.shard_file(i)).st_mtime_ns != mtime
+            self.assertEqual(changed, i == index)
+        self.assertEqual(ShardedDatabase(self.tmp_dir).get_habit("Morning Yoga").log[-1], datetime(2024, 7, 22, 7))
+
+    def test_no_eviction_during_batch(self):
+        """
+        Tests that shards touched in a batch are neither evicted nor written before it ends.
+        """
+        sharded = ShardedDatabase(self.tmp_dir, max_loaded_shards=1)
+        names = {}
+        for habit in Database("db.json").get_all_habits():
+            names.setdefault(sharded.shard_index(habit.name), habit.name)
+        first, second = list(names.values())[:2]
+        first_file = sharded.shard_file(sharded.shard_index(first))
+        state = os.stat(first_file).st_mtime_ns
+        with sharded.batch():
+            habit = sharded.log_entry(first, datetime(2024, 7, 22, 7))
+            sharded.log_entry(second, datetime(2024, 7, 22, 7))
+            self.assertEqual(len(sharded.loaded_shards()), 2)
+            self.assertEqual(os.stat(first_file).st_mtime_ns, state)
+            self.assertIs(sharded.get_habit(first), habit)
+        self.assertEqual(len(sharded.loaded_shards()), 1)
+        reopened = ShardedDatabase(self.tmp_dir)
+        self.assertEqual([reopened.get_habit(name).log[-1] for name in (first, second)], [datetime(2024, 7, 22, 7)] * 2)
+
+    def test_dirty_shards_are_not_evicted(self):
+        """
+        Tests that a shard with unflushed mutations stays loaded.
+        """
+        sharded = ShardedDatabase(self.tmp_dir, max_loaded_shards=1, flush_every=None)
+        index = sharded.shard_index("Morning Yoga")
+        sharded.log_entry("Morning Yoga", datetime(2024, 7, 22, 7))
+        sharded.get_all_habits()
+        self.assertIn(index, sharded.loaded_shards())
+        sharded.close()
+        self.assertEqual(ShardedDatabase(self.tmp_dir).get_habit("Morning Yoga").log[-1], datetime(2024, 7, 22, 7))
+
+class TestSQLiteDatabase(unittest.TestCase):
+    """
+    Test cases for the SQLiteDatabase class.
+    """
+
+    def setUp(self):
+        """
+        Sets up a SQLite database in a temporary directory.
+        """
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.tmp_dir, "habits.sqlite")
+        self.db = open_database(self.db_file)
+        self.db.add_habit(Habit(
+            name="SQL Habit",
+            start_date=datetime.strptime("2024-07-01", '%Y-%m-%d'),
+            log=[datetime.strptime("2024-07-01 08:00", '%Y-%m-%d %H:%M')],
+            periodicity="daily"
+        ))
+
+    def tearDown(self):
+        """
+        Closes the database and removes the temporary directory.
+        """
+        self.db.connection.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_log_entry_persists(self):
+        """
+        Tests that logged entries are visible after reopening the database.
+        """
+        self.assertIsInstance(self.db, SQLiteDatabase)
+        self.db.log_entry("SQL Habit", datetime.strptime("2024-07-02 08:00", '%Y-%m-%d %H:%M'))
+        new_db = SQLiteDatabase(self.db_file)
+        self.assertEqual(new_db.get_habit("SQL Habit").calculate_streak(), 2)
+        self.assertEqual(len(new_db.get_habits_by_periodicity("daily")), 1)
+        new_db.connection.close()
+
+    def test_add_duplicate_habit(self):
+        """
+        Tests that habit names are unique.
+        """
+        with self.assertRaises(ValueError):
+            self.db.add_habit(Habit("SQL Habit", datetime(2024, 7, 1), [], "weekly"))
+
+    def test_delete_habit(self):
+        """
+        Tests deleting a habit from the database.
+        """
+        self.db.delete_habit("SQL Habit")
+        self.assertIsNone(self.db.get_habit("SQL Habit"))
+        self.assertEqual(self.db.get_all_habits(), [])
+
+    def test_flush_every(self):
+        """
+        Tests that grouped mutations are committed by flush without rewriting loaded logs.
+        """
+        db = SQLiteDatabase(os.path.join(self.tmp_dir, "grouped.sqlite"), flush_every=None)
+        db.add_habit(Habit("Grouped Habit", datetime(2024, 7, 1), [datetime(2024, 7, 1, 8)]))
+        db.log_entry("Grouped Habit", datetime(2024, 7, 2, 8))
+        other = sqlite3.connect(db.db_file)
+        self.assertEqual(other.execute("SELECT COUNT(*) FROM completions").fetchone(), (0,))
+        statements = []
+        db.connection.set_trace_callback(statements.append)
+        db.flush()
+        self.assertEqual(statements, ["COMMIT"])
+        self.assertEqual(other.execute("SELECT COUNT(*) FROM completions").fetchone(), (2,))
+        other.close()
+        db.connection.close()
+
+    def test_migrate_json(self):
+        """
+        Tests importing a JSON database into SQLite.
+        """
+        sqlite_file = os.path.join(self.tmp_dir, "migrated.sqlite")
+        names = [habit.name for habit in Database("db.json").get_all_habits()]
+        self.assertEqual(migrate_json("db.json", sqlite_file), (len(names), []))
+        self.assertEqual(migrate_json("db.json", sqlite_file), (0, names))
+        migrated = SQLiteDatabase(sqlite_file)
+        self.assertEqual(len(migrated.get_habit("Morning Yoga").log), 15)
+        self.assertEqual(len(migrated.get_all_habits()), len(names))
+        migrated.connection.close()
+
+    def test_migrate_duplicate_names(self):
+        """
+        Tests that a habit repeated in the JSON file is imported once and reported.
+        """
+        json_file = os.path.join(self.tmp_dir, "duplicates.json")
+        with open("db.json", "r") as file:
+            data = json.load(file)
+        with open(json_file, "w") as file:
+            json.dump(data + data[:1], file)
+        sqlite_file = os.path.join(self.tmp_dir, "duplicates.sqlite")
+        self.assertEqual(migrate_json(json_file, sqlite_file), (len(data), [data[0]['name']]))
+
+class TestColumnarDatabase(unittest.TestCase):
+    """
+    Test cases for the binary columnar database format.
+    """
+
+    def setUp(self):
+        """
+        Converts the sample database into a temporary columnar file.
+        """
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.tmp_dir, "db.hbt")
+        self.count = convert("db.json", self.db_file)
+
+    def tearDown(self):
+        """
+        Removes the temporary directory.
+        """
+        shutil.rmtree(self.tmp_dir)
+
+    def test_round_trip(self):
+        """
+        Tests converting JSON to columnar and back without changing the data.
+        """
+        json_file = os.path.join(self.tmp_dir, "db.json")
+        self.assertEqual(convert(self.db_file, json_file), self.count)
+        with open("db.json", "r") as original, open(json_file, "r") as converted:
+            converted = json.load(converted)
+            self.assertEqual(json.load(original), [{key: value for key, value in item.items() if key != 'summary'}
+                                                   for item in converted])
+        self.assertEqual(converted[0]['summary'], Database("db.json").get_habit(converted[0]['name']).summary())
+
+    def test_load_and_save(self):
+        """
+        Tests loading a columnar file in every mode and saving a change to it.
+        """
+        expected = Database("db.json").get_habit("Family Call")
+        for options in ({}, {'lazy': True}, {'compact_logs': True}):
+            habit = Database(self.db_file, **options).get_habit("Family Call")
+            self.assertEqual(list(habit.log), expected.log)
+            self.assertEqual(habit.calculate_streak(), expected.calculate_streak())
+        db = Database(self.db_file, compact_logs=True)
+        db.log_entry("Family Call", datetime(2024, 7, 22, 18))
+        reloaded = Database(self.db_file, compact_logs=True).get_habit("Family Call")
+        self.assertEqual(reloaded.log[-1], datetime(2024, 7, 22, 18))
+        self.assertEqual(len(reloaded.log), len(expected.log) + 1)
+
+class TestParallelAnalytics(unittest.TestCase):
+    """
+    Test cases for the process-parallel analytics report.
+    """
+
+    def test_report(self):
+        """
+        Tests the per-habit statistics and that worker processes agree with
+        the in-process computation.
+        """
+        habits = Database("db.json").get_all_habits()
+        gappy = Habit("Gappy", datetime(2024, 7, 1), [datetime(2024, 7, day) for day in (1, 2, 5, 6, 7, 10)])
+        habits.append(gappy)
+        report = analyze_parallel(habits, workers=1, as_of=datetime(2024, 7, 10))
+        self.assertEqual(report, analyze_parallel(habits, workers=2, as_of=datetime(2024, 7, 10)))
+        stats = report['habits']["Gappy"]
+        self.assertEqual((stats['current_streak'], stats['longest_streak']), (1, 3))
+        self.assertEqual((stats['gaps'], stats['longest_gap']), (2, 2))
+        self.assertAlmostEqual(stats['completion_rate'], 0.6)
+        for habit in habits:
+            self.assertEqual(report['habits'][habit.name]['current_streak'], habit.calculate_streak())
+        self.assertEqual(report['total_completions'], sum(len(habit.log) for habit in habits))
+
+class TestInstrumentation(unittest.TestCase):
+    """
+    Test cases for the opt-in instrumentation.
+    """
+
+    def setUp(self):
+        """
+        Copies the sample database into a temporary directory.
+        """
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.tmp_dir, "db.json")
+        shutil.copy("db.json", self.db_file)
+
+    def tearDown(self):
+        """
+        Removes the instrumentation and the temporary directory.
+        """
+        instrumentation.disable()
+        instrumentation.reset()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_records_calls_and_bytes(self):
+        """
+        Tests that wrapped methods record calls, latencies and file sizes.
+        """
+        original = Habit.calculate_streak
+        instrumentation.enable(None)
+        db = Database(self.db_file)
+        db.get_habit("Morning Yoga").calculate_streak()
+        db.log_entry("Morning Yoga", datetime(2024, 7, 22, 7))
+        stats = instrumentation.snapshot()
+        self.assertEqual(stats['Database.load_db']['bytes_read'], os.path.getsize("db.json"))
+        self.assertEqual(stats['Database.save_db']['bytes_written'], os.path.getsize(self.db_file))
+        self.assertEqual(stats['Database.log_entry']['calls'], 1)
+        self.assertEqual(sum(stats['Habit.calculate_streak']['histogram'].values()),
+                         stats['Habit.calculate_streak']['calls'])
+        self.assertIn("Database.get_habit", instrumentation.summary())
+        instrumentation.disable()
+        self.assertIs(Habit.calculate_streak, original)
+
+    def test_covers_every_query(self):
+        """
+        Tests that the summary and calendar queries of every backend are counted.
+        """
+        instrumentation.enable(None)
+        db = Database(self.db_file)
+        db.get_summary("Morning Yoga")
+        db.get_completion_counts(date(2024, 7, 1), date(2024, 7, 7))
+        sharded = ShardedDatabase(os.path.join(self.tmp_dir, "shards"))
+        sharded.get_summaries()
+        stats = instrumentation.snapshot()
+        for name in ("Database.get_summary", "Database.get_completion_counts", "ShardedDatabase.get_summaries"):
+            self.assertEqual(stats[name]['calls'], 1)
+        for cls in (Database, SQLiteDatabase, ShardedDatabase):
+            self.assertIn("get_habits_completed_in_week", instrumentation.INSTRUMENTED[cls])
+
+class TestBenchmark(unittest.TestCase):
+    """
+    Test cases for the benchmark harness.
+    """
+
+    def test_generate_habits(self):
+        """
+        Tests that generated habits follow the requested mix and are reproducible.
+        """
+        habits = generate_habits(50, days=70, density=1.0, weekly_share=0.5, seed=1)
+        again = generate_habits(50, days=70, density=1.0, weekly_share=0.5, seed=1)
+        self.assertEqual([habit.log for habit in habits], [habit.log for habit in again])
+        for habit in habits:
+            self.assertEqual(len(habit.log), 10 if habit.periodicity == "weekly" else 70)
+        self.assertIn("weekly", {habit.periodicity for habit in habits})
+
+    def test_run_benchmarks_and_regressions(self):
+        """
+        Tests a small benchmark run and the regression check against it.
+        """
+        report = run_benchmarks([5], repeat=1, days=14)
+        self.assertEqual(set(report['results']['5']), {'load_db', 'save_db', 'get_habit', 'log_entry',
+                                                       'calculate_streak', 'get_longest_streak_all_habits'})
+        self.assertEqual(find_regressions(report, report, 0.2), [])
+        faster = {'results': {'5': {operation: seconds / 2 for operation, seconds in report['results']['5'].items()}}}
+        self.assertEqual(len(find_regressions(report, faster, 0.2)), 6)
+
+    def test_benchmark_startup(self):
+        """
+        Tests timing cold starts of the command line tool.
+        """
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            db_file = os.path.join(tmp_dir, "bench.json")
+            generate_database(db_file, 5, days=14)
+            timings = benchmark_startup(db_file, repeat=1)
+        finally:
+            shutil.rmtree(tmp_dir)
+        self.assertEqual(set(timings), {'startup_interpreter', 'startup_imports', 'startup_streak',
+                                        'startup_log', 'full_json_parse'})
+        self.assertTrue(all(seconds > 0 for seconds in timings.values()))
+
+class TestImporter(unittest.TestCase):
+    """
+    Test cases for the bulk CSV/JSONL importer.
+    """
+
+    def setUp(self):
+        """
+        Copies the sample database into a temporary directory.
+        """
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.tmp_dir, "db.json")
+        shutil.copy("db.json", self.db_file)
+
+    def tearDown(self):
+        """
+        Removes the temporary directory.
+        """
+        shutil.rmtree(self.tmp_dir)
+
+    def test_import_csv(self):
+        """
+        Tests merging CSV events into existing habits in small chunks.
+        """
+        csv_file = os.path.join(self.tmp_dir, "events.csv")
+        with open(csv_file, "w") as file:
+            file.write("habit,timestamp\n")
+            for day in range(22, 30):
+                file.write(f"Morning Yoga,2024-07-{day} 07:00:00\n")
+            file.write("Morning Yoga,2024-07-01 06:30:00\nUnknown,2024-07-01 06:30:00\n")
+        db = Database(self.db_file, flush_every=None)
+        before = len(db.get_habit("Morning Yoga").log)
+        stats = import_events(db, read_events(csv_file), chunk_size=3)
+        self.assertEqual((stats['rows'], stats['imported'], stats['skipped']), (10, 8, 1))
+        habit = Database(self.db_file).get_habit("Morning Yoga")
+        self.assertEqual(len(habit.log), before + 8)
+        self.assertEqual(habit.log, sorted(habit.log))
+
+    def test_csv_blank_and_malformed_rows(self):
+        """
+        Tests that blank CSV lines are skipped and malformed rows name their line.
+        """
+        csv_file = os.path.join(self.tmp_dir, "events.csv")
+        with open(csv_file, "w") as file:
+            file.write("\nhabit,timestamp\nMorning Yoga,2024-07-22 07:00:00\n\n,\nMorning Yoga,2024-07-23 07:00:00\n")
+        self.assertEqual(len(list(read_events(csv_file))), 2)
+        for row in ("Morning Yoga", "Morning Yoga,yesterday"):
+            with open(csv_file, "w") as file:
+                file.write(f"Morning Yoga,2024-07-22 07:00:00\n\n{row}\n")
+            with self.assertRaisesRegex(ValueError, "line 3"):
+                list(read_events(csv_file))
+
+    def test_import_jsonl_creates_habits(self):
+        """
+        Tests importing JSONL events with epoch timestamps into new habits.
+        """
+        jsonl_file = os.path.join(self.tmp_dir, "events.jsonl")
+        with open(jsonl_file, "w") as file:
+            file.write(json.dumps({"habit": "Stretch", "timestamp": 1721635200}) + "\n")
+            file.write(json.dumps({"habit": "Stretch", "timestamp": "2024-07-21 09:15:00"}) + "\n")
+        db = Database(self.db_file, compact_logs=True, journal=True, flush_every=None)
+        stats = import_events(db, read_events(jsonl_file), create_missing=True)
+        self.assertEqual(stats['imported'], 2)
+        habit = Database(self.db_file, journal=True).get_habit("Stretch")
+        self.assertEqual(habit.start_date, datetime(2024, 7, 21))
+        self.assertEqual(habit.log, [datetime(2024, 7, 21, 9, 15), datetime(2024, 7, 22, 8)])
+
+    def test_import_memory_is_bounded_by_chunks(self):
+        """
+        Tests that pending events never hold more than one chunk of completions,
+        and that a snapshot import still merges with another writer.
+        """
+        for journal in (False, True):
+            shutil.copy("db.json", self.db_file)
+            db = Database(self.db_file, journal=journal, flush_every=None)
+            held = []
+
+            def events():
+                for index in range(40):
+                    held.append(sum(len(event.get('timestamps') or ()) for event in db._pending))
+                    if index == 20:
+                        Database(self.db_file).log_entry("Family Call", datetime(2024, 8, 1, 18))
+                    yield "Morning Yoga", datetime(2024, 8, 1, 7) + timedelta(days=index)
+            stats = import_events(db, events(), chunk_size=5)
+            self.assertEqual(stats['imported'], 40)
+            self.assertLessEqual(max(held), 5)
+            reloaded = Database(self.db_file, journal=journal)
+            self.assertIn(datetime(2024, 9, 9, 7), reloaded.get_habit("Morning Yoga").log)
+            self.assertIn(datetime(2024, 8, 1, 18), reloaded.get_habit("Family Call").log)
+
+class TestExporter(unittest.TestCase):
+    """
+    Test cases for the streaming CSV/JSONL/columnar exporter.
+    """
+
+    def setUp(self):
+        """
+        Copies the sample database into a temporary directory.
+        """
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.tmp_dir, "db.json")
+        shutil.copy("db.json", self.db_file)
+
+    def tearDown(self):
+        """
+        Removes the temporary directory.
+        """
+        shutil.rmtree(self.tmp_dir)
+
+    def test_export_round_trips_through_importer(self):
+        """
+        Tests that CSV and JSONL exports are read back as the same events.
+        """
+        db = Database(self.db_file)
+        db.add_habit(Habit("Night, Owl", datetime(2024, 7, 1), [datetime(2024, 7, 1, 23, 30)], timezone="Asia/Tokyo"))
+        expected = [(habit.name, log_datetime) for habit in db.get_all_habits() for log_datetime in habit.log]
+        for name in ("events.csv", "events.jsonl"):
+            output_file = os.path.join(self.tmp_dir, name)
+            stats = export_completions(Database(self.db_file, lazy=True), output_file, chunk_size=4)
+            self.assertEqual(stats['rows'], len(expected))
+            events = [(habit, log_datetime.replace(tzinfo=None)) for habit, log_datetime in read_events(output_file)]
+            self.assertEqual(events, expected)
+
+    def test_filters(self):
+        """
+        Tests filtering by periodicity and by local days, honouring the day cutoff.
+        """
+        db = Database(self.db_file)
+        db.add_habit(Habit("Late Reading", datetime(2024, 7, 1), [datetime(2024, 7, 14, 0, 30), datetime(2024, 7, 14, 9)],
+                           day_cutoff=4))
+        output_file = os.path.join(self.tmp_dir, "events.csv")
+        export_completions(db, output_file, periodicity="weekly")
+        self.assertEqual({name for name, _ in read_events(output_file)}, {"Family Call", "House Cleaning"})
+        export_completions(db, output_file, start=date(2024, 7, 14), end=date(2024, 7, 14))
+        events = [(name, format(log_datetime, "%d %H:%M")) for name, log_datetime in read_events(output_file)]
+        self.assertIn(("Reading a Book", "14 00:00"), events)
+        self.assertIn(("Late Reading", "14 09:00"), events)
+        self.assertNotIn(("Late Reading", "14 00:30"), events)
+        self.assertEqual(len(events), 5)
+
+    def test_columnar_chunks(self):
+        """
+        Tests that columnar chunks are bounded, complete, and leave lazy logs unloaded.
+        """
+        db = Database(self.db_file, lazy=True, compact_logs=True)
+        output_file = os.path.join(self.tmp_dir, "events.hbx")
+        stats = export_completions(db, output_file, chunk_size=5)
+        self.assertFalse(any(habit.log_loaded for habit in db.get_all_habits()))
+        with open(output_file, "rb") as file:
+            chunks = list(read_columnar_chunks(file))
+        self.assertTrue(all(0 < len(column) <= 5 for _, column in chunks))
+        self.assertEqual(sum(len(column) for _, column in chunks), stats['rows'])
+        for habit in Database(self.db_file, compact_logs=True).get_all_habits():
+            columns = [column for metadata, column in chunks if metadata['habit'] == habit.name]
+            self.assertEqual([timestamp for column in columns for timestamp in column], list(habit.log.timestamps))
+
+    def test_streams_json_snapshot(self):
+        """
+        Tests that a JSON snapshot exported from a memory map matches the Database export.
+        """
+        for timestamp_format in ("text", "epoch"):
+            db = Database(self.db_file, timestamp_format=timestamp_format)
+            db.add_habit(Habit(f"Caf\u00e9, \"{timestamp_format}\"", datetime(2024, 7, 1), [datetime(2024, 7, 14, 0, 30), datetime(2024, 7, 14, 9)],
+                               day_cutoff=4))
+            self.assertTrue(streamable(self.db_file))
+            for options in ({}, {'periodicity': "weekly"}, {'start': date(2024, 7, 14), 'end': date(2024, 7, 20)}):
+                expected, streamed = (os.path.join(self.tmp_dir, name) for name in ("expected.hbx", "streamed.hbx"))
+                stats = export_completions(Database(self.db_file), expected, **options)
+                streamed_stats = export_completions(self.db_file, streamed, chunk_size=3, **options)
+                self.assertEqual((streamed_stats['habits'], streamed_stats['rows']), (stats['habits'], stats['rows']))
+                columns = {}
+                with open(streamed, "rb") as file:
+                    for metadata, column in read_columnar_chunks(file):
+                        self.assertTrue(0 < len(column) <= 3)
+                        columns.setdefault(metadata['habit'], []).extend(column)
+                with open(expected, "rb") as file:
+                    self.assertEqual(columns, {metadata['habit']: list(column) for metadata, column in read_columnar_chunks(file)})
+        Database(self.db_file, journal=True).log_entry("Reading a Book", datetime(2024, 8, 1))
+        self.assertFalse(streamable(self.db_file))
+
+class TestCommandLine(unittest.TestCase):
+    """
+    Test cases for the non-interactive subcommands of main.py.
+    """
+
+    def setUp(self):
+        """
+        Copies the sample database into a temporary directory.
+        """
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.tmp_dir, "db.json")
+        shutil.copy("db.json", self.db_file)
+
+    def tearDown(self):
+        """
+        Removes the temporary directory.
+        """
+        shutil.rmtree(self.tmp_dir)
+
+    def run_main(self, *args):
+        """
+        Runs main.py with arguments and returns its exit status and output.
+        """
+        output = StringIO()
+        with redirect_stdout(output), redirect_stderr(output):
+            status = main.run(["--db", self.db_file, *args])
+        return status, output.getvalue()
+
+    def test_log_and_streak(self):
+        """
+        Tests logging an entry and reading the streak from the stored summary.
+        """
+        status, output = self.run_main("streak", "Morning Yoga")
+        self.assertEqual(status, 0)
+        self.assertIn("Current streak: 15", output)
+        self.assertEqual(self.run_main("log", "Morning Yoga", "2024-07-16")[0], 0)
+        self.assertTrue(os.path.exists(self.db_file + ".journal"))
+        self.assertIn("Current streak: 16", self.run_main("streak", "Morning Yoga")[1])
+        self.assertEqual(len(Database(self.db_file, journal=True).get_habit("Morning Yoga").log), 16)
+        self.assertEqual(self.run_main("compact")[0], 0)
+        self.assertFalse(os.path.exists(self.db_file + ".journal"))
+        self.assertEqual(len(Database(self.db_file).get_habit("Morning Yoga").log), 16)
+
+    def test_journal_stays_bounded(self):
+        """
+        Tests that a subcommand compacts a journal grown past the limit.
+        """
+        line = json.dumps({'op': "log", 'name': "Morning Yoga", 'timestamp': "2024-07-16 08:00:00"}) + "\n"
+        with open(self.db_file + ".journal", "w") as file:
+            file.write(line * (main.JOURNAL_LIMIT // len(line) + 1))
+        self.assertIn("Current streak: 16", self.run_main("streak", "Morning Yoga")[1])
+        self.assertFalse(os.path.exists(self.db_file + ".journal"))
+        self.assertEqual(len(Database(self.db_file).get_habit("Morning Yoga").log), 16)
+
+    def test_unknown_habit(self):
+        """
+        Tests that commands on an unknown habit fail with status 1.
+        """
+        self.assertEqual(self.run_main("log", "Unknown", "2024-07-16")[0], 1)
+        self.assertEqual(self.run_main("streak", "Unknown")[0], 1)
+
+    def test_list(self):
+        """
+        Tests listing habits by periodicity.
+        """
+        status, output = self.run_main("list", "--periodicity", "weekly")
+        self.assertEqual(status, 0)
+        self.assertEqual(len(output.splitlines()), len(Database(self.db_file).get_habits_by_periodicity("weekly")))
+
+    def test_subcommands_skip_heavy_imports(self):
+        """
+        Tests that a subcommand imports neither the prompt library nor numpy.
+        """
+        code = (f"import sys, main; main.run(['--db', {self.db_file!r}, 'streak', 'Morning Yoga']); "
+                "print(sorted({'questionary', 'prompt_toolkit', 'numpy'} & set(sys.modules)))")
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+        self.assertEqual(output.splitlines()[-1], "[]")
+
+async def http_request(port, method, path, body=None):
+    """
+    Sends one HTTP request to a local server and returns the decoded reply.
+    """
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    data = json.dumps(body).encode("utf-8") if body is not None else b""
+    writer.write(f"{method} {path} HTTP/1.1\r\nContent-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode() + data)
+    status = int((await reader.readline()).split()[1])
+    headers, payload = (await reader.read()).split(b"\r\n\r\n", 1)
+    writer.close()
+    return status, json.loads(payload)
+
+class TestHabitServer(unittest.TestCase):
+    """
+    Test cases for the HTTP/JSON habit service.
+    """
+
+    def setUp(self):
+        """
+        Copies the sample database into a temporary directory.
+        """
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.tmp_dir, "db.json")
+        shutil.copy("db.json", self.db_file)
+
+    def tearDown(self):
+        """
+        Removes the temporary directory.
+        """
+        shutil.rmtree(self.tmp_dir)
+
+    def run_server(self, scenario, db=None):
+        """
+        Runs a scenario against a server listening on a free port.
+        """
+        async def run():
+            server = HabitServer(db or Database(self.db_file, flush_every=None))
+            listener = await server.start(port=0)
+            try:
+                await scenario(listener.sockets[0].getsockname()[1])
+            finally:
+                listener.close()
+                await listener.wait_closed()
+                await server.stop()
+        asyncio.run(run())
+
+    def test_endpoints(self):
+        """
+        Tests adding, logging, querying and deleting a habit over HTTP.
+        """
+        async def scenario(port):
+            habit = {"name": "Stretch", "start_date": "2024-07-01 00:00:00", "periodicity": "daily"}
+            self.assertEqual(await http_request(port, "POST", "/habits", habit), (201, {"name": "Stretch"}))
+            self.assertEqual((await http_request(port, "POST", "/habits", habit))[0], 409)
+            for day in (20, 21):
+                status, reply = await http_request(port, "POST", "/habits/Stretch/log",
+                                                   {"timestamp": f"2024-07-{day} 08:00:00"})
+                self.assertEqual(status, 200)
+            status, reply = await http_request(port, "GET", "/habits/Stretch/streak")
+            self.assertEqual(reply["longest_streak"], 2)
+            status, reply = await http_request(port, "GET", "/habits?periodicity=weekly")
+            self.assertNotIn("Stretch", [item["name"] for item in reply])
+            self.assertEqual(len(Database(self.db_file).get_habit("Stretch").log), 2)
+            self.assertEqual((await http_request(port, "DELETE", "/habits/Stretch"))[0], 200)
+            self.assertEqual((await http_request(port, "GET", "/habits/Stretch/streak"))[0], 404)
+        self.run_server(scenario)
+
+    def test_sqlite_backend(self):
+        """
+        Tests that a SQLite database can be flushed from the server's executor thread.
+        """
+        sqlite_file = os.path.join(self.tmp_dir, "habits.sqlite")
+        migrate_json(self.db_file, sqlite_file)
+        db = open_database(sqlite_file, flush_every=None)
+
+        async def scenario(port):
+            habit = {"name": "Stretch", "start_date": "2024-07-01 00:00:00"}
+            self.assertEqual(await http_request(port, "POST", "/habits", habit), (201, {"name": "Stretch"}))
+            status, reply = await http_request(port, "POST", "/habits/Stretch/log", {"timestamp": "2024-07-20 08:00:00"})
+            self.assertEqual((status, reply["streak"]), (200, 1))
+            self.assertEqual((await http_request(port, "DELETE", "/habits/Morning%20Yoga"))[0], 200)
+        self.run_server(scenario, db)
+        db.connection.close()
+        reopened = SQLiteDatabase(sqlite_file)
+        self.assertEqual(len(reopened.get_habit("Stretch").log), 1)
+        self.assertIsNone(reopened.get_habit("Morning Yoga"))
+        reopened.connection.close()
+
+    def test_concurrent_logs_share_flushes(self):
+        """
+        Tests that concurrent check-ins are serialized and all persisted.
+        """
+        async def scenario(port):
+            replies = await asyncio.gather(*(
+                http_request(port, "POST", "/habits/Morning Yoga/log".replace(" ", "%20"),
+                             {"timestamp": f"2024-08-{day:02d} 07:00:00"})
+                for day in range(1, 21)
+            ))
+            self.assertTrue(all(status == 200 for status, _ in replies))
+        self.run_server(scenario)
+        habit = Database(self.db_file).get_habit("Morning Yoga")
+        self.assertEqual(sum(log_datetime.month == 8 for log_datetime in habit.log), 20)
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,231 @@
+"""
+This module converts completion timestamps into local day numbers.
+
+A habit may have an IANA timezone, in which case its log holds naive UTC
+datetimes, and a day cutoff hour, before which completions still count for
+the previous day. Instead of calling astimezone for every entry, the UTC
+offset changes of a timezone are found once per year and cached, so a
+timestamp is converted with a binary search over a few transitions, a sorted
+log with one linear pass and a NumPy array with numpy.searchsorted.
+"""
+
+from bisect import bisect_right
+from datetime import datetime, timedelta, timezone as dt_timezone
+from functools import lru_cache
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+DAY_SECONDS = 86400
+HOUR_SECONDS = 3600
+UTC_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+class ZoneOffsets:
+    """
+    The UTC offsets of a timezone as a table of transitions.
+
+    The table covers whole years and grows on demand to the years of the
+    timestamps looked up.
+    """
+
+    def __init__(self, name):
+        """
+        Initializes the table of a timezone.
+
+        Args:
+            name (str): IANA timezone name, e.g. 'Europe/Berlin'.
+
+        Raises:
+            ValueError: If the timezone is unknown.
+        """
+        try:
+            self.zone = ZoneInfo(name)
+        except (ZoneInfoNotFoundError, ValueError):
+            raise ValueError(f"Unknown timezone '{name}'.") from None
+        self.name = name
+        self.years = None
+        self._table = (0, 0, [], [])
+        self._arrays = None
+
+    def _utcoffset(self, timestamp):
+        """
+        Returns the UTC offset in seconds at a timestamp, via zoneinfo.
+        """
+        return int((UTC_EPOCH + timedelta(seconds=timestamp)).astimezone(self.zone).utcoffset().total_seconds())
+
+    def _cover(self, timestamp):
+        """
+        Extends the table to the year of a timestamp.
+
+        Every day of the new years is probed, and where the offset changed
+        between two days the transition second is found by bisection.
+        """
+        year = (UTC_EPOCH + timedelta(seconds=timestamp)).year
+        first, last = self.years or (year, year)
+        first, last = min(first, year), max(last, year)
+        low = int((datetime(first, 1, 1, tzinfo=dt_timezone.utc) - UTC_EPOCH).total_seconds())
+        high = int((datetime(last + 1, 1, 1, tzinfo=dt_timezone.utc) - UTC_EPOCH).total_seconds())
+        starts, offsets = [low], [self._utcoffset(low)]
+        for probe in range(low + DAY_SECONDS, high + DAY_SECONDS, DAY_SECONDS):
+            offset = self._utcoffset(probe)
+            if offset != offsets[-1]:
+                before, after = probe - DAY_SECONDS, probe
+                while after - before > 1:
+                    middle = (before + after) // 2
+                    if self._utcoffset(middle) == offset:
+                        after = middle
+                    else:
+                        before = middle
+                starts.append(after)
+                offsets.append(offset)
+        self.years = (first, last)
+        self._table = (low, high, starts, offsets)
+        self._arrays = None
+
+    def segment(self, timestamp):
+        """
+        Returns the span of constant UTC offset around a timestamp.
+
+        Args:
+            timestamp (int): UTC epoch seconds.
+
+        Returns:
+            tuple: The first and one past the last timestamp of the span, and
+            its UTC offset in seconds.
+        """
+        low, high, starts, offsets = self._table
+        if not low <= timestamp < high:
+            self._cover(timestamp)
+            low, high, starts, offsets = self._table
+        index = bisect_right(starts, timestamp) - 1
+        end = starts[index + 1] if index + 1 < len(starts) else high
+        return starts[index], end, offsets[index]
+
+    def offset_array(self, timestamps):
+        """
+        Returns the UTC offsets of a NumPy array of timestamps.
+
+        Args:
+            timestamps (numpy.ndarray): UTC epoch seconds, not empty.
+
+        Returns:
+            numpy.ndarray: UTC offsets in seconds.
+        """
+        import numpy
+        for timestamp in (int(timestamps.min()), int(timestamps.max())):
+            if not self._table[0] <= timestamp < self._table[1]:
+                self._cover(timestamp)
+        if self._arrays is None:
+            _, _, starts, offsets = self._table
+            self._arrays = numpy.array(starts, dtype=numpy.int64), numpy.array(offsets, dtype=numpy.int64)
+        starts, offsets = self._arrays
+        return offsets[numpy.searchsorted(starts, timestamps, side='right') - 1]
+
+@lru_cache(maxsize=None)
+def zone_offsets(name):
+    """
+    Returns the shared offset table of a timezone.
+
+    Args:
+        name (str): IANA timezone name.
+
+    Returns:
+        ZoneOffsets: The table.
+
+    Raises:
+        ValueError: If the timezone is unknown.
+    """
+    return ZoneOffsets(name)
+
+def check_timezone(name):
+    """
+    Validates a timezone name.
+
+    Args:
+        name (str): IANA timezone name, or None for naive local time.
+
+    Returns:
+        str: The name.
+
+    Raises:
+        ValueError: If the timezone is unknown.
+    """
+    if name is not None:
+        zone_offsets(name)
+    return name
+
+def check_day_cutoff(day_cutoff):
+    """
+    Validates a day cutoff.
+
+    Args:
+        day_cutoff (int): Hour from 0 to 23 at which a new day starts.
+
+    Returns:
+        int: The cutoff.
+
+    Raises:
+        ValueError: If the cutoff is not an hour of the day.
+    """
+    if not isinstance(day_cutoff, int) or not 0 <= day_cutoff < 24:
+        raise ValueError(f"Invalid day cutoff '{day_cutoff}'. Use an hour from 0 to 23.")
+    return day_cutoff
+
+def local_day(timestamp, timezone=None, day_cutoff=0):
+    """
+    Converts a timestamp into the number of its local day.
+
+    Args:
+        timestamp (int): Epoch seconds; UTC if a timezone is given, otherwise
+            local wall-clock time.
+        timezone (str): IANA timezone name, or None.
+        day_cutoff (int): Hour at which a new day starts.
+
+    Returns:
+        int: Days since 1970-01-01 in local time.
+    """
+    if timezone is not None:
+        timestamp += zone_offsets(timezone).segment(timestamp)[2]
+    return (timestamp - day_cutoff * HOUR_SECONDS) // DAY_SECONDS
+
+def local_days(timestamps, timezone=None, day_cutoff=0):
+    """
+    Converts timestamps into the numbers of their local days.
+
+    The offset span of the previous timestamp is reused while the next one
+    falls into it, so a sorted log is converted in one linear pass.
+
+    Args:
+        timestamps (iterable): Epoch seconds, as for local_day.
+        timezone (str): IANA timezone name, or None.
+        day_cutoff (int): Hour at which a new day starts.
+
+    Returns:
+        list: Local day numbers, in input order.
+    """
+    shift = day_cutoff * HOUR_SECONDS
+    if timezone is None:
+        return [(timestamp - shift) // DAY_SECONDS for timestamp in timestamps]
+    zone = zone_offsets(timezone)
+    days = []
+    start = end = delta = 0
+    for timestamp in timestamps:
+        if not start <= timestamp < end:
+            start, end, offset = zone.segment(timestamp)
+            delta = offset - shift
+        days.append((timestamp + delta) // DAY_SECONDS)
+    return days
+
+def local_day_array(timestamps, timezone=None, day_cutoff=0):
+    """
+    Converts a NumPy array of timestamps into local day numbers.
+
+    Args:
+        timestamps (numpy.ndarray): Epoch seconds, as for local_day.
+        timezone (str): IANA timezone name, or None.
+        day_cutoff (int): Hour at which a new day starts.
+
+    Returns:
+        numpy.ndarray: Local day numbers.
+    """
+    if timezone is not None and len(timestamps):
+        timestamps = timestamps + zone_offsets(timezone).offset_array(timestamps)
+    return (timestamps - day_cutoff * HOUR_SECONDS) // DAY_SECONDS